@@ -48,11 +48,15 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # does nothing unless PROFILING is on
+    'parasitologyTool.profiling.ProfilingMiddleware',
+    'parasitologyTool.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'parasitologyTool.middleware.UserProfileMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -138,5 +142,104 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 MEDIA_ROOT = MEDIA_DIR
 MEDIA_URL = '/media/'
+# uploads are stored once per distinct content, see parasitologyTool.storage
+DEFAULT_FILE_STORAGE = 'parasitologyTool.storage.ContentAddressedStorage'
+# uploads are served by parasitologyTool.media; set to 'x-accel-redirect' (nginx) or 'x-sendfile'
+# to have the front-end server send the bytes
+MEDIA_SERVE_MODE = None
 
-CRISPY_TEMPLATE_PACK = 'bootstrap4'
\ No newline at end of file
+CRISPY_TEMPLATE_PACK = 'bootstrap4'
+
+# Cache
+# 'locmem' keeps a cache in each process; 'file' and 'redis' (which needs the django-redis package)
+# are shared by every process, so invalidations reach all of them, see parasitologyTool.page_cache
+
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'locmem')
+CACHES = {
+    'default': {
+        'locmem': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+        'file': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ.get('CACHE_LOCATION', os.path.join(BASE_DIR, 'cache')),
+        },
+        'redis': {
+            'BACKEND': 'django_redis.cache.RedisCache',
+            'LOCATION': os.environ.get('CACHE_LOCATION', 'redis://127.0.0.1:6379/1'),
+        },
+    }[CACHE_BACKEND],
+}
+# anonymous responses of the public pages, and fragments such as the parasite list
+PAGE_CACHE_SECONDS = 60
+FRAGMENT_CACHE_SECONDS = 60 * 60
+# rows behind the detail pages, see parasitologyTool.objcache; LOCAL_SIZE objects are also kept in each process
+OBJECT_CACHE_SECONDS = 60 * 60
+OBJECT_CACHE_LOCAL_SIZE = 1000
+
+# Startup budget checked by `manage.py startup_profile`
+
+STARTUP_PROFILE_BUDGET = {
+    'setup_seconds': 2.0,
+    'setup_rss_mb': 100,
+    'module_seconds': 0.5,
+    'module_rss_mb': 20,
+    'forbidden_modules': ['sympy', 'numpy', 'pandas'],
+}
+
+# Per-request SQL and template timing, Server-Timing headers and a JSON log line per request, see
+# parasitologyTool.profiling. PROFILING_SAMPLER is 'stacks' or 'cprofile' to also save where the
+# time went in requests slower than PROFILING_SLOW_MS.
+
+PROFILING = os.environ.get('PROFILING') == '1'
+PROFILING_SAMPLER = os.environ.get('PROFILING_SAMPLER') or None
+PROFILING_SLOW_MS = 500
+PROFILING_SAMPLE_INTERVAL_MS = 5
+PROFILING_DIR = os.path.join(BASE_DIR, 'profiles')
+
+# Metrics served at /metrics, see parasitologyTool.metrics. Set METRICS_DIR to a directory of its own
+# when running several worker processes, so that /metrics adds them all up. Scrapers authenticate with
+# METRICS_TOKEN; METRICS_ALLOWED_IPS is no use behind a reverse proxy, where every request comes from it.
+
+METRICS_DIR = os.environ.get('METRICS_DIR') or None
+METRICS_FLUSH_SECONDS = 5
+METRICS_ACTIVE_SECONDS = 5 * 60
+METRICS_ALLOWED_IPS = []
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN') or None
+
+# Async like, dislike and reply endpoints, see parasitologyTool.async_views. asgi.py turns them on;
+# their ORM calls run in a pool of ASYNC_ORM_THREADS threads in each worker.
+
+ASYNC_VIEWS = os.environ.get('ASYNC_VIEWS') == '1'
+ASYNC_ORM_THREADS = 8
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'parasitologyTool.profiling': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+    },
+}
+
+# How far over benchmark_baseline.json `manage.py benchmark` lets a route go, as a fraction of the baseline
+BENCHMARK_TOLERANCE = {
+    'seconds': 0.5,
+    'queries': 0,
+    'rows': 0.1,
+    'bytes': 0.1,
+}
+
+# Background jobs (thumbnails, attachment checks, removing unused blobs), run by `manage.py run_workers`
+
+JOB_WORKERS = 2
+JOB_MAX_ATTEMPTS = 3
+# how long an unreferenced upload is kept before it is removed, see parasitologyTool.storage
+BLOB_DELETE_GRACE_SECONDS = 60 * 60
+
+# Limits on attachments uploaded with a post, see parasitologyTool.uploads
+
+UPLOAD_MAX_FILE_BYTES = 50 * 1024 * 1024
+UPLOAD_MAX_REQUEST_BYTES = 200 * 1024 * 1024
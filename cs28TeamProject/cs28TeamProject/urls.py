@@ -15,10 +15,9 @@ Including another URLconf
 """
 from django.conf.urls import url, include
 from django.contrib import admin
-from parasitologyTool import views
+from parasitologyTool import media, metrics, views
 from django.conf import settings
-from django.conf.urls.static import static
-from django.urls import path
+from django.urls import path, re_path
 
 
 
@@ -26,6 +25,8 @@ urlpatterns = [
     path('', views.index, name='index'),
     path('parasitologyTool/', include('parasitologyTool.urls')),
     path('admin/', admin.site.urls),
-]+ static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    path('metrics', metrics.view, name='metrics'),
+    re_path(r'^%s(?P<path>.+)$' % settings.MEDIA_URL.lstrip('/'), media.serve, name='media'),
+]
 
 
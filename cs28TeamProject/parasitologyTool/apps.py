@@ -4,3 +4,14 @@ from django.apps import AppConfig
 class ParasitologytoolConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'parasitologyTool'
+
+    def ready(self):
+        from parasitologyTool import attachments, objcache, page_cache, permissions, ranking, reactions, search, thumbnails
+        permissions.connect_signals()
+        reactions.connect_signals()
+        ranking.connect_signals()
+        search.connect_signals()
+        thumbnails.connect_signals()
+        attachments.connect_signals()
+        page_cache.connect_signals()
+        objcache.connect_signals()
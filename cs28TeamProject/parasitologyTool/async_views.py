@@ -0,0 +1,122 @@
+"""
+Async versions of the like, dislike and reply endpoints, the requests we get
+the most of.
+
+Under WSGI, and under ASGI for a sync view, each of these requests holds a
+thread while it waits on the database. These views wait on the event loop
+instead and hand only their ORM calls to a pool of ASYNC_ORM_THREADS
+threads (run_orm()), so one ASGI worker can have many more of them in
+flight than it has threads, and opens at most that many connections to
+the database.
+
+The URLs use them when ASYNC_VIEWS is set, which cs28TeamProject/asgi.py
+does; under WSGI they would only add an event loop to every request.
+They answer as views.AddLike, AddDislike and CommentReplyView do, except
+that replying, like reacting, needs a login.
+
+For a request to stay on the event loop all the way through, every
+middleware has to be async capable (see middleware.SyncAndAsyncMiddleware).
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.views import redirect_to_login
+from django.db import close_old_connections
+from django.http import HttpResponseNotAllowed, JsonResponse
+
+from . import metrics, permissions, reactions
+from .forms import ReplyForm
+from .middleware import get_profile, installed_sql_wrappers
+from .models import Comment
+
+ORM_THREADS = getattr(settings, 'ASYNC_ORM_THREADS', 8)
+
+_executor = ThreadPoolExecutor(max_workers=ORM_THREADS, thread_name_prefix='orm')
+
+
+def _in_orm_thread(func, args, kwargs):
+    # these threads don't see request_started and request_finished, which close connections
+    # that broke or are past CONN_MAX_AGE in request threads, so do it here
+    close_old_connections()
+    try:
+        with installed_sql_wrappers():
+            return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+async def run_orm(func, *args, **kwargs):
+    """Calls func(*args, **kwargs), which may use the ORM, in the ORM thread pool."""
+    return await sync_to_async(_in_orm_thread, thread_sensitive=False, executor=_executor)(func, args, kwargs)
+
+
+def _load_user(request):
+    user = request.user
+    if not user.is_authenticated:
+        return False
+    # now, as MetricsMiddleware can't look it up in an async request
+    permissions.user_role(user)
+    return True
+
+
+async def _check(request):
+    """The response to send instead, if the request isn't a POST by a logged in user."""
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    # request.user comes from the session, which may need the database
+    if not await run_orm(_load_user, request):
+        return redirect_to_login(request.get_full_path())
+    return None
+
+
+async def _react(request, post_model, post_id, reaction, kind, message):
+    refused = await _check(request)
+    if refused is not None:
+        return refused
+    model = reactions.post_model(post_model)
+    try:
+        likes, dislikes, added = await run_orm(reactions.toggle, model, post_id, request.user, reaction)
+    except model.DoesNotExist:
+        return JsonResponse({'message': "Post not found."}, status=404)
+    if added:
+        metrics.INTERACTIONS.inc(kind=kind)
+    return JsonResponse({'message': message, 'likes': likes, 'dislikes': dislikes})
+
+
+async def add_like(request, post_model, post_id):
+    return await _react(request, post_model, post_id, 'likes', 'like', "Successfully liked post.")
+
+
+async def add_dislike(request, post_model, post_id):
+    return await _react(request, post_model, post_id, 'dislikes', 'dislike', "Successfully disliked post.")
+
+
+def _save_reply(request, comment_id):
+    parent_comment = Comment.objects.get(id=comment_id)
+    form = ReplyForm(request.POST)
+    if not form.is_valid():
+        return None
+    reply = form.save(commit=False)
+    reply.parent_comment = parent_comment
+    reply.user = get_profile(request)
+    reply.save()
+    return reply
+
+
+async def comment_reply(request, post_id, comment_id):
+    refused = await _check(request)
+    if refused is not None:
+        return refused
+    if request.POST.get('reply_text', '').strip() == "":
+        return JsonResponse({'message': 'empty string'})
+    try:
+        reply = await run_orm(_save_reply, request, comment_id)
+    except Comment.DoesNotExist:
+        return JsonResponse({'message': "Comment not found."}, status=404)
+    if reply is None:
+        return JsonResponse({'message': 'failed'})
+    metrics.INTERACTIONS.inc(kind='reply')
+    return JsonResponse({'reply_text': request.POST['reply_text'], 'comment_id': comment_id,
+                         'username': reply.user.username if reply.user else ''})
@@ -0,0 +1,109 @@
+"""
+Pictures and files attached to clinical and research posts.
+
+create_all() adds a post's uploads with one INSERT per table and queues a
+single background job (see jobs.py) to process them: thumbnails for the
+pictures, and a check of each file against its extension, so a ".pdf"
+that isn't a PDF is marked failed. Attachments created one at a time
+(e.g. in the admin) are processed by jobs queued from signals instead.
+"""
+
+import posixpath
+
+from django.db import transaction
+from django.db.models.signals import post_save
+
+from . import jobs, objcache, thumbnails
+from .models import ClinicalImage, Post, ResearchFile, ResearchImage
+
+# what the first bytes of a file with each extension must be
+SIGNATURES = {
+    '.pdf': b'%PDF-',
+    '.png': b'\x89PNG\r\n\x1a\n',
+    '.jpg': b'\xff\xd8\xff',
+    '.jpeg': b'\xff\xd8\xff',
+    '.zip': b'PK\x03\x04',
+}
+
+# post model: the attachment models that point at it, with the name of their foreign key
+ATTACHMENT_MODELS = {
+    'parasitologyTool.Post': [(ClinicalImage, 'clinical_post')],
+    'parasitologyTool.ResearchPost': [(ResearchImage, 'research_post'), (ResearchFile, 'research_post')],
+}
+
+
+def create_all(post, images=(), files=()):
+    """Attaches the uploaded images, and for research posts files, to the post."""
+    if isinstance(post, Post):
+        image_model, post_field = ClinicalImage, 'clinical_post'
+    else:
+        image_model, post_field = ResearchImage, 'research_post'
+
+    with transaction.atomic():
+        # bulk_create still saves each file to storage, but sends no post_save
+        image_model.objects.bulk_create(
+            [image_model(**{post_field: post}, image=image, sha256=getattr(image, 'sha256', ''))
+             for image in images])
+        ResearchFile.objects.bulk_create(
+            [ResearchFile(research_post=post, file=file, sha256=getattr(file, 'sha256', ''), original_name=file.name[:255])
+             for file in files])
+        if images or files:
+            jobs.enqueue('process_attachments', post._meta.label, post.pk)
+            # bulk_create sends no post_save for objcache to see
+            objcache.bump_on_commit(type(post), post.pk)
+
+
+def matches_signature(name, header):
+    signature = SIGNATURES.get(posixpath.splitext(name)[1].lower())
+    return signature is None or header.startswith(signature)
+
+
+def inspection_failed(pk):
+    ResearchFile.objects.filter(pk=pk).update(status='failed')
+
+
+@jobs.task('inspect_file', on_failure=inspection_failed)
+def inspect_file(pk):
+    attachment = ResearchFile.objects.filter(pk=pk).first()
+    if attachment is None:
+        return
+    if not attachment.file:
+        ResearchFile.objects.filter(pk=pk).update(status='ready')
+        return
+    with attachment.file.open('rb') as file:
+        header = file.read(16)
+    status = 'ready' if matches_signature(attachment.file.name, header) else 'failed'
+    ResearchFile.objects.filter(pk=pk).update(status=status)
+
+
+def _pending(post_label, post_id):
+    for model, post_field in ATTACHMENT_MODELS[post_label]:
+        for pk in model.objects.filter(**{post_field: post_id}, status='pending').values_list('pk', flat=True):
+            yield model, pk
+
+
+def processing_failed(post_label, post_id):
+    for model, pk in list(_pending(post_label, post_id)):
+        model.objects.filter(pk=pk).update(status='failed')
+
+
+@jobs.task('process_attachments', on_failure=processing_failed)
+def process_attachments(post_label, post_id):
+    # anything already done by an earlier attempt is no longer pending
+    for model, pk in list(_pending(post_label, post_id)):
+        if model is ResearchFile:
+            inspect_file(pk)
+        else:
+            thumbnails.make_thumbnails(model._meta.label, pk)
+
+
+def file_saved(sender, instance, created, **kwargs):
+    if created and instance.file:
+        jobs.enqueue('inspect_file', instance.pk)
+    elif created:
+        # nothing to check, so no job will ever say it's done
+        ResearchFile.objects.filter(pk=instance.pk).update(status='ready')
+
+
+def connect_signals():
+    post_save.connect(file_saved, sender=ResearchFile, dispatch_uid='attachments.file_saved')
@@ -0,0 +1,270 @@
+"""
+Benchmarks of every named route, run by `manage.py benchmark`.
+
+Each route in ROUTES is requested with the test client against DATASET
+(see seeding.py), once to warm the caches and then `repeat` times. For
+each one the benchmark records the median wall time, and the number of
+SQL queries, rows fetched and response bytes of the last request.
+Savepoints aren't counted, so the numbers are the same inside a test's
+transaction as outside it.
+
+The results are compared with the baseline checked in as
+benchmark_baseline.json. A route fails if a measurement is over the
+baseline by more than its tolerance in BENCHMARK_TOLERANCE. Wall time
+depends on the machine, so it gets a generous tolerance. Query and row
+counts only change when the code does, so they get little or none.
+
+Routes that change data are in SKIPPED rather than ROUTES, because they
+would change what the routes after them measure. `manage.py load_test`
+exercises those instead.
+"""
+
+import json
+import os
+import statistics
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.urls import get_resolver, reverse
+
+from . import objcache, seeding, view_counts
+from .models import Article, Comment, Parasite, Post, ResearchPost, UserProfile
+
+BASELINE_PATH = getattr(settings, 'BENCHMARK_BASELINE',
+                        os.path.join(os.path.dirname(__file__), 'benchmark_baseline.json'))
+
+# relative to the baseline, e.g. 0.5 allows 50% more; seconds also need to be `min_seconds` over
+DEFAULT_TOLERANCE = {
+    'seconds': 0.5,
+    'min_seconds': 0.005,
+    'queries': 0,
+    'rows': 0.1,
+    'bytes': 0.1,
+}
+METRICS = ('seconds', 'queries', 'rows', 'bytes')
+
+# the arguments of seeding.seed(); changing them means recording a new baseline
+DATASET = {
+    'parasites': 3, 'users': 30, 'posts': 40, 'articles': 10, 'comments': 5, 'replies': 2, 'likes': 5,
+    'attachments': 1, 'random_seed': 1,
+}
+
+ADMIN_USERNAME = 'benchmark-admin'
+
+
+class Targets:
+    """The busiest rows of the dataset, which make for the slowest pages."""
+
+    def __init__(self):
+        self.parasite = Parasite.objects.annotate(post_total=Count('post')).order_by('-post_total', 'pk')[0]
+        self.post = Post.objects.filter(parasite=self.parasite).annotate(
+            comment_total=Count('comment')).order_by('-comment_total', 'pk')[0]
+        self.research_post = ResearchPost.objects.filter(parasite=self.parasite).annotate(
+            comment_total=Count('comment')).order_by('-comment_total', 'pk')[0]
+        self.comment = Comment.objects.filter(clinical_post=self.post).annotate(
+            reply_total=Count('reply')).order_by('-reply_total', 'pk')[0]
+        self.article = Article.objects.filter(parasite=self.parasite).order_by('pk')[0]
+        self.clinician = UserProfile.objects.filter(role='clinician').annotate(
+            post_total=Count('post')).order_by('-post_total', 'pk')[0].user
+        self.admin = User.objects.get(username=ADMIN_USERNAME)
+        self.picture = self.parasite.picture.name
+
+
+# url name: (who is logged in, function of Targets -> URL)
+ROUTES = {
+    'index': ('clinician', lambda t: reverse('parasitologyTool:index')),
+    'about': ('clinician', lambda t: reverse('parasitologyTool:about')),
+    'register': (None, lambda t: reverse('parasitologyTool:register')),
+    'login': (None, lambda t: reverse('parasitologyTool:login')),
+    'public_content': ('clinician', lambda t: reverse('parasitologyTool:public_content')),
+    'more_articles': ('clinician', lambda t: reverse('parasitologyTool:more_articles')),
+    'add_article': ('clinician', lambda t: reverse('parasitologyTool:add_article', args=[t.parasite.pk])),
+    'public_parasite_page': ('clinician', lambda t: reverse('parasitologyTool:public_parasite_page',
+                                                           args=[t.parasite.pk])),
+    'more_parasite_articles': ('clinician', lambda t: reverse('parasitologyTool:more_parasite_articles',
+                                                             args=[t.parasite.pk])),
+    'add_parasite': ('clinician', lambda t: reverse('parasitologyTool:add_parasite')),
+    'goto': ('clinician', lambda t: reverse('parasitologyTool:goto') + f'?parasite_id={t.parasite.pk}'),
+    'goto_article': ('clinician', lambda t: reverse('parasitologyTool:goto_article')
+                     + f'?article_id={t.article.pk}'),
+    'clinical_portal': ('clinician', lambda t: reverse('parasitologyTool:clinical_portal')),
+    'clinical_parasite_page': ('clinician', lambda t: reverse('parasitologyTool:clinical_parasite_page',
+                                                             args=[t.parasite.pk])),
+    'more_clinical_posts': ('clinician', lambda t: reverse('parasitologyTool:more_clinical_posts',
+                                                          args=[t.parasite.pk])),
+    'add_post': ('clinician', lambda t: reverse('parasitologyTool:add_post', args=[t.parasite.pk])),
+    'research_portal': ('clinician', lambda t: reverse('parasitologyTool:research_portal')),
+    'research_parasite_page': ('clinician', lambda t: reverse('parasitologyTool:research_parasite_page',
+                                                             args=[t.parasite.pk])),
+    'more_research_posts': ('clinician', lambda t: reverse('parasitologyTool:more_research_posts',
+                                                          args=[t.parasite.pk])),
+    'profile': ('clinician', lambda t: reverse('parasitologyTool:profile', args=[t.clinician.username])),
+    'add_research_post': ('clinician', lambda t: reverse('parasitologyTool:add_research_post',
+                                                        args=[t.parasite.pk])),
+    'research_post_page': ('clinician', lambda t: reverse('parasitologyTool:research_post_page',
+                                                         args=[t.parasite.pk, t.research_post.pk])),
+    'clinical_post_page': ('clinician', lambda t: reverse('parasitologyTool:clinical_post_page',
+                                                         args=[t.parasite.pk, t.post.pk])),
+    'more_research_comments': ('clinician', lambda t: reverse('parasitologyTool:more_research_comments',
+                                                             args=[t.parasite.pk, t.research_post.pk])),
+    'more_clinical_comments': ('clinician', lambda t: reverse('parasitologyTool:more_clinical_comments',
+                                                             args=[t.parasite.pk, t.post.pk])),
+    'search_results': ('clinician', lambda t: reverse('parasitologyTool:search_results') + '?q=seed'),
+    'autocomplete_users': ('clinician', lambda t: reverse('parasitologyTool:autocomplete_users') + '?q=seed'),
+    'admin_manage': ('admin', lambda t: reverse('parasitologyTool:admin_manage', args=[t.clinician.username])),
+    'cache_stats': ('admin', lambda t: reverse('parasitologyTool:cache_stats')),
+    'search_page': ('clinician', lambda t: reverse('parasitologyTool:search_page')),
+    'content_search': ('clinician', lambda t: reverse('parasitologyTool:content_search') + '?q=malaria'),
+    'user_posts': ('clinician', lambda t: reverse('parasitologyTool:user_posts', args=[t.clinician.username])),
+    'more_user_posts': ('clinician', lambda t: reverse('parasitologyTool:more_user_posts',
+                                                      args=[t.clinician.username])),
+    'comment_replies': ('clinician', lambda t: reverse('parasitologyTool:comment_replies', args=[t.comment.pk])),
+    'media': ('clinician', lambda t: settings.MEDIA_URL + t.picture),
+}
+
+# url name: why it isn't benchmarked
+SKIPPED = {
+    'logout': "ends the session",
+    'like_post': "changes data",
+    'delete_post': "changes data",
+    'like': "changes data",
+    'dislike': "changes data",
+    'comment-reply': "changes data",
+}
+
+
+def route_names():
+    """The names of the routes of parasitologyTool.urls, and the media route."""
+    resolver = get_resolver()
+    app_resolver = resolver.namespace_dict['parasitologyTool'][1]
+    names = {pattern.name for pattern in app_resolver.url_patterns if pattern.name}
+    return names | {'media'}
+
+
+def uncovered():
+    """Named routes that are neither benchmarked nor skipped."""
+    return route_names() - set(ROUTES) - set(SKIPPED)
+
+
+def seed():
+    seeding.seed(**DATASET)
+    admin = User.objects.create_user(username=ADMIN_USERNAME, password=seeding.SEED_PASSWORD)
+    UserProfile.objects.create(user=admin, role='admin')
+
+
+class SQLCounter:
+    """Counts the queries run and rows fetched through a connection, with connection.execute_wrapper()."""
+
+    def __init__(self):
+        self.queries = 0
+        self.rows = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        if not sql.lstrip().upper().startswith(('SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT')):
+            self.queries += 1
+        result = execute(sql, params, many, context)
+        self._count_fetches(context['cursor'])
+        return result
+
+    def _count_fetches(self, wrapper):
+        # the fetch methods of Django's CursorWrapper are looked up on the database cursor it wraps,
+        # so setting them on the wrapper puts these in front
+        cursor = wrapper.cursor
+
+        def fetchone():
+            row = cursor.fetchone()
+            self.rows += row is not None
+            return row
+
+        def fetchmany(size=cursor.arraysize):
+            rows = cursor.fetchmany(size)
+            self.rows += len(rows)
+            return rows
+
+        def fetchall():
+            rows = cursor.fetchall()
+            self.rows += len(rows)
+            return rows
+
+        wrapper.fetchone, wrapper.fetchmany, wrapper.fetchall = fetchone, fetchmany, fetchall
+
+
+def _request(client, url):
+    counter = SQLCounter()
+    with connection.execute_wrapper(counter):
+        start = time.perf_counter()
+        response = client.get(url)
+        if response.streaming:
+            size = sum(len(chunk) for chunk in response.streaming_content)
+        else:
+            size = len(response.content)
+        seconds = time.perf_counter() - start
+    response.close()
+    return response.status_code, {'seconds': seconds, 'queries': counter.queries, 'rows': counter.rows,
+                                  'bytes': size}
+
+
+def measure(repeat=5, names=None):
+    """Benchmarks the routes (all of ROUTES by default) against the dataset seed() added."""
+    for cache in caches.all():
+        cache.clear()
+    objcache.clear_local()
+    targets = Targets()
+    clients = {None: Client(), 'clinician': Client(), 'admin': Client()}
+    clients['clinician'].force_login(targets.clinician)
+    clients['admin'].force_login(targets.admin)
+
+    results = {}
+    for name in names or ROUTES:
+        user, url = ROUTES[name]
+        url = url(targets)
+        client = clients[user]
+        _request(client, url)
+        runs = [_request(client, url) for _ in range(repeat)]
+        status, last = runs[-1]
+        results[name] = dict(last, url=url, status=status,
+                             seconds=statistics.median(run['seconds'] for _, run in runs))
+    # goto and goto_article count views in memory, and they belong in this database
+    view_counts.flush()
+    return results
+
+
+def load_baseline(path=BASELINE_PATH):
+    with open(path) as file:
+        return json.load(file)
+
+
+def save_baseline(results, path=BASELINE_PATH):
+    routes = {name: {metric: result[metric] for metric in METRICS} for name, result in results.items()}
+    with open(path, 'w') as file:
+        json.dump({'dataset': DATASET, 'routes': routes}, file, indent=2, sort_keys=True)
+        file.write('\n')
+
+
+def compare(results, baseline, tolerance=None, metrics=METRICS):
+    """What got slower or bigger than the baseline allows, as messages."""
+    tolerance = dict(DEFAULT_TOLERANCE, **(tolerance or getattr(settings, 'BENCHMARK_TOLERANCE', {})))
+    if baseline.get('dataset') != DATASET:
+        return ["the baseline was recorded with another dataset; record a new one with --update-baseline"]
+
+    failures = []
+    for name, result in results.items():
+        if result['status'] >= 400:
+            failures.append(f"{name} answered {result['status']}")
+        base = baseline['routes'].get(name)
+        if base is None:
+            failures.append(f"{name} has no baseline; record one with --update-baseline")
+            continue
+        for metric in metrics:
+            allowed = base[metric] * (1 + tolerance[metric])
+            if metric == 'seconds':
+                allowed = max(allowed, base[metric] + tolerance['min_seconds'])
+            if result[metric] > allowed:
+                failures.append(f"{name}: {metric} went from {base[metric]:g} to {result[metric]:g}, "
+                                f"over the {tolerance[metric]:.0%} allowed")
+    return failures
@@ -1,28 +1,6 @@
-from functools import wraps
-from django.http import HttpResponse
-from .models import *
+from .permissions import portal_required
 
-def clinicians_only(function):
-  @wraps(function)
-  def wrap(request, *args, **kwargs):
+# kept for the views that already use them, see permissions.py
+clinicians_only = portal_required('clinical')
 
-        user = UserProfile.objects.get(user=request.user)
-        if user.role == 'clinician':
-             return function(request, *args, **kwargs)
-        else:
-            return HttpResponse("you are not authorised to view this page")
-
-  return wrap
-
-
-def clinicians_researchers_only(function):
-  @wraps(function)
-  def wrap(request, *args, **kwargs):
-
-        user = UserProfile.objects.get(user=request.user)
-        if user.role == 'clinician' or user.role == 'researcher':
-             return function(request, *args, **kwargs)
-        else:
-            return HttpResponse("you are not authorised to view this page")
-
-  return wrap
\ No newline at end of file
+clinicians_researchers_only = portal_required('research')
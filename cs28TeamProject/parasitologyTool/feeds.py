@@ -0,0 +1,103 @@
+"""
+Querysets for the post feeds, which load a whole page of posts with a fixed
+number of queries however many posts, images or likes there are.
+
+Posts from these querysets have their author, images and files already
+loaded, so templates can use post.user.username, post.images and
+post.files freely. Like and dislike counts are stored on the post itself
+(see reactions.py). Listings don't show comments, so they aren't loaded;
+post pages page through them with comment_thread().
+
+Comment threads only show the first REPLIES_SHOWN replies of each comment,
+so a post with thousands of replies renders as fast as one without; the
+rest are fetched REPLIES_PAGE_SIZE at a time (see reply_page()) when the
+reader expands the thread.
+"""
+
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce
+
+from .models import Comment, Post, Reply, ResearchPost
+
+REPLIES_SHOWN = getattr(settings, 'REPLIES_SHOWN', 3)
+REPLIES_PAGE_SIZE = getattr(settings, 'REPLIES_PAGE_SIZE', 50)
+
+
+def _reply_count():
+    counts = (Reply.objects.filter(parent_comment=OuterRef('pk'))
+              .order_by()
+              .values('parent_comment')
+              .annotate(total=Count('pk'))
+              .values('total'))
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
+def comment_thread(queryset=None):
+    """
+    Comments with their authors and number of replies loaded. Pass the
+    page of comments to with_replies() for the replies themselves.
+    """
+    if queryset is None:
+        queryset = Comment.objects.all()
+    return queryset.select_related('user__user').annotate(reply_count=_reply_count())
+
+
+def _first_replies(comment_ids, count):
+    # ids of the first `count` replies of each comment; Django 3.2 can't filter on a window function
+    table = connection.ops.quote_name(Reply._meta.db_table)
+    placeholders = ', '.join(['%s'] * len(comment_ids))
+    return RawSQL(
+        f'SELECT id FROM (SELECT id, ROW_NUMBER() OVER (PARTITION BY parent_comment_id ORDER BY id) AS position '
+        f'FROM {table} WHERE parent_comment_id IN ({placeholders})) AS ranked WHERE position <= %s',
+        [*comment_ids, count])
+
+
+def with_replies(comments, count=REPLIES_SHOWN):
+    """
+    Sets comment.first_replies on each comment from comment_thread() to
+    its first `count` replies, with their authors, in one query, and
+    comment.more_replies to how many are left to fetch with reply_page().
+    """
+    comments = list(comments)
+    by_comment = defaultdict(list)
+    if comments and count:
+        replies = (Reply.objects.filter(pk__in=_first_replies([comment.pk for comment in comments], count))
+                   .select_related('user__user').order_by('id'))
+        for reply in replies:
+            by_comment[reply.parent_comment_id].append(reply)
+    for comment in comments:
+        comment.first_replies = by_comment[comment.pk]
+        comment.more_replies = comment.reply_count - len(comment.first_replies)
+        comment.last_reply_id = comment.first_replies[-1].pk if comment.first_replies else 0
+    return comments
+
+
+def reply_page(comment_id, after=0, page_size=REPLIES_PAGE_SIZE):
+    """
+    The replies to a comment that come after reply `after`, oldest first,
+    and whether there are more.
+    """
+    replies = list(Reply.objects.filter(parent_comment_id=comment_id, pk__gt=after)
+                   .select_related('user__user').order_by('id')[:page_size + 1])
+    return replies[:page_size], len(replies) > page_size
+
+
+def _prefetch(queryset, lookups):
+    return queryset.select_related('user__user').prefetch_related(*lookups)
+
+
+def clinical_feed(queryset=None):
+    if queryset is None:
+        queryset = Post.objects.all()
+    return _prefetch(queryset, ('clinicalimage_set',))
+
+
+def research_feed(queryset=None):
+    if queryset is None:
+        queryset = ResearchPost.objects.all()
+    return _prefetch(queryset, ('researchimage_set', 'researchfile_set'))
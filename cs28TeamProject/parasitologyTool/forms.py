@@ -2,6 +2,7 @@ from django import forms
 from django.contrib.auth.models import User
 from .models import *
 from django.core.exceptions import ValidationError
+from django.core.validators import URLValidator
 from django.utils.translation import gettext_lazy as _
 
 class PostForm(forms.ModelForm):
@@ -49,7 +50,7 @@ class ArticleForm(forms.ModelForm):
     title = forms.CharField(max_length=Article.TITLE_MAX_LENGTH, 
                             help_text="Please enter the title of the Article")
     content = forms.CharField(widget=forms.Textarea)
-    url = forms.URLField(max_length=Article.URL_MAX_LENGTH,
+    url = forms.URLField(max_length=Article.URL_MAX_LENGTH, validators=[URLValidator(schemes=Article.URL_SCHEMES)],
                          help_text="Please enter the URL of the Article.")
     picture = forms.ImageField()
     views = forms.IntegerField(widget=forms.HiddenInput(), initial=0)
@@ -0,0 +1,118 @@
+"""
+A small job queue for work that shouldn't hold up a request, such as
+making thumbnails of uploaded pictures.
+
+Jobs are rows in the Job table, so no broker is needed: enqueue() inserts
+one, and `manage.py run_workers` runs processes that claim and run them.
+A claim is a single conditional UPDATE, so two workers can never take the
+same job. A job whose task raises is retried after JOB_RETRY_SECONDS,
+doubling each time, until it has been tried max_attempts times; it is
+then left in the table as failed, with the traceback in last_error. A job
+left running by a worker that died is taken up again after
+JOB_TIMEOUT_SECONDS. Finished jobs are deleted: what the rest of the site
+needs to know about (e.g. the status of an attachment) is recorded by the
+task itself.
+
+Tasks are plain functions registered with @task('name'); their arguments
+must be JSON serialisable.
+"""
+
+import logging
+import threading
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = getattr(settings, 'JOB_MAX_ATTEMPTS', 3)
+RETRY_SECONDS = getattr(settings, 'JOB_RETRY_SECONDS', 30)
+TIMEOUT_SECONDS = getattr(settings, 'JOB_TIMEOUT_SECONDS', 600)
+POLL_SECONDS = getattr(settings, 'JOB_POLL_SECONDS', 1)
+
+# task name: (function, called with the job's arguments once it has failed for good)
+_tasks = {}
+
+
+def task(name, on_failure=None):
+    def register(function):
+        _tasks[name] = (function, on_failure)
+        return function
+    return register
+
+
+def enqueue(name, *args, max_attempts=MAX_ATTEMPTS, delay_seconds=0):
+    if name not in _tasks:
+        raise ValueError(f"unknown task {name!r}")
+    return Job.objects.create(task=name, args=list(args), max_attempts=max_attempts,
+                              run_after=timezone.now() + timedelta(seconds=delay_seconds))
+
+
+def _claimable(now):
+    return (Q(status='pending', run_after__lte=now)
+            | Q(status='running', locked_at__lt=now - timedelta(seconds=TIMEOUT_SECONDS)))
+
+
+def claim():
+    """Takes the next job that is due, or returns None if there isn't one."""
+    now = timezone.now()
+    candidates = Job.objects.filter(_claimable(now)).order_by('run_after', 'pk').values_list('pk', flat=True)[:10]
+    for pk in candidates:
+        # only one worker's UPDATE can match, however many try at once
+        if Job.objects.filter(_claimable(now), pk=pk).update(status='running', locked_at=now,
+                                                             attempts=F('attempts') + 1):
+            return Job.objects.get(pk=pk)
+    return None
+
+
+def run(job):
+    """Runs a claimed job. Returns True if its task succeeded."""
+    function, on_failure = _tasks.get(job.task, (None, None))
+    try:
+        if function is None:
+            raise LookupError(f"unknown task {job.task!r}")
+        function(*job.args)
+    except Exception:
+        job.last_error = traceback.format_exc()
+        if job.attempts >= job.max_attempts:
+            logger.error("job %s failed for good after %d attempt(s)", job, job.attempts)
+            job.status = 'failed'
+            if on_failure is not None:
+                on_failure(*job.args)
+        else:
+            logger.warning("job %s failed, will retry", job, exc_info=True)
+            job.status = 'pending'
+            job.run_after = timezone.now() + timedelta(seconds=RETRY_SECONDS * 2 ** (job.attempts - 1))
+        job.locked_at = None
+        job.save(update_fields=['status', 'run_after', 'locked_at', 'last_error'])
+        return False
+    job.delete()
+    return True
+
+
+def run_pending(limit=None):
+    """Runs due jobs in this process until there are none left. Returns how many were run."""
+    count = 0
+    while limit is None or count < limit:
+        job = claim()
+        if job is None:
+            break
+        run(job)
+        count += 1
+    return count
+
+
+def work(stop=None, poll_seconds=POLL_SECONDS):
+    """A worker's main loop: runs jobs as they become due until `stop` is set."""
+    stop = stop or threading.Event()
+    while not stop.is_set():
+        job = claim()
+        if job is None:
+            stop.wait(poll_seconds)
+        else:
+            run(job)
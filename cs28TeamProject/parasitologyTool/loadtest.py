@@ -0,0 +1,243 @@
+"""
+A load driver for a running server, e.g. `manage.py runserver` over a
+database filled by `manage.py seed_data`.
+
+Each of `concurrency` threads logs in as a different seeded clinician and
+repeatedly picks a scenario from the mix:
+
+* browse: a public, portal, post or comment page,
+* like: likes or dislikes a post,
+* comment: comments on a post,
+* upload: adds a clinical post with a small picture.
+
+The ids to use are read from the database before starting, so the driver
+must run against the same database as the server. Redirects aren't
+followed, so every request is timed on its own, and each one is reported
+under the name of its URL pattern in parasitologyTool/urls.py.
+"""
+
+import math
+import random
+import threading
+import time
+import uuid
+from collections import defaultdict, namedtuple
+from http.cookiejar import CookieJar
+from io import BytesIO
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode, urlsplit
+from urllib.request import HTTPCookieProcessor, HTTPRedirectHandler, Request, build_opener
+
+from PIL import Image
+
+from django.urls import Resolver404, resolve, reverse
+
+from .models import Comment, Parasite, Post, ResearchPost, UserProfile
+from .seeding import SEED_PASSWORD, SEED_USERNAME_PREFIX
+
+DEFAULT_MIX = {'browse': 80, 'like': 10, 'comment': 7, 'upload': 3}
+
+Sample = namedtuple('Sample', ['name', 'seconds', 'status', 'ok'])
+
+
+class NoRedirects(HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(math.ceil(fraction * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+def report(samples, elapsed):
+    """Per URL name: requests, errors, throughput and p50/p95/p99 latency in milliseconds."""
+    by_name = defaultdict(list)
+    for sample in samples:
+        by_name[sample.name].append(sample)
+    rows = {}
+    for name, group in sorted(by_name.items()):
+        seconds = sorted(sample.seconds for sample in group)
+        rows[name] = {
+            'requests': len(group),
+            'errors': sum(1 for sample in group if not sample.ok),
+            'per_second': len(group) / elapsed if elapsed else None,
+            'p50_ms': percentile(seconds, 0.50) * 1000,
+            'p95_ms': percentile(seconds, 0.95) * 1000,
+            'p99_ms': percentile(seconds, 0.99) * 1000,
+        }
+    return rows
+
+
+def parse_mix(text):
+    """'browse=80,like=20' -> {'browse': 80, 'like': 20}"""
+    mix = {}
+    for part in filter(None, (part.strip() for part in text.split(','))):
+        name, _, weight = part.partition('=')
+        if name not in DEFAULT_MIX:
+            raise ValueError(f"unknown scenario {name!r}")
+        mix[name] = float(weight)
+    return mix
+
+
+def _picture():
+    buffer = BytesIO()
+    Image.new('RGB', (32, 32), (200, 100, 50)).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def _multipart(fields, files):
+    boundary = uuid.uuid4().hex
+    body = BytesIO()
+    for name, value in fields.items():
+        body.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, content, content_type) in files.items():
+        body.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                   f'Content-Type: {content_type}\r\n\r\n'.encode())
+        body.write(content + b'\r\n')
+    body.write(f'--{boundary}--\r\n'.encode())
+    return body.getvalue(), f'multipart/form-data; boundary={boundary}'
+
+
+class Targets:
+    """Ids of rows to visit, sampled from the database once."""
+
+    def __init__(self, sample_size=1000):
+        def ids(queryset, *fields):
+            return list(queryset.order_by('?').values_list(*fields)[:sample_size])
+
+        self.parasites = [pk for pk, in ids(Parasite.objects, 'pk')]
+        self.posts = ids(Post.objects, 'parasite_id', 'pk')
+        self.research_posts = ids(ResearchPost.objects, 'parasite_id', 'pk')
+        self.comments = [pk for pk, in ids(Comment.objects.filter(clinical_post__isnull=False), 'pk')]
+        self.usernames = [name for name, in ids(UserProfile.objects.filter(
+            role='clinician', user__username__startswith=SEED_USERNAME_PREFIX), 'user__username')]
+        if not (self.parasites and self.posts and self.research_posts and self.usernames):
+            raise ValueError("there is nothing to load test; run `manage.py seed_data` first")
+
+
+class VirtualUser:
+    def __init__(self, base_url, username, targets, rng, record):
+        self.base_url = base_url.rstrip('/')
+        self.username = username
+        self.targets = targets
+        self.rng = rng
+        self.record = record
+        self.cookies = CookieJar()
+        self.opener = build_opener(HTTPCookieProcessor(self.cookies), NoRedirects)
+
+    def csrf_token(self):
+        return next((cookie.value for cookie in self.cookies if cookie.name == 'csrftoken'), '')
+
+    def request(self, path, data=None, content_type=None, expect=None):
+        """
+        Sends one request and records how long it took. It counts as an error
+        if it fails, or if `expect` is given and the status isn't that, e.g. a
+        form that is shown again rather than redirecting.
+        """
+        headers = {'X-CSRFToken': self.csrf_token()}
+        if isinstance(data, dict):
+            data, content_type = urlencode(data).encode(), 'application/x-www-form-urlencoded'
+        if content_type:
+            headers['Content-Type'] = content_type
+        try:
+            name = resolve(urlsplit(path).path).url_name
+        except Resolver404:
+            name = path
+        start = time.perf_counter()
+        try:
+            with self.opener.open(Request(self.base_url + path, data=data, headers=headers), timeout=60) as response:
+                response.read()
+                status = response.status
+        except HTTPError as error:
+            # redirects land here too, as they aren't followed
+            status = error.code
+        except (URLError, OSError):
+            status = None
+        seconds = time.perf_counter() - start
+        ok = status is not None and status < 400 and (expect is None or status == expect)
+        self.record(Sample(name, seconds, status, ok))
+        return status
+
+    def log_in(self):
+        self.request(reverse('parasitologyTool:login'))
+        self.request(reverse('parasitologyTool:login'), {
+            'username': self.username, 'password': SEED_PASSWORD, 'csrfmiddlewaretoken': self.csrf_token()},
+            expect=302)
+
+    def browse(self):
+        targets, rng = self.targets, self.rng
+        parasite_id = rng.choice(targets.parasites)
+        parasite_of_post, post_id = rng.choice(targets.posts)
+        parasite_of_research_post, research_post_id = rng.choice(targets.research_posts)
+        pages = [
+            reverse('parasitologyTool:index'),
+            reverse('parasitologyTool:public_content'),
+            reverse('parasitologyTool:public_parasite_page', args=[parasite_id]),
+            reverse('parasitologyTool:clinical_parasite_page', args=[parasite_id]),
+            reverse('parasitologyTool:research_parasite_page', args=[parasite_id]),
+            reverse('parasitologyTool:clinical_post_page', args=[parasite_of_post, post_id]),
+            reverse('parasitologyTool:research_post_page', args=[parasite_of_research_post, research_post_id]),
+        ]
+        if targets.comments:
+            pages.append(reverse('parasitologyTool:comment_replies', args=[rng.choice(targets.comments)]))
+        self.request(rng.choice(pages))
+
+    def like(self):
+        model, (_, post_id) = self.rng.choice([('Post', self.rng.choice(self.targets.posts)),
+                                                ('ResearchPost', self.rng.choice(self.targets.research_posts))])
+        reaction = self.rng.choice(['like', 'dislike'])
+        self.request(reverse(f'parasitologyTool:{reaction}', args=[model, post_id]), {}, expect=200)
+
+    def comment(self):
+        parasite_id, post_id = self.rng.choice(self.targets.posts)
+        self.request(reverse('parasitologyTool:clinical_post_page', args=[parasite_id, post_id]), {
+            'comment_text': 'load test comment', 'csrfmiddlewaretoken': self.csrf_token()}, expect=302)
+
+    def upload(self):
+        body, content_type = _multipart(
+            {'title': 'load test', 'content': 'load test post', 'likes': 0, 'csrfmiddlewaretoken': self.csrf_token()},
+            {'images': ('load-test.png', _picture(), 'image/png')})
+        self.request(reverse('parasitologyTool:add_post', args=[self.rng.choice(self.targets.parasites)]),
+                     body, content_type, expect=302)
+
+
+def run(base_url, concurrency=10, duration=None, requests=None, mix=None, random_seed=None, targets=None):
+    """
+    Runs the scenarios until `duration` seconds have passed or about
+    `requests` requests were made. Returns (samples, elapsed seconds).
+    """
+    if duration is None and requests is None:
+        raise ValueError("give a duration or a number of requests")
+    mix = mix or DEFAULT_MIX
+    targets = targets or Targets()
+    samples = []
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def record(sample):
+        with lock:
+            samples.append(sample)
+            if requests is not None and len(samples) >= requests:
+                stop.set()
+
+    def worker(number):
+        rng = random.Random(None if random_seed is None else random_seed + number)
+        user = VirtualUser(base_url, targets.usernames[number % len(targets.usernames)], targets, rng, record)
+        user.log_in()
+        scenarios, weights = list(mix), list(mix.values())
+        while not stop.is_set():
+            getattr(user, rng.choices(scenarios, weights=weights)[0])()
+
+    threads = [threading.Thread(target=worker, args=(number,), daemon=True) for number in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    stop.wait(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return samples, time.perf_counter() - start
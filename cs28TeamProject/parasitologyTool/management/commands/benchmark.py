@@ -0,0 +1,75 @@
+import json
+import shutil
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings, setup_databases, setup_test_environment, teardown_databases, \
+    teardown_test_environment
+
+from parasitologyTool import benchmarks
+
+
+class Command(BaseCommand):
+    help = ("Benchmarks every named route against a freshly seeded test database, and fails if one got slower, "
+            "or runs more queries, fetches more rows or sends more bytes, than benchmark_baseline.json allows.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('routes', nargs='*', help="url names to benchmark, all of them by default")
+        parser.add_argument('--repeat', type=int, default=5, help="timed requests per route")
+        parser.add_argument('--json', action='store_true', help="Print the results as JSON.")
+        parser.add_argument('--output', help="Also write the results as JSON to this file.")
+        parser.add_argument('--update-baseline', action='store_true',
+                            help="Record these results as the new baseline.")
+        parser.add_argument('--no-check', action='store_true', help="Report only, never fail.")
+
+    def handle(self, *args, **options):
+        unknown = set(options['routes']) - set(benchmarks.ROUTES)
+        if unknown:
+            raise CommandError(f"not benchmarked: {', '.join(sorted(unknown))}")
+        uncovered = benchmarks.uncovered()
+        if uncovered:
+            raise CommandError(f"add these routes to benchmarks.ROUTES or SKIPPED: {', '.join(sorted(uncovered))}")
+
+        results = self.measure(options['routes'], options['repeat'])
+        failures = []
+        if options['update_baseline']:
+            benchmarks.save_baseline(results)
+        else:
+            failures = benchmarks.compare(results, benchmarks.load_baseline())
+
+        report = {'dataset': benchmarks.DATASET, 'routes': results, 'failures': failures}
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(report, file, indent=2)
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            self.report(results)
+
+        for failure in failures:
+            self.stderr.write(failure)
+        if failures and not options['no_check']:
+            raise CommandError(f"{len(failures)} benchmark(s) regressed")
+
+    def measure(self, routes, repeat):
+        # a throwaway database and media directory, so that every run sees the same data
+        media_root = tempfile.mkdtemp()
+        setup_test_environment()
+        try:
+            # as in production and under the test runner; with DEBUG on, templates are parsed on every render
+            with override_settings(MEDIA_ROOT=media_root, DEBUG=False):
+                old_config = setup_databases(verbosity=0, interactive=False, aliases={'default'})
+                try:
+                    benchmarks.seed()
+                    return benchmarks.measure(repeat, routes)
+                finally:
+                    teardown_databases(old_config, verbosity=0)
+        finally:
+            teardown_test_environment()
+            shutil.rmtree(media_root)
+
+    def report(self, results):
+        self.stdout.write(f"{'route':<26}{'status':>7}{'ms':>9}{'queries':>9}{'rows':>8}{'bytes':>9}")
+        for name, result in results.items():
+            self.stdout.write(f"{name:<26}{result['status']:>7}{result['seconds'] * 1000:>9.1f}"
+                              f"{result['queries']:>9}{result['rows']:>8}{result['bytes']:>9}")
@@ -0,0 +1,73 @@
+from collections import defaultdict
+
+from django.core.files.storage import default_storage, get_storage_class
+from django.core.management.base import BaseCommand, CommandError
+from django.template.defaultfilters import filesizeformat
+
+from parasitologyTool import storage, thumbnails
+
+
+class Command(BaseCommand):
+    help = ("Moves uploads from before content-addressed storage into blobs, keeping one copy of "
+            "each distinct file, and points every row at its blob.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="only report what would be saved")
+
+    def handle(self, *args, **options):
+        if not issubclass(get_storage_class(), storage.ContentAddressedStorage):
+            raise CommandError("DEFAULT_FILE_STORAGE is not parasitologyTool.storage.ContentAddressedStorage")
+
+        # old name: the (model, field name) pairs that use it
+        users = defaultdict(list)
+        for model, field_name in storage.file_fields():
+            field = model._meta.get_field(field_name)
+            default = field.get_default()
+            names = (model._default_manager.exclude(**{field_name: ''})
+                     .values_list(field_name, flat=True).distinct())
+            for name in names:
+                # a field's default is shared by design and must stay where the field expects it;
+                # blobs, public or private, were moved by an earlier run
+                if name and name != default and not storage.is_blob(name):
+                    users[name].append((model, field_name))
+
+        moved = {}
+        before = after = 0
+        blobs = set()
+        for name in sorted(users):
+            if not default_storage.exists(name):
+                self.stderr.write(f"missing: {name}")
+                continue
+            with default_storage.open(name, 'rb') as file:
+                digest = storage.content_hash(file)
+            new_name = storage.blob_name(digest, name)
+            size = default_storage.size(name)
+            before += size
+            if new_name not in blobs:
+                blobs.add(new_name)
+                after += size
+            moved[name] = new_name
+
+        self.stdout.write(f"{len(moved)} file(s), {len(blobs)} distinct: "
+                          f"{filesizeformat(before)} -> {filesizeformat(after)}")
+        if options['dry_run']:
+            return
+
+        for name, new_name in moved.items():
+            if not default_storage.exists(new_name):
+                with default_storage.open(name, 'rb') as file:
+                    default_storage.save(new_name, file)
+            for model, field_name in users[name]:
+                # update() sends no signals, so django_cleanup leaves the files alone
+                model._default_manager.filter(**{field_name: name}).update(**{field_name: new_name})
+
+        for name, new_name in moved.items():
+            default_storage.delete(name)
+            for variant in thumbnails.variant_names(name):
+                default_storage.delete(variant)
+            try:
+                thumbnails.generate(new_name)
+            except OSError:
+                # not a picture
+                pass
+        self.stdout.write(f"moved {len(moved)} file(s) into {len(blobs)} blob(s)")
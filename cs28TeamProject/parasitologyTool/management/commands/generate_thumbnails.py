@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from parasitologyTool import thumbnails
+
+
+class Command(BaseCommand):
+    help = "Makes the resized copies of every uploaded picture that doesn't have them yet."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help="remake copies that already exist")
+
+    def handle(self, *args, **options):
+        done = set()
+        for model, field_name in thumbnails.IMAGE_FIELDS.items():
+            names = model.objects.exclude(**{field_name: ''}).values_list(field_name, flat=True).distinct()
+            for name in names:
+                if name in done:
+                    continue
+                done.add(name)
+                try:
+                    thumbnails.generate(name, force=options['force'])
+                except OSError as error:
+                    self.stderr.write(f"skipped {name}: {error}")
+        self.stdout.write(f"checked {len(done)} picture(s)")
@@ -0,0 +1,44 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from parasitologyTool import loadtest
+
+
+class Command(BaseCommand):
+    help = ("Sends concurrent requests to a running server as seeded users (see seed_data) and reports the "
+            "latency percentiles, throughput and errors of each view.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+        parser.add_argument('--concurrency', type=int, default=10, help="simulated users")
+        parser.add_argument('--duration', type=float, default=None, help="seconds to run for")
+        parser.add_argument('--requests', type=int, default=None, help="requests to make, if no duration is given")
+        parser.add_argument('--mix', default=None,
+                            help="scenario weights, default %s" % ','.join(
+                                f'{name}={weight}' for name, weight in loadtest.DEFAULT_MIX.items()))
+        parser.add_argument('--seed', type=int, default=None, help="random seed, for a repeatable run")
+        parser.add_argument('--json', action='store_true', help="print the report as JSON")
+
+    def handle(self, *args, **options):
+        duration, requests = options['duration'], options['requests']
+        if duration is None and requests is None:
+            duration = 30
+        try:
+            mix = loadtest.parse_mix(options['mix']) if options['mix'] else None
+            samples, elapsed = loadtest.run(options['base_url'], concurrency=options['concurrency'],
+                                            duration=duration, requests=requests, mix=mix,
+                                            random_seed=options['seed'])
+        except ValueError as error:
+            raise CommandError(error)
+
+        rows = loadtest.report(samples, elapsed)
+        if options['json']:
+            self.stdout.write(json.dumps({'seconds': elapsed, 'requests': len(samples), 'views': rows}, indent=2))
+            return
+        self.stdout.write(f"{len(samples)} request(s) in {elapsed:.1f}s, {len(samples) / elapsed:.1f}/s")
+        self.stdout.write(f"{'view':<28}{'requests':>9}{'errors':>8}{'per s':>8}{'p50 ms':>9}{'p95 ms':>9}"
+                          f"{'p99 ms':>9}")
+        for name, row in rows.items():
+            self.stdout.write(f"{name:<28}{row['requests']:>9}{row['errors']:>8}{row['per_second']:>8.1f}"
+                              f"{row['p50_ms']:>9.1f}{row['p95_ms']:>9.1f}{row['p99_ms']:>9.1f}")
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from parasitologyTool import ranking
+
+
+class Command(BaseCommand):
+    help = "Recomputes the popularity score of every post, e.g. after changing the ranking weights."
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"scored {ranking.rebuild()} post(s)")
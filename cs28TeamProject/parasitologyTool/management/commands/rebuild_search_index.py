@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from parasitologyTool import search
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the full-text search index from the database, e.g. after a bulk import."
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"indexed {search.rebuild()} object(s)")
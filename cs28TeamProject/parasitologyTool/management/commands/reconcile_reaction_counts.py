@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from parasitologyTool import reactions
+
+
+class Command(BaseCommand):
+    help = "Recomputes the stored like/dislike counts of every post from the likes tables."
+
+    def handle(self, *args, **options):
+        for name, model in reactions.POST_MODELS.items():
+            fixed = reactions.recount(model)
+            self.stdout.write(f"{name}: fixed {fixed} post(s)")
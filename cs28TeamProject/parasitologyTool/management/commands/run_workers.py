@@ -0,0 +1,51 @@
+import multiprocessing
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from parasitologyTool import jobs
+
+
+def _worker(stop):
+    # the parent stops the workers through `stop`, so ignore the Ctrl-C it also gets
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    jobs.work(stop)
+
+
+class Command(BaseCommand):
+    help = "Runs the background job workers (thumbnails, attachment checks) until interrupted."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=getattr(settings, 'JOB_WORKERS', 2),
+                            help="number of worker processes")
+        parser.add_argument('--once', action='store_true',
+                            help="run the jobs that are due in this process, then exit")
+
+    def handle(self, *args, **options):
+        if options['once']:
+            self.stdout.write(f"ran {jobs.run_pending()} job(s)")
+            return
+
+        concurrency = max(options['concurrency'], 1)
+        context = multiprocessing.get_context('fork')
+        stop = context.Event()
+        # each worker must open its own database connection
+        connections.close_all()
+        workers = [context.Process(target=_worker, args=(stop,), daemon=True) for _ in range(concurrency)]
+        for worker in workers:
+            worker.start()
+        self.stdout.write(f"started {concurrency} worker(s)")
+
+        signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+        try:
+            while not stop.is_set() and any(worker.is_alive() for worker in workers):
+                stop.wait(1)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            stop.set()
+            for worker in workers:
+                worker.join()
+        self.stdout.write("workers stopped")
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+
+from parasitologyTool import seeding
+
+
+class Command(BaseCommand):
+    help = ("Adds synthetic parasites, users, articles, posts, comments, replies, likes and attachments in bulk, "
+            "for load testing. Every seeded user's password is '%s'." % seeding.SEED_PASSWORD)
+
+    def add_arguments(self, parser):
+        parser.add_argument('--parasites', type=int, default=10)
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--posts', type=int, default=100,
+                            help="clinical posts, and as many research posts, per parasite on average")
+        parser.add_argument('--articles', type=int, default=10, help="articles per parasite on average")
+        parser.add_argument('--comments', type=int, default=5, help="comments per post on average")
+        parser.add_argument('--replies', type=int, default=2, help="replies per comment on average")
+        parser.add_argument('--likes', type=int, default=5,
+                            help="likes per post on average, with a quarter as many dislikes")
+        parser.add_argument('--attachments', type=int, default=1, help="attachments per post")
+        parser.add_argument('--skew', type=float, default=1.0,
+                            help="0 spreads activity evenly; higher values give more of it to a few parasites, "
+                                 "posts and comments")
+        parser.add_argument('--days', type=int, default=365, help="how far back posts are dated")
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--seed', type=int, default=None, help="random seed, for repeatable data")
+
+    def handle(self, *args, **options):
+        def progress(parasite, totals):
+            if options['verbosity'] > 1:
+                self.stdout.write(f"{parasite.name}: {totals}")
+
+        totals = seeding.seed(
+            parasites=options['parasites'], users=options['users'], posts=options['posts'],
+            articles=options['articles'], comments=options['comments'], replies=options['replies'],
+            likes=options['likes'], attachments=options['attachments'], skew=options['skew'],
+            days=options['days'], batch_size=options['batch_size'], random_seed=options['seed'], progress=progress,
+        )
+        self.stdout.write(', '.join(f"{count} {kind}(s)" for kind, count in totals.items()))
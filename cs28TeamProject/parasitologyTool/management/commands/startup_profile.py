@@ -0,0 +1,85 @@
+import json
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+MB = 1024 * 1024
+
+DEFAULT_BUDGET = {
+    'setup_seconds': 2.0,
+    'setup_rss_mb': 100,
+    'module_seconds': 0.5,
+    'module_rss_mb': 20,
+    'forbidden_modules': [],
+}
+
+
+class Command(BaseCommand):
+    help = ("Measures import time and memory of django.setup() and every app module "
+            "in a fresh interpreter, and fails if they go over STARTUP_PROFILE_BUDGET.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--json', action='store_true', help="Print the raw measurements as JSON.")
+        parser.add_argument('--no-check', action='store_true', help="Report only, never fail.")
+
+    def handle(self, *args, **options):
+        budget = dict(DEFAULT_BUDGET, **getattr(settings, 'STARTUP_PROFILE_BUDGET', {}))
+        results = self.measure()
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+        else:
+            self.report(results)
+
+        failures = self.check_budget(results, budget)
+        for failure in failures:
+            self.stderr.write(failure)
+        if failures and not options['no_check']:
+            raise CommandError(f"{len(failures)} startup budget(s) exceeded")
+
+    def measure(self):
+        # a fresh interpreter, so modules this command has already loaded aren't free
+        base_dir = str(settings.BASE_DIR)
+        process = subprocess.run(
+            [sys.executable, '-m', 'parasitologyTool.startup_profile', base_dir],
+            cwd=base_dir, capture_output=True, text=True,
+        )
+        if process.returncode != 0:
+            raise CommandError(f"startup profile failed:\n{process.stderr}")
+        return json.loads(process.stdout)
+
+    def report(self, results):
+        setup = results['setup']
+        self.stdout.write(f"django.setup(): {setup['seconds'] * 1000:.1f} ms, "
+                          f"{setup['rss_bytes'] / MB:.1f} MB")
+        modules = sorted(results['modules'].items(), key=lambda item: -item[1]['seconds'])
+        for name, cost in modules:
+            self.stdout.write(f"  {name}: {cost['seconds'] * 1000:.1f} ms, {cost['rss_bytes'] / MB:.1f} MB")
+        self.stdout.write(f"total: {results['total_rss_bytes'] / MB:.1f} MB")
+
+    def check_budget(self, results, budget):
+        failures = []
+        setup = results['setup']
+        if setup['seconds'] > budget['setup_seconds']:
+            failures.append(f"django.setup() took {setup['seconds']:.2f}s, "
+                            f"budget is {budget['setup_seconds']}s")
+        if setup['rss_bytes'] > budget['setup_rss_mb'] * MB:
+            failures.append(f"django.setup() used {setup['rss_bytes'] / MB:.1f} MB, "
+                            f"budget is {budget['setup_rss_mb']} MB")
+
+        for name, cost in results['modules'].items():
+            if cost['seconds'] > budget['module_seconds']:
+                failures.append(f"{name} took {cost['seconds']:.2f}s to import, "
+                                f"budget is {budget['module_seconds']}s")
+            if cost['rss_bytes'] > budget['module_rss_mb'] * MB:
+                failures.append(f"{name} used {cost['rss_bytes'] / MB:.1f} MB on import, "
+                                f"budget is {budget['module_rss_mb']} MB")
+
+        loaded = set(results['loaded_modules'])
+        for name in budget['forbidden_modules']:
+            if name in loaded:
+                failures.append(f"{name} is imported at startup")
+
+        return failures
@@ -0,0 +1,197 @@
+"""
+Serving uploaded files.
+
+serve() replaces django.conf.urls.static for MEDIA_URL and does what a
+static file server would:
+
+* strong ETags and Last-Modified, answering If-None-Match and
+  If-Modified-Since with 304 Not Modified,
+* single byte ranges (Range, If-Range) with 206 Partial Content, so a PDF
+  viewer can fetch the page it needs rather than the whole file,
+* Cache-Control: a year and immutable for content-addressed blobs (see
+  storage.py), whose name changes whenever their content would, and
+  MEDIA_CACHE_SECONDS for anything else,
+* whole files are sent with FileResponse, which the WSGI server can hand
+  to sendfile(),
+* attachments of clinical and research posts are only sent for a signed
+  URL (see signing.py), and only cached privately until it expires.
+
+With MEDIA_SERVE_MODE set to 'x-accel-redirect' (nginx) or 'x-sendfile'
+(Apache, lighttpd) the checks still happen here but the bytes are sent by
+the front-end server. For nginx, MEDIA_ACCEL_REDIRECT_PREFIX must be an
+internal location aliased to MEDIA_ROOT:
+
+    location /protected-media/ {
+        internal;
+        alias /path/to/media/;
+    }
+"""
+
+import mimetypes
+import os
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseForbidden, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+from django.views.decorators.http import require_safe
+
+from . import signing
+from .storage import is_blob
+
+CACHE_SECONDS = getattr(settings, 'MEDIA_CACHE_SECONDS', 60 * 60)
+IMMUTABLE_CACHE_SECONDS = 365 * 24 * 60 * 60
+SERVE_MODE = getattr(settings, 'MEDIA_SERVE_MODE', None)
+ACCEL_REDIRECT_PREFIX = getattr(settings, 'MEDIA_ACCEL_REDIRECT_PREFIX', '/protected-media/')
+CHUNK_SIZE = 64 * 1024
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def is_immutable(name):
+    # thumbnails of a blob are remade if the thumbnail settings change, so they don't count
+    return is_blob(name) and '/thumbs/' not in name
+
+
+def etag_for(name, stat):
+    if is_immutable(name):
+        # the name is the SHA-256 of the content
+        return quote_etag(os.path.splitext(os.path.basename(name))[0])
+    return quote_etag(f'{stat.st_mtime_ns:x}-{stat.st_size:x}')
+
+
+def parse_range(header, size):
+    """
+    The (first, last) byte asked for by a Range header, or None if the whole
+    file should be sent instead. Several ranges at once aren't supported, and
+    get the whole file, which the HTTP spec allows.
+    """
+    unit, _, ranges = header.partition('=')
+    if unit.strip() != 'bytes' or ',' in ranges:
+        return None
+    first, _, last = ranges.strip().partition('-')
+    try:
+        if first == '':
+            # the last n bytes
+            length = int(last)
+            if length == 0:
+                raise RangeNotSatisfiable
+            first, last = max(size - length, 0), size - 1
+        else:
+            first = int(first)
+            if last and int(last) < first:
+                # not a valid range at all, so the header is ignored (RFC 7233, section 2.1)
+                return None
+            last = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if first >= size:
+        raise RangeNotSatisfiable
+    return first, min(last, size - 1)
+
+
+def _if_range_passes(request, etag, last_modified):
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return if_range == etag
+    return parse_http_date_safe(if_range) == int(last_modified)
+
+
+def _read_range(path, first, length):
+    with open(path, 'rb') as file:
+        file.seek(first)
+        while length > 0:
+            chunk = file.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def send_file(request, name, cache_control):
+    """
+    The response to a GET or HEAD of the stored file `name` (relative to
+    MEDIA_ROOT), honouring conditional and range requests.
+    """
+    try:
+        path = safe_join(settings.MEDIA_ROOT, name)
+        stat = os.stat(path)
+    except (SuspiciousFileOperation, OSError):
+        raise Http404("no such file")
+    if not os.path.isfile(path):
+        raise Http404("no such file")
+
+    etag = etag_for(name, stat)
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(stat.st_mtime),
+        'Cache-Control': cache_control,
+        'Accept-Ranges': 'bytes',
+        'X-Content-Type-Options': 'nosniff',
+    }
+    content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+
+    response = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if response is None and SERVE_MODE == 'x-accel-redirect':
+        # nginx deals with Range itself
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = ACCEL_REDIRECT_PREFIX + quote(name)
+    elif response is None and SERVE_MODE == 'x-sendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = path
+    elif response is None:
+        response = _file_response(request, path, stat.st_size, content_type, etag, stat.st_mtime)
+
+    for header, value in headers.items():
+        response[header] = value
+    return response
+
+
+def _file_response(request, path, size, content_type, etag, last_modified):
+    byte_range = None
+    if 'HTTP_RANGE' in request.META and _if_range_passes(request, etag, last_modified):
+        try:
+            byte_range = parse_range(request.META['HTTP_RANGE'], size)
+        except RangeNotSatisfiable:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+
+    if byte_range is None:
+        return FileResponse(open(path, 'rb'), content_type=content_type)
+
+    first, last = byte_range
+    response = StreamingHttpResponse(_read_range(path, first, last - first + 1), status=206,
+                                     content_type=content_type)
+    response['Content-Range'] = f'bytes {first}-{last}/{size}'
+    response['Content-Length'] = str(last - first + 1)
+    return response
+
+
+def is_normalised(path):
+    # what the gate checks must be the file that is sent, so no '..', '.', empty or absolute segments
+    return all(part not in ('', '.', '..') for part in path.split('/'))
+
+
+@require_safe
+def serve(request, path):
+    if not is_normalised(path):
+        raise Http404
+    if signing.is_gated(path):
+        remaining = signing.verify(path, request.GET.get('expires'), request.GET.get('signature'))
+        if remaining is None:
+            return HttpResponseForbidden("this link has expired or is not valid")
+        # only the user's own browser may keep it, and no longer than the link lasts
+        cache_control = f'private, max-age={remaining}'
+    elif is_immutable(path):
+        cache_control = f'public, max-age={IMMUTABLE_CACHE_SECONDS}, immutable'
+    else:
+        cache_control = f'public, max-age={CACHE_SECONDS}'
+    return send_file(request, path, cache_control)
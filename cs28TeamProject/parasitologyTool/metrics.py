@@ -0,0 +1,337 @@
+"""
+Application metrics, served at /metrics in the Prometheus text format.
+
+The metrics are defined at the bottom of this file. MetricsMiddleware
+counts requests and their latency and SQL queries by URL name, and notes
+which users were active; the views, page_cache.py and objcache.py count
+the rest (likes, comments, uploads, cache lookups).
+
+Like view_counts.py, values are added up in memory. With METRICS_DIR set
+(e.g. under gunicorn, where each worker is a separate process), each
+process also writes its totals to its own file in that directory, from a
+background thread every METRICS_FLUSH_SECONDS and when it exits, and
+/metrics adds up the files of every process, so what one worker reports
+may be a few seconds behind the others. Files of processes that have exited are kept, so
+counters don't go down when a worker is restarted; empty the directory
+when the whole server is restarted. Without METRICS_DIR, /metrics reports
+this process only, which is right for runserver and a single worker.
+
+Active users are counted, not added up: a user seen by two workers in the
+last METRICS_ACTIVE_SECONDS counts once.
+
+/metrics is only served to admins, to requests with METRICS_TOKEN as a
+bearer token (what Prometheus' `authorization` scrape setting sends), and
+to METRICS_ALLOWED_IPS, which is empty by default. Behind a reverse proxy
+every request comes from the proxy's address, so only list addresses when
+the app server is reached directly.
+"""
+
+import atexit
+import bisect
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+
+from . import permissions
+from .middleware import SyncAndAsyncMiddleware, sql_wrapper
+
+NAMESPACE = 'parasitology'
+DIRECTORY = getattr(settings, 'METRICS_DIR', None)
+FLUSH_SECONDS = getattr(settings, 'METRICS_FLUSH_SECONDS', 5)
+ACTIVE_SECONDS = getattr(settings, 'METRICS_ACTIVE_SECONDS', 5 * 60)
+ALLOWED_IPS = getattr(settings, 'METRICS_ALLOWED_IPS', ())
+TOKEN = getattr(settings, 'METRICS_TOKEN', None)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+REGISTRY = {}
+
+_lock = threading.Lock()
+# one flush at a time, so an older snapshot can't overwrite a newer one
+_flush_lock = threading.Lock()
+# (metric name, label values): a number, or for histograms the count in each bucket, then the sum and count
+_values = {}
+# role: {user id: when they were last seen, as a unix time}
+_seen = {}
+# whether anything changed since the last flush
+_dirty = False
+_filename = None
+# the process the flushing thread was started in, as it doesn't survive a fork
+_flusher_pid = None
+
+
+def reset():
+    """Forgets this process's values, e.g. in a forked worker, which starts from nothing."""
+    global _filename, _dirty
+    with _lock:
+        _values.clear()
+        _seen.clear()
+        _filename = None
+        _dirty = False
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = f'{NAMESPACE}_{name}'
+        self.help = help
+        self.labels = tuple(labels)
+        REGISTRY[self.name] = self
+
+    def _key(self, labels):
+        return self.name, tuple(str(labels[name]) for name in self.labels)
+
+    def merge(self, total, value):
+        return total + value
+
+    def samples(self, values, active):
+        for (name, label_values), value in sorted(values.items()):
+            if name == self.name:
+                yield f'{self.name}{_labels(self.labels, label_values)} {_number(value)}'
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with _lock:
+            _values[key] = _values.get(key, 0) + amount
+            _changed()
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with _lock:
+            data = _values.setdefault(key, [0] * (len(self.buckets) + 2))
+            bucket = bisect.bisect_left(self.buckets, value)
+            if bucket < len(self.buckets):
+                data[bucket] += 1
+            data[-2] += value
+            data[-1] += 1
+            _changed()
+
+    def merge(self, total, value):
+        return [a + b for a, b in zip(total, value)]
+
+    def samples(self, values, active):
+        for (name, label_values), data in sorted(values.items()):
+            if name != self.name:
+                continue
+            cumulative = 0
+            for bound, count in zip(self.buckets, data):
+                cumulative += count
+                labels = _labels(self.labels, label_values, [('le', _number(bound))])
+                yield f'{self.name}_bucket{labels} {cumulative}'
+            yield f'{self.name}_bucket{_labels(self.labels, label_values, [("le", "+Inf")])} {_number(data[-1])}'
+            yield f'{self.name}_sum{_labels(self.labels, label_values)} {_number(data[-2])}'
+            yield f'{self.name}_count{_labels(self.labels, label_values)} {_number(data[-1])}'
+
+
+class ActiveUsers(Metric):
+    kind = 'gauge'
+
+    def seen(self, role, user_id):
+        with _lock:
+            _seen.setdefault(role, {})[user_id] = time.time()
+            _changed()
+
+    def samples(self, values, active):
+        for role, count in sorted(active.items()):
+            yield f'{self.name}{_labels(self.labels, [role])} {count}'
+
+
+def _recent(seen):
+    cutoff = time.time() - ACTIVE_SECONDS
+    return {role: {user_id: at for user_id, at in users.items() if at >= cutoff} for role, users in seen.items()}
+
+
+def flush():
+    """Writes this process's totals to its file in METRICS_DIR."""
+    global _filename, _dirty
+    if DIRECTORY is None:
+        return
+    with _flush_lock:
+        with _lock:
+            _seen.update(_recent(_seen))
+            data = {
+                'values': [[name, list(labels), value] for (name, labels), value in _values.items()],
+                'seen': {role: list(users.items()) for role, users in _seen.items()},
+            }
+            if _filename is None:
+                # not just the pid, which the OS may give a later worker
+                _filename = f'{os.getpid()}-{uuid.uuid4().hex[:8]}.json'
+            _dirty = False
+            path = os.path.join(DIRECTORY, _filename)
+        os.makedirs(DIRECTORY, exist_ok=True)
+        temporary = f'{path}.tmp'
+        with open(temporary, 'w') as file:
+            json.dump(data, file)
+        # readers see the old file or the new one, never half of one
+        os.replace(temporary, path)
+
+
+def _flush_regularly():
+    while True:
+        time.sleep(FLUSH_SECONDS)
+        if _dirty:
+            flush()
+
+
+def _changed():
+    # called holding _lock
+    global _dirty, _flusher_pid
+    _dirty = True
+    if DIRECTORY is not None and _flusher_pid != os.getpid():
+        _flusher_pid = os.getpid()
+        threading.Thread(target=_flush_regularly, name='metrics-flush', daemon=True).start()
+
+
+def collect():
+    """
+    The values of every process as {(name, label values): value}, and the
+    number of active users by role.
+    """
+    if DIRECTORY is None:
+        with _lock:
+            values = {key: list(value) if isinstance(value, list) else value for key, value in _values.items()}
+            seen = _recent(_seen)
+        return values, {role: len(users) for role, users in seen.items() if users}
+
+    flush()
+    values, seen = {}, {}
+    for filename in os.listdir(DIRECTORY):
+        if not filename.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(DIRECTORY, filename)) as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            # gone, e.g. the directory was emptied
+            continue
+        for name, labels, value in data['values']:
+            metric = REGISTRY.get(name)
+            if metric is None:
+                continue
+            key = (name, tuple(labels))
+            values[key] = metric.merge(values[key], value) if key in values else value
+        for role, users in data['seen'].items():
+            seen.setdefault(role, {}).update((user_id, at) for user_id, at in users)
+    return values, {role: len(users) for role, users in _recent(seen).items() if users}
+
+
+def uploads_added(kind, files):
+    UPLOADED_FILES.inc(len(files), kind=kind)
+    UPLOADED_BYTES.inc(sum(file.size for file in files), kind=kind)
+
+
+def exposition():
+    """Every metric in the Prometheus text format."""
+    values, active = collect()
+    lines = []
+    for metric in REGISTRY.values():
+        lines.append(f'# HELP {metric.name} {metric.help}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        lines.extend(metric.samples(values, active))
+    return '\n'.join(lines) + '\n'
+
+
+def _allowed(request):
+    if TOKEN and constant_time_compare(request.META.get('HTTP_AUTHORIZATION', ''), f'Bearer {TOKEN}'):
+        return True
+    return request.META.get('REMOTE_ADDR') in ALLOWED_IPS or permissions.has_permission(request.user, 'manage_users')
+
+
+def view(request):
+    if not _allowed(request):
+        return HttpResponseForbidden()
+    return HttpResponse(exposition(), content_type=CONTENT_TYPE)
+
+
+class QueryCounter:
+    def __init__(self):
+        self.queries = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+
+class MetricsMiddleware(SyncAndAsyncMiddleware):
+    """
+    Counts each request and its latency and SQL queries under its URL name.
+    Put it near the top of MIDDLEWARE, so that the other middleware is timed too.
+    """
+
+    def start(self, request, sync):
+        counter = QueryCounter()
+        stack = ExitStack()
+        stack.enter_context(sql_wrapper(counter, install=sync))
+        return counter, stack, sync, time.perf_counter()
+
+    def stop(self, request, state):
+        counter, stack, sync, start = state
+        stack.close()
+
+    def finish(self, request, response, state):
+        counter, stack, sync, start = state
+        seconds = time.perf_counter() - start
+        view_name = request.resolver_match.view_name if request.resolver_match else 'unresolved'
+        REQUESTS.inc(view=view_name, method=request.method, status=response.status_code)
+        LATENCY.observe(seconds, view=view_name)
+        QUERIES.observe(counter.queries, view=view_name)
+
+        # only if the request loaded the user anyway, so anonymous requests don't pay for a session lookup
+        user = getattr(request, '_cached_user', None)
+        # and in an async request, which can't query here, only if the role was looked up too
+        if user is not None and user.is_authenticated and (sync or hasattr(user, '_cached_role')):
+            ACTIVE_USERS.seen(permissions.user_role(user) or 'none', user.pk)
+        return response
+
+
+REQUESTS = Counter('http_requests_total', "Requests answered, by URL name, method and status.",
+                   ['view', 'method', 'status'])
+LATENCY = Histogram('http_request_duration_seconds', "Time taken to answer a request, by URL name.", ['view'])
+QUERIES = Histogram('db_queries_per_request', "SQL queries run by a request, by URL name.", ['view'],
+                    buckets=(0, 1, 2, 5, 10, 20, 50, 100))
+CACHE_LOOKUPS = Counter('cache_lookups_total',
+                        "Lookups in the page, fragment and object caches (see page_cache.py and objcache.py), "
+                        "by result.", ['cache', 'result'])
+UPLOADED_BYTES = Counter('uploaded_bytes_total', "Bytes of files attached to posts, by kind.", ['kind'])
+UPLOADED_FILES = Counter('uploaded_files_total', "Files attached to posts, by kind.", ['kind'])
+INTERACTIONS = Counter('interactions_total', "Posts, comments, replies, likes and dislikes, by kind.", ['kind'])
+ACTIVE_USERS = ActiveUsers('active_users', "Users who made a request in the last METRICS_ACTIVE_SECONDS, by role.",
+                           ['role'])
+
+atexit.register(flush)
+os.register_at_fork(after_in_child=reset)
@@ -0,0 +1,120 @@
+import asyncio
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.db import connections
+from django.utils.functional import SimpleLazyObject
+
+from .models import UserProfile
+
+# execute_wrapper()s added by the middleware for the current request, see sql_wrapper()
+_sql_wrappers = ContextVar('parasitologyTool.sql_wrappers', default=())
+
+
+def get_profile(request):
+    """
+    The logged in user's UserProfile, or None for anonymous users and users
+    without one. It is fetched at most once per request, however many
+    decorators and views ask for it.
+    """
+    if not hasattr(request, '_cached_profile'):
+        profile = None
+        if request.user.is_authenticated:
+            try:
+                profile = UserProfile.objects.get(user=request.user)
+            except UserProfile.DoesNotExist:
+                pass
+            else:
+                # saves a second query for profile.username
+                profile.user = request.user
+        request._cached_profile = profile
+    return request._cached_profile
+
+
+@contextmanager
+def sql_wrapper(wrapper, install=True):
+    """
+    Runs the request's queries through `wrapper`, as with
+    connection.execute_wrapper(), on every database. Connections belong to
+    a thread, so it is installed on this thread's connections (unless
+    `install` is false, as in an async request, whose thread is shared by
+    every request in flight), and remembered for the rest of the request
+    so that the threads async views run their queries in can install it
+    on theirs with installed_sql_wrappers().
+    """
+    token = _sql_wrappers.set(_sql_wrappers.get() + (wrapper,))
+    try:
+        with ExitStack() as stack:
+            if install:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(wrapper))
+            yield
+    finally:
+        _sql_wrappers.reset(token)
+
+
+@contextmanager
+def installed_sql_wrappers():
+    """Installs the current request's sql_wrapper()s on this thread's connections."""
+    with ExitStack() as stack:
+        for connection in connections.all():
+            for wrapper in _sql_wrappers.get():
+                stack.enter_context(connection.execute_wrapper(wrapper))
+        yield
+
+
+class SyncAndAsyncMiddleware:
+    """
+    Middleware that Django can run either way, so that under ASGI it doesn't
+    make Django run async views (see async_views.py) in a thread. Subclasses
+    override start(), which is called before the rest of the stack with
+    whether the request runs in a thread of its own (`sync`), stop(), called
+    after it even if it raised, and finish(), which may change the response.
+    None of them may block.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            # how Django's MiddlewareMixin marks __call__ as returning a coroutine
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        state = self.start(request, sync=True)
+        try:
+            response = self.get_response(request)
+        finally:
+            self.stop(request, state)
+        return self.finish(request, response, state)
+
+    async def __acall__(self, request):
+        state = self.start(request, sync=False)
+        try:
+            response = await self.get_response(request)
+        finally:
+            self.stop(request, state)
+        return self.finish(request, response, state)
+
+    def start(self, request, sync):
+        return None
+
+    def stop(self, request, state):
+        pass
+
+    def finish(self, request, response, state):
+        return response
+
+
+class UserProfileMiddleware(SyncAndAsyncMiddleware):
+    """
+    Adds a lazy request.profile, which only hits the database if something
+    uses it. Must come after AuthenticationMiddleware.
+    """
+
+    def start(self, request, sync):
+        request.profile = SimpleLazyObject(lambda: get_profile(request))
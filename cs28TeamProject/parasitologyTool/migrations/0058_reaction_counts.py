@@ -0,0 +1,40 @@
+from django.db import migrations, models
+
+
+def count_reactions(apps, schema_editor):
+    for model_name in ('Post', 'ResearchPost'):
+        model = apps.get_model('parasitologyTool', model_name)
+        for post in model.objects.annotate(likes_total=models.Count('likes', distinct=True),
+                                           dislikes_total=models.Count('dislikes', distinct=True)):
+            model.objects.filter(pk=post.pk).update(like_count=post.likes_total, dislike_count=post.dislikes_total)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parasitologyTool', '0057_reply_user'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='dislike_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='researchpost',
+            name='dislike_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='researchpost',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(count_reactions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 3.2.18 on 2026-10-18 13:00
+
+import math
+from datetime import datetime, timezone
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# the scoring of ranking.py as it was when this migration was written, so that later changes
+# to it don't change what this migration does; ranking.refresh() rescores posts as they change
+EPOCH = datetime(2021, 1, 1, tzinfo=timezone.utc)
+COMMENT_WEIGHT = 2
+DECAY_SECONDS = 7 * 24 * 60 * 60
+
+
+def hot_score(net_votes, date_posted):
+    order = math.log10(1 + abs(net_votes))
+    sign = (net_votes > 0) - (net_votes < 0)
+    return sign * order + (date_posted - EPOCH).total_seconds() / DECAY_SECONDS
+
+
+def score_posts(apps, schema_editor):
+    PostScore = apps.get_model('parasitologyTool', 'PostScore')
+    for model_name, portal, field in (('Post', 'clinical', 'clinical_post'),
+                                      ('ResearchPost', 'research', 'research_post')):
+        model = apps.get_model('parasitologyTool', model_name)
+        for post in model.objects.annotate(comments=models.Count('comment')):
+            net_votes = post.like_count - post.dislike_count + COMMENT_WEIGHT * post.comments
+            PostScore.objects.create(**{field: post}, parasite_id=post.parasite_id, portal=portal,
+                                     score=hot_score(net_votes, post.date_posted))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parasitologyTool', '0058_reaction_counts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PostScore',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('portal', models.CharField(choices=[('clinical', 'Clinical'), ('research', 'Research')], max_length=10)),
+                ('score', models.FloatField(default=0)),
+                ('clinical_post', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='parasitologyTool.post')),
+                ('parasite', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='parasitologyTool.parasite')),
+                ('research_post', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='parasitologyTool.researchpost')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='postscore',
+            index=models.Index(fields=['parasite', 'portal', '-score'], name='parasitolog_parasit_61d1af_idx'),
+        ),
+        migrations.RunPython(score_posts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,79 @@
+# Generated by Django 3.2.18 on 2026-10-18 14:00
+
+from django.db import migrations
+
+# search.py's table and indexing as they were when this migration was written, so that later
+# changes to it don't change what this migration does
+TABLE = 'parasitologyTool_searchindex'
+KINDS = {
+    'parasite': 1,
+    'article': 2,
+    'post': 3,
+    'researchpost': 4,
+    'comment': 5,
+}
+KIND_COUNT = 8
+MODELS = {
+    'parasite': 'Parasite',
+    'article': 'Article',
+    'post': 'Post',
+    'researchpost': 'ResearchPost',
+    'comment': 'Comment',
+}
+
+# an FTS5 table, so this needs SQLite (built with FTS5, which it is by default)
+CREATE_TABLE = f'''
+CREATE VIRTUAL TABLE "{TABLE}" USING fts5(
+    title, body,
+    kind UNINDEXED, object_id UNINDEXED, label UNINDEXED,
+    parasite_id UNINDEXED, post_id UNINDEXED, portal UNINDEXED,
+    tokenize = 'porter unicode61'
+)
+'''
+
+
+def document(kind, obj):
+    if kind == 'parasite':
+        return obj.name, obj.intro, obj.name, obj.id, None, 'public'
+    if kind == 'article':
+        return obj.title, obj.content, obj.title, obj.parasite_id, None, 'public'
+    if kind == 'post':
+        return obj.title, obj.content, obj.title, obj.parasite_id, None, 'clinical'
+    if kind == 'researchpost':
+        return obj.title, obj.content, obj.title, obj.parasite_id, None, 'research'
+    post = obj.clinical_post if obj.clinical_post_id else obj.research_post
+    if post is None:
+        return None
+    portal = 'clinical' if obj.clinical_post_id else 'research'
+    return '', obj.comment_text, post.title, post.parasite_id, post.id, portal
+
+
+def index_content(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        for kind, model_name in MODELS.items():
+            queryset = apps.get_model('parasitologyTool', model_name).objects.all()
+            if kind == 'comment':
+                queryset = queryset.select_related('clinical_post', 'research_post')
+            for obj in queryset.iterator():
+                row = document(kind, obj)
+                if row is None:
+                    continue
+                title, body, label, parasite_id, post_id, portal = row
+                cursor.execute(
+                    f'INSERT INTO "{TABLE}" (rowid, title, body, kind, object_id, label, parasite_id, post_id, portal) '
+                    f'VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)',
+                    [obj.pk * KIND_COUNT + KINDS[kind], title, body, kind, obj.pk, label, parasite_id, post_id,
+                     portal],
+                )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parasitologyTool', '0059_post_score'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_TABLE, f'DROP TABLE "{TABLE}"'),
+        migrations.RunPython(index_content, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 3.2.18 on 2026-10-18 13:07
+
+from django.db import migrations, models
+
+
+def normalize_username(username):
+    # models.normalize_username as it was when this migration was written
+    return username.casefold()
+
+
+def normalize_usernames(apps, schema_editor):
+    UserProfile = apps.get_model('parasitologyTool', 'UserProfile')
+    for profile in UserProfile.objects.select_related('user'):
+        profile.username_normalized = normalize_username(profile.user.username)
+        profile.save(update_fields=['username_normalized'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parasitologyTool', '0060_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='username_normalized',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=150),
+        ),
+        migrations.RunPython(normalize_usernames, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.2.18 on 2026-10-18 13:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parasitologyTool', '0062_background_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='clinicalimage',
+            name='sha256',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='researchfile',
+            name='sha256',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='researchimage',
+            name='sha256',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.2.18 on 2026-10-18 13:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parasitologyTool', '0063_attachment_sha256'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='researchfile',
+            name='original_name',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='clinicalimage',
+            name='image',
+            field=models.ImageField(blank=True, default=None, null=True, upload_to='private/clinical_pictures'),
+        ),
+        migrations.AlterField(
+            model_name='researchfile',
+            name='file',
+            field=models.FileField(default=None, upload_to='private/files'),
+        ),
+        migrations.AlterField(
+            model_name='researchimage',
+            name='image',
+            field=models.ImageField(default=None, upload_to='private/clinical_pictures'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 3.2.18 on 2026-10-18 13:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parasitologyTool', '0064_private_attachments'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='article',
+            index=models.Index(fields=['-date_posted', '-id'], name='article_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='article',
+            index=models.Index(fields=['parasite', '-date_posted', '-id'], name='article_parasite_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['research_post', '-date_posted', '-id'], name='comment_research_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['clinical_post', '-date_posted', '-id'], name='comment_clinical_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='parasite',
+            index=models.Index(fields=['-views'], name='parasite_views_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['parasite', '-date_posted', '-id'], name='post_parasite_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['user', '-date_posted', '-id'], name='post_user_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='researchpost',
+            index=models.Index(fields=['parasite', '-date_posted', '-id'], name='researchpost_parasite_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='researchpost',
+            index=models.Index(fields=['user', '-date_posted', '-id'], name='researchpost_user_date_idx'),
+        ),
+    ]
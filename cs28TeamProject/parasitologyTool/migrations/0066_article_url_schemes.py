@@ -0,0 +1,19 @@
+# Generated by Django 3.2.18 on 2026-10-18 14:13
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('parasitologyTool', '0065_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='article',
+            name='url',
+            field=models.URLField(validators=[django.core.validators.URLValidator(schemes=['http', 'https'])]),
+        ),
+    ]
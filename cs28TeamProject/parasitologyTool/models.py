@@ -1,11 +1,14 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.core.validators import URLValidator
 from django.template.defaultfilters import slugify
 from django.utils import timezone
-from sympy import true
 
 # Create your models here.
 
+def normalize_username(username):
+	return username.casefold()
+
 class UserProfile(models.Model):
 
 	user = models.OneToOneField(User, on_delete=models.CASCADE)
@@ -21,9 +24,16 @@ class UserProfile(models.Model):
 
 	role = models.CharField(max_length=50, choices=ROLE_CHOICES, default='Public')
 
+	# the username casefolded, for indexed prefix search; see parasitologyTool.search.search_users
+	username_normalized = models.CharField(max_length=150, db_index=True, default='', editable=False)
+
 	@property
 	def username(self):
 		return self.user.username
+
+	def save(self, *args, **kwargs):
+		self.username_normalized = normalize_username(self.user.username)
+		super(UserProfile, self).save(*args, **kwargs)
 		
 	def __str__(self):
 		return self.user.username
@@ -43,12 +53,19 @@ class Parasite(models.Model):
 	def __str__(self):
 		return self.name
 
+	class Meta:
+		# the most viewed parasites on the public pages
+		indexes = [models.Index(fields=['-views'], name='parasite_views_idx')]
+
 class Post(models.Model):
 	title = models.CharField(max_length=100)
 	content = models.TextField()
 	parasite = models.ForeignKey(Parasite, on_delete=models.CASCADE, default=None)
 	likes = models.ManyToManyField(User, blank=True, related_name="clinical_likes")
 	dislikes = models.ManyToManyField(User, blank=True, related_name="clinical_dislikes")
+	# kept in step with likes/dislikes by parasitologyTool.reactions
+	like_count = models.PositiveIntegerField(default=0)
+	dislike_count = models.PositiveIntegerField(default=0)
 	user = models.ForeignKey(UserProfile, on_delete=models.CASCADE, default=None)
 	date_posted = models.DateTimeField(default=timezone.now)
 
@@ -69,16 +86,23 @@ class Post(models.Model):
 
 	class Meta:
 		ordering = ['-date_posted',]
+		# the listings page through posts on (date_posted, id), see parasitologyTool.pagination
+		indexes = [
+			models.Index(fields=['parasite', '-date_posted', '-id'], name='post_parasite_date_idx'),
+			models.Index(fields=['user', '-date_posted', '-id'], name='post_user_date_idx'),
+		]
 
 class Article(models.Model):
 	TITLE_MAX_LENGTH = 128
 	URL_MAX_LENGTH = 200
+	# what goto_article may redirect to
+	URL_SCHEMES = ['http', 'https']
 	
 	parasite = models.ForeignKey(Parasite, on_delete=models.CASCADE, default=None)
 	title = models.CharField(max_length=TITLE_MAX_LENGTH, unique=True)
 	content = models.TextField(default=None)
 	user = models.ForeignKey(UserProfile, on_delete=models.CASCADE, default=None)
-	url = models.URLField(max_length=URL_MAX_LENGTH)
+	url = models.URLField(max_length=URL_MAX_LENGTH, validators=[URLValidator(schemes=URL_SCHEMES)])
 	views = models.IntegerField(default=0)
 	picture = models.ImageField(upload_to='article_pic')
 	date_posted = models.DateTimeField(default=timezone.now)
@@ -88,15 +112,22 @@ class Article(models.Model):
 	
 	class Meta:
 		ordering = ['-date_posted',]
+		indexes = [
+			models.Index(fields=['-date_posted', '-id'], name='article_date_idx'),
+			models.Index(fields=['parasite', '-date_posted', '-id'], name='article_parasite_date_idx'),
+		]
 
 class ResearchPost(models.Model):
 	title = models.CharField(max_length=100)
 	content = models.TextField()
 	parasite = models.ForeignKey(Parasite, on_delete=models.CASCADE, default=None)
-	#image = models.ImageField(upload_to='clinical_pictures', default=None)
-	#file = models.FileField(upload_to='files', default=None)
+	#image = models.ImageField(upload_to='private/clinical_pictures', default=None)
+	#file = models.FileField(upload_to='private/files', default=None)
 	likes = models.ManyToManyField(User, blank=True, related_name="likes")
 	dislikes = models.ManyToManyField(User, blank=True, related_name="dislikes")
+	# kept in step with likes/dislikes by parasitologyTool.reactions
+	like_count = models.PositiveIntegerField(default=0)
+	dislike_count = models.PositiveIntegerField(default=0)
 	user = models.ForeignKey(UserProfile, on_delete=models.CASCADE, default=None)
 	date_posted = models.DateTimeField(default=timezone.now)
 
@@ -123,18 +154,42 @@ class ResearchPost(models.Model):
 
 	class Meta:
 		ordering = ['-date_posted',]
+		indexes = [
+			models.Index(fields=['parasite', '-date_posted', '-id'], name='researchpost_parasite_date_idx'),
+			models.Index(fields=['user', '-date_posted', '-id'], name='researchpost_user_date_idx'),
+		]
+
+# where an attachment is in its background post-processing (see parasitologyTool.jobs);
+# attachments are uploaded to private/, which is only served through signed URLs
+PROCESSING_CHOICES = [
+	('pending', 'Pending'),
+	('ready', 'Ready'),
+	('failed', 'Failed'),
+]
 
 class ResearchImage(models.Model):
 	research_post = models.ForeignKey(ResearchPost, on_delete=models.CASCADE, default=None)
-	image = models.ImageField(upload_to='clinical_pictures', default=None)
+	image = models.ImageField(upload_to='private/clinical_pictures', default=None)
+	status = models.CharField(max_length=10, choices=PROCESSING_CHOICES, default='pending')
+	sha256 = models.CharField(max_length=64, blank=True)
 
 class ResearchFile(models.Model):
 	research_post = models.ForeignKey(ResearchPost, on_delete=models.CASCADE, default=None)
-	file = models.FileField(upload_to='files', default=None)
+	file = models.FileField(upload_to='private/files', default=None)
+	status = models.CharField(max_length=10, choices=PROCESSING_CHOICES, default='pending')
+	sha256 = models.CharField(max_length=64, blank=True)
+	# the name it was uploaded with; the stored name is its hash (see parasitologyTool.storage)
+	original_name = models.CharField(max_length=255, blank=True)
+
+	@property
+	def display_name(self):
+		return self.original_name or self.file.name.rsplit('/', 1)[-1]
 
 class ClinicalImage(models.Model):
 	clinical_post = models.ForeignKey(Post, on_delete=models.CASCADE, default=None)
-	image = models.ImageField(upload_to='clinical_pictures', default=None, blank=True, null=True)
+	image = models.ImageField(upload_to='private/clinical_pictures', default=None, blank=True, null=True)
+	status = models.CharField(max_length=10, choices=PROCESSING_CHOICES, default='pending')
+	sha256 = models.CharField(max_length=64, blank=True)
 
 class Comment(models.Model):
 	comment_text = models.TextField()
@@ -152,6 +207,10 @@ class Comment(models.Model):
 	
 	class Meta:
 		ordering = ['-date_posted',]
+		indexes = [
+			models.Index(fields=['research_post', '-date_posted', '-id'], name='comment_research_date_idx'),
+			models.Index(fields=['clinical_post', '-date_posted', '-id'], name='comment_clinical_date_idx'),
+		]
 
 class Reply(models.Model):
 	reply_text = models.TextField()
@@ -161,6 +220,25 @@ class Reply(models.Model):
 	def __str__(self):
 		return self.reply_text
 
+class PostScore(models.Model):
+	# one row per post, maintained by parasitologyTool.ranking, for the "most popular" sidebars
+	PORTAL_CHOICES = [
+		('clinical', 'Clinical'),
+		('research', 'Research'),
+	]
+
+	parasite = models.ForeignKey(Parasite, on_delete=models.CASCADE)
+	portal = models.CharField(max_length=10, choices=PORTAL_CHOICES)
+	clinical_post = models.OneToOneField(Post, on_delete=models.CASCADE, null=True, blank=True)
+	research_post = models.OneToOneField(ResearchPost, on_delete=models.CASCADE, null=True, blank=True)
+	score = models.FloatField(default=0)
+
+	@property
+	def post(self):
+		return self.clinical_post if self.portal == 'clinical' else self.research_post
+
+	class Meta:
+		indexes = [models.Index(fields=['parasite', 'portal', '-score'])]
 
 
 
@@ -169,3 +247,28 @@ class Reply(models.Model):
 
 
 
+
+
+class Job(models.Model):
+	# a task for the background workers; see parasitologyTool.jobs
+	STATUS_CHOICES = [
+		('pending', 'Pending'),
+		('running', 'Running'),
+		('failed', 'Failed'),
+	]
+
+	task = models.CharField(max_length=100)
+	args = models.JSONField(default=list)
+	status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+	attempts = models.PositiveSmallIntegerField(default=0)
+	max_attempts = models.PositiveSmallIntegerField(default=3)
+	run_after = models.DateTimeField(default=timezone.now)
+	locked_at = models.DateTimeField(null=True, blank=True)
+	last_error = models.TextField(blank=True)
+	created = models.DateTimeField(default=timezone.now)
+
+	def __str__(self):
+		return f'{self.task}{tuple(self.args)}'
+
+	class Meta:
+		indexes = [models.Index(fields=['status', 'run_after'])]
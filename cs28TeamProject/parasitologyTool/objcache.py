@@ -0,0 +1,262 @@
+"""
+A read-through cache of the rows behind the detail pages and the article
+listings.
+
+Each cached object is stored under its kind, pk and the row's version:
+
+    parasitologyTool:object:clinical_post:42:1700000000123456789
+
+The version lives in the shared cache and is bumped whenever the row (or
+something stored with it, such as a post's images) is saved or deleted,
+and again once the transaction commits, in case a request loaded the old
+row in between. Nothing is ever deleted or overwritten: a bump just means
+readers look for a key that isn't there yet, and the old entries expire.
+
+Reading an object costs one get of its version from the shared cache.
+In front of the shared cache each process keeps the last
+OBJECT_CACHE_LOCAL_SIZE objects it used, so with a shared backend such as
+Redis (see CACHE_BACKEND in settings.py) the object itself usually doesn't
+have to cross the network. Objects are kept pickled and unpickled on every
+get(), so callers each get their own copy to change.
+
+A post's or article's author is a separate kind ('profile'), so that a
+renamed user or a new profile picture doesn't go stale on all of their
+posts. get_many() loads several objects of a kind at once, for lists such
+as the popular posts sidebar; cached_page() uses it for a page of a
+listing, whose query then only has to find the ids. stats() counts hits on each tier in this process, and
+metrics.py counts them across processes for /metrics.
+
+Like and dislike counts, and attachments, are changed with update() and
+bulk_create(), which send no signals, so reactions.py and attachments.py
+call bump() themselves.
+"""
+
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+
+from . import metrics
+from .models import Article, ClinicalImage, Parasite, Post, ResearchFile, ResearchImage, ResearchPost, UserProfile
+
+CACHE_ALIAS = getattr(settings, 'OBJECT_CACHE_ALIAS', 'default')
+SECONDS = getattr(settings, 'OBJECT_CACHE_SECONDS', 60 * 60)
+LOCAL_SIZE = getattr(settings, 'OBJECT_CACHE_LOCAL_SIZE', 1000)
+
+
+class LocalCache:
+    """A bounded least-recently-used dict, safe to share between threads."""
+
+    def __init__(self, size):
+        self.size = size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+
+_local = LocalCache(LOCAL_SIZE)
+_stats = {'local_hits': 0, 'shared_hits': 0, 'misses': 0}
+_stats_lock = threading.Lock()
+# counter in _stats: result label of metrics.CACHE_LOOKUPS
+_RESULTS = {'local_hits': 'local_hit', 'shared_hits': 'shared_hit', 'misses': 'miss'}
+
+# kind: (model, load(pks) -> iterable of instances, finish(instances) or None)
+KINDS = {}
+
+
+def _cache():
+    return caches[CACHE_ALIAS]
+
+
+def _version_key(model, pk):
+    return f'parasitologyTool:version:{model._meta.label_lower}:{pk}'
+
+
+def _versions(model, pks):
+    cache = _cache()
+    keys = {pk: _version_key(model, pk) for pk in pks}
+    found = cache.get_many(keys.values())
+    versions = {}
+    for pk, key in keys.items():
+        if key not in found:
+            # start from the clock rather than 1, so that a version that was evicted can't come back
+            # to a number that old copies were cached under
+            cache.add(key, time.time_ns(), None)
+            found[key] = cache.get(key, 0)
+        versions[pk] = found[key]
+    return versions
+
+
+def bump(model, pk):
+    """Makes readers of the row load it afresh."""
+    try:
+        _cache().incr(_version_key(model, pk))
+    except ValueError:
+        # no version yet, so the next reader starts a new one
+        pass
+
+
+def bump_on_commit(model, pk):
+    bump(model, pk)
+    transaction.on_commit(lambda: bump(model, pk))
+
+
+def _count(counter, n=1):
+    with _stats_lock:
+        _stats[counter] += n
+    if n:
+        metrics.CACHE_LOOKUPS.inc(n, cache='object', result=_RESULTS[counter])
+
+
+def get_many(kind, pks):
+    """The objects of `kind` with the given pks, as {pk: object}. Missing rows are left out."""
+    model, load, finish = KINDS[kind]
+    pks = list(dict.fromkeys(model._meta.pk.to_python(pk) for pk in pks))
+    if not pks:
+        return {}
+    versions = _versions(model, pks)
+    keys = {pk: f'parasitologyTool:object:{kind}:{pk}:{versions[pk]}' for pk in pks}
+
+    found = {}
+    for pk in pks:
+        data = _local.get(keys[pk])
+        if data is not None:
+            found[pk] = data
+    _count('local_hits', len(found))
+
+    missing = [pk for pk in pks if pk not in found]
+    if missing:
+        shared = _cache().get_many([keys[pk] for pk in missing])
+        for pk in missing:
+            if keys[pk] in shared:
+                found[pk] = shared[keys[pk]]
+                _local.set(keys[pk], found[pk])
+                _count('shared_hits')
+        missing = [pk for pk in missing if pk not in found]
+
+    if missing:
+        _count('misses', len(missing))
+        loaded = {obj.pk: pickle.dumps(obj, pickle.HIGHEST_PROTOCOL) for obj in load(missing)}
+        _cache().set_many({keys[pk]: data for pk, data in loaded.items()}, SECONDS)
+        for pk, data in loaded.items():
+            _local.set(keys[pk], data)
+        found.update(loaded)
+
+    objects = {pk: pickle.loads(found[pk]) for pk in pks if pk in found}
+    if finish is not None:
+        finish(list(objects.values()))
+    return objects
+
+
+def cached_page(kind, page):
+    """
+    The pagination.Page with its items swapped for their cached objects, so
+    the listing's query need only load ids and the fields the cursor uses.
+    """
+    objects = get_many(kind, [item.pk for item in page.items])
+    return page._replace(items=[objects[item.pk] for item in page.items if item.pk in objects])
+
+
+def get(kind, pk):
+    """Like Model.objects.get(pk=pk), raising DoesNotExist for a missing row."""
+    model = KINDS[kind][0]
+    try:
+        pk = model._meta.pk.to_python(pk)
+    except ValidationError:
+        raise model.DoesNotExist(f"{pk!r} is not a valid {model.__name__} id.")
+    obj = get_many(kind, [pk]).get(pk) if pk is not None else None
+    if obj is None:
+        raise model.DoesNotExist(f"{model.__name__} matching query does not exist.")
+    return obj
+
+
+def stats():
+    with _stats_lock:
+        result = dict(_stats)
+    lookups = sum(result.values())
+    result['hit_ratio'] = (result['local_hits'] + result['shared_hits']) / lookups if lookups else None
+    result['local_size'] = len(_local)
+    return result
+
+
+def clear_local():
+    _local.clear()
+
+
+def _attach_authors(posts):
+    profiles = get_many('profile', [post.user_id for post in posts])
+    for post in posts:
+        if post.user_id in profiles:
+            post.user = profiles[post.user_id]
+
+
+KINDS.update({
+    'parasite': (Parasite, lambda pks: Parasite.objects.filter(pk__in=pks), None),
+    'article': (Article, lambda pks: Article.objects.filter(pk__in=pks), _attach_authors),
+    'profile': (UserProfile, lambda pks: UserProfile.objects.filter(pk__in=pks).select_related('user'), None),
+    'clinical_post': (Post, lambda pks: Post.objects.filter(pk__in=pks).prefetch_related('clinicalimage_set'),
+                      _attach_authors),
+    'research_post': (ResearchPost, lambda pks: ResearchPost.objects.filter(pk__in=pks).prefetch_related(
+        'researchimage_set', 'researchfile_set'), _attach_authors),
+})
+
+# attachment model: the post field it belongs to
+ATTACHMENTS = {
+    ClinicalImage: (Post, 'clinical_post_id'),
+    ResearchImage: (ResearchPost, 'research_post_id'),
+    ResearchFile: (ResearchPost, 'research_post_id'),
+}
+
+
+def row_changed(sender, instance, **kwargs):
+    bump_on_commit(sender, instance.pk)
+
+
+def attachment_changed(sender, instance, **kwargs):
+    post_model, field = ATTACHMENTS[sender]
+    bump_on_commit(post_model, getattr(instance, field))
+
+
+def user_saved(sender, instance, update_fields=None, **kwargs):
+    # logging in saves last_login, which isn't cached
+    if update_fields is not None and 'username' not in update_fields:
+        return
+    for pk in UserProfile.objects.filter(user_id=instance.pk).values_list('pk', flat=True):
+        bump_on_commit(UserProfile, pk)
+
+
+def connect_signals():
+    for model in (Parasite, Article, Post, ResearchPost, UserProfile):
+        post_save.connect(row_changed, sender=model, dispatch_uid=f'objcache.{model.__name__}_saved')
+        post_delete.connect(row_changed, sender=model, dispatch_uid=f'objcache.{model.__name__}_deleted')
+    for model in ATTACHMENTS:
+        post_save.connect(attachment_changed, sender=model, dispatch_uid=f'objcache.{model.__name__}_saved')
+        post_delete.connect(attachment_changed, sender=model, dispatch_uid=f'objcache.{model.__name__}_deleted')
+    post_save.connect(user_saved, sender=User, dispatch_uid='objcache.user_saved')
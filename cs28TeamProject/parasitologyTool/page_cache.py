@@ -0,0 +1,127 @@
+"""
+Caching of the public pages.
+
+The public pages look the same to every visitor who isn't logged in, so
+views decorated with @cache_public_page keep their anonymous responses in
+the PAGE_CACHE_ALIAS cache for PAGE_CACHE_SECONDS, and the parasite list
+in the sidebar of every page is kept as rendered HTML (see fragment()).
+Logged in users always get a freshly rendered page.
+
+Every key includes a generation number, which is bumped whenever a
+Parasite or Article is saved or deleted, so everything cached from the old
+rows is dropped at once without having to know which keys were used. It
+is bumped again when the transaction commits, in case a request rendered
+the old rows in between. Other changes (view counts, thumbnails being
+made) show up once the page expires.
+
+The backend is chosen with CACHES (CACHE_BACKEND in settings.py). With
+the local-memory backend each worker process has its own copy and only
+sees its own invalidations; use the file or Redis backend to share one
+cache between processes.
+"""
+
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+
+from . import metrics
+from .models import Article, Parasite
+
+CACHE_ALIAS = getattr(settings, 'PAGE_CACHE_ALIAS', 'default')
+PAGE_SECONDS = getattr(settings, 'PAGE_CACHE_SECONDS', 60)
+FRAGMENT_SECONDS = getattr(settings, 'FRAGMENT_CACHE_SECONDS', 60 * 60)
+
+_GENERATION_KEY = 'parasitologyTool:public:generation'
+
+
+def _cache():
+    return caches[CACHE_ALIAS]
+
+
+def generation():
+    cache = _cache()
+    value = cache.get(_GENERATION_KEY)
+    if value is None:
+        # start from the clock rather than 1, so that if the counter is evicted it can't come back
+        # to a number that pages from before were cached under
+        cache.add(_GENERATION_KEY, time.time_ns(), None)
+        value = cache.get(_GENERATION_KEY, 0)
+    return value
+
+
+def invalidate():
+    """Drops every cached page and fragment."""
+    cache = _cache()
+    try:
+        cache.incr(_GENERATION_KEY)
+    except ValueError:
+        # not set (or evicted), which is as good as a new generation
+        cache.add(_GENERATION_KEY, time.time_ns(), None)
+
+
+def _key(kind, *parts):
+    digest = hashlib.md5(':'.join(str(part) for part in parts).encode()).hexdigest()
+    return f'parasitologyTool:{kind}:{generation()}:{digest}'
+
+
+def cache_public_page(view):
+    """
+    Serves anonymous GET and HEAD requests for the view from the cache.
+    Only complete 200 responses that don't set cookies are cached.
+    """
+    @wraps(view)
+    def wrap(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD') or request.user.is_authenticated:
+            return view(request, *args, **kwargs)
+
+        cache = _cache()
+        key = _key('page', request.get_full_path())
+        cached = cache.get(key)
+        metrics.CACHE_LOOKUPS.inc(cache='page', result='hit' if cached is not None else 'miss')
+        if cached is not None:
+            content_type, content = cached
+            response = HttpResponse(content, content_type=content_type)
+        else:
+            response = view(request, *args, **kwargs)
+            if (response.status_code == 200 and not response.streaming and not response.cookies
+                    and not request.META.get('CSRF_COOKIE_USED')):
+                cache.set(key, (response['Content-Type'], response.content), PAGE_SECONDS)
+        # logged in users get another page for the same URL
+        patch_vary_headers(response, ('Cookie',))
+        return response
+    return wrap
+
+
+def fragment(name, render, *vary_on):
+    """
+    The HTML returned by render(), cached under `name` and the values it
+    depends on.
+    """
+    cache = _cache()
+    key = _key('fragment', name, *vary_on)
+    html = cache.get(key)
+    metrics.CACHE_LOOKUPS.inc(cache='fragment', result='hit' if html is not None else 'miss')
+    if html is None:
+        html = render()
+        cache.set(key, html, FRAGMENT_SECONDS)
+    return html
+
+
+def public_content_changed(sender, **kwargs):
+    invalidate()
+    transaction.on_commit(invalidate)
+
+
+def connect_signals():
+    for model in (Parasite, Article):
+        post_save.connect(public_content_changed, sender=model,
+                          dispatch_uid=f'page_cache.{model.__name__}_saved')
+        post_delete.connect(public_content_changed, sender=model,
+                            dispatch_uid=f'page_cache.{model.__name__}_deleted')
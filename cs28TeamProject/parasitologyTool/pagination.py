@@ -0,0 +1,93 @@
+"""
+Keyset (cursor) pagination for the post, article and comment listings.
+
+Pages are ordered newest first on (date_posted, id) and each page continues
+from the last row of the one before it, so fetching page 50 costs the same
+as fetching page 1 - there is no OFFSET for the database to scan through.
+The cursor handed to the client is an opaque token for that last row.
+
+paginate_merged() lists rows of several models together, whose ids can
+be equal, so ties on date_posted are broken on the model's label before
+the id, and the cursor records the label too.
+"""
+
+import base64
+import binascii
+import json
+from collections import namedtuple
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+PAGE_SIZE = getattr(settings, 'LISTING_PAGE_SIZE', 20)
+
+Page = namedtuple('Page', ['items', 'next_cursor'])
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def _sort_key(obj):
+    return obj.date_posted, obj._meta.label, obj.pk
+
+
+def encode_cursor(obj):
+    payload = json.dumps([obj.date_posted.isoformat(), obj.pk, obj._meta.label])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """The (date_posted, pk, label) of the row the cursor is for; label is None in older cursors."""
+    try:
+        payload = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        date_posted, pk, *label = json.loads(payload)
+        date_posted = parse_datetime(date_posted)
+        pk = int(pk)
+        label = str(label[0]) if label else None
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError):
+        raise InvalidCursor(cursor)
+    if date_posted is None:
+        raise InvalidCursor(cursor)
+    return date_posted, pk, label
+
+
+def _after(queryset, cursor):
+    queryset = queryset.order_by('-date_posted', '-pk')
+    if not cursor:
+        return queryset
+    date_posted, pk, label = decode_cursor(cursor)
+    own_label = queryset.model._meta.label
+    if label is None or label == own_label:
+        return queryset.filter(Q(date_posted__lt=date_posted) | Q(date_posted=date_posted, pk__lt=pk))
+    # another model's row: at the same date_posted, ours come after it if our label sorts first
+    if own_label < label:
+        return queryset.filter(date_posted__lte=date_posted)
+    return queryset.filter(date_posted__lt=date_posted)
+
+
+def _page(items, page_size):
+    # one extra row was fetched to find out whether there is another page
+    if len(items) > page_size:
+        items = items[:page_size]
+        return Page(items, encode_cursor(items[-1]))
+    return Page(items, None)
+
+
+def paginate(queryset, cursor=None, page_size=PAGE_SIZE):
+    """Returns the page of `queryset` that follows `cursor` (the first page if it is empty)."""
+    return _page(list(_after(queryset, cursor)[:page_size + 1]), page_size)
+
+
+def paginate_merged(querysets, cursor=None, page_size=PAGE_SIZE):
+    """
+    Paginates several querysets as if they were one listing, e.g. a user's
+    clinical and research posts. Each queryset contributes at most one page,
+    which are then merged in Python.
+    """
+    items = []
+    for queryset in querysets:
+        items.extend(_after(queryset, cursor)[:page_size + 1])
+    items.sort(key=_sort_key, reverse=True)
+    return _page(items, page_size)
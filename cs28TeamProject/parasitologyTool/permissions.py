@@ -0,0 +1,120 @@
+"""
+Role based access control.
+
+What each role may do is listed in ROLE_PERMISSIONS, and every check goes
+through has_permission(). A user's role is cached (in the request's user
+object and in Django's cache) so that the checks on hot pages don't query
+the database; saving a UserProfile, e.g. when an admin changes someone's
+role in AdminManage, drops the cached role straight away.
+
+With the default local-memory cache each worker process has its own copy,
+so a role change reaches other processes when their copy expires after
+PERMISSION_CACHE_SECONDS. Point CACHES at a shared backend to make it
+immediate everywhere.
+"""
+
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.auth.views import redirect_to_login
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.http import HttpResponse
+
+from .models import UserProfile
+
+CACHE_SECONDS = getattr(settings, 'PERMISSION_CACHE_SECONDS', 300)
+
+ROLE_PERMISSIONS = {
+    'clinician': {'clinical_portal', 'research_portal'},
+    'researcher': {'research_portal'},
+    'public': set(),
+    'admin': {'manage_users'},
+}
+
+PORTALS = ('clinical', 'research')
+
+
+def _cache_key(user_id):
+    return f'parasitologyTool:role:{user_id}'
+
+
+def user_role(user):
+    """The user's role, or None for anonymous users and users without a profile."""
+    if not user.is_authenticated:
+        return None
+    if not hasattr(user, '_cached_role'):
+        role = cache.get(_cache_key(user.pk))
+        if role is None:
+            role = UserProfile.objects.filter(user=user).values_list('role', flat=True).first() or ''
+            cache.set(_cache_key(user.pk), role, CACHE_SECONDS)
+        user._cached_role = role
+    return user._cached_role or None
+
+
+def has_permission(user, permission):
+    return permission in ROLE_PERMISSIONS.get(user_role(user), ())
+
+
+def has_portal_access(user, portal):
+    if portal not in PORTALS:
+        raise ValueError(f"unknown portal {portal!r}")
+    return has_permission(user, f'{portal}_portal')
+
+
+def invalidate(user_id):
+    cache.delete(_cache_key(user_id))
+
+
+def not_authorised():
+    return HttpResponse("you are not authorised to view this page")
+
+
+def permission_required(permission):
+    """Decorator for function based views."""
+    def decorator(function):
+        @wraps(function)
+        def wrap(request, *args, **kwargs):
+            if not request.user.is_authenticated:
+                return redirect_to_login(request.get_full_path())
+            if not has_permission(request.user, permission):
+                return not_authorised()
+            return function(request, *args, **kwargs)
+        return wrap
+    return decorator
+
+
+def portal_required(portal):
+    if portal not in PORTALS:
+        raise ValueError(f"unknown portal {portal!r}")
+    return permission_required(f'{portal}_portal')
+
+
+class PermissionRequiredMixin:
+    """
+    For class based views. Set `permission`, or `portal` for one of the
+    portal permissions.
+    """
+    permission = None
+    portal = None
+
+    def get_permission(self):
+        if self.portal is not None:
+            return f'{self.portal}_portal'
+        return self.permission
+
+    def dispatch(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        if not has_permission(request.user, self.get_permission()):
+            return not_authorised()
+        return super().dispatch(request, *args, **kwargs)
+
+
+def profile_changed(sender, instance, **kwargs):
+    invalidate(instance.user_id)
+
+
+def connect_signals():
+    post_save.connect(profile_changed, sender=UserProfile, dispatch_uid='permissions.profile_saved')
+    post_delete.connect(profile_changed, sender=UserProfile, dispatch_uid='permissions.profile_deleted')
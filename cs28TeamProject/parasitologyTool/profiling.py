@@ -0,0 +1,262 @@
+"""
+Per-request profiling, for finding out where the time goes.
+
+It is off unless PROFILING is set (the PROFILING environment variable,
+see settings.py), and then costs nothing: the middleware takes itself out
+of the stack at startup. When it is on, ProfilingMiddleware records for
+every request:
+
+* the total time,
+* the time spent in SQL and the number of queries, with
+  connection.execute_wrapper(),
+* the time spent rendering each template, including the ones pulled in
+  with {% include %} and {% extends %},
+* queries that ran more than once with only their parameters changed
+  (the same fingerprint), which usually means an N+1.
+
+They are sent back in a Server-Timing header, which browsers show in the
+network panel, and logged as one line of JSON per request on the
+'parasitologyTool.profiling' logger.
+
+With PROFILING_SAMPLER set, where the time went in requests slower than
+PROFILING_SLOW_MS is saved in PROFILING_DIR as well:
+
+* 'stacks': a background thread samples the stack of every running request
+  each PROFILING_SAMPLE_INTERVAL_MS, and slow requests' samples are written
+  in the folded format that flamegraph.pl and speedscope read. This is
+  cheap enough to leave on under load.
+* 'cprofile': every request runs under cProfile, and the slow ones are
+  saved for pstats or snakeviz. This makes every request a lot slower.
+
+Both follow the thread serving the request, so they leave out async
+requests (see async_views.py), which share theirs with every other one.
+"""
+
+import cProfile
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack
+from contextvars import ContextVar
+from datetime import datetime
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.template.base import Template
+
+from .middleware import SyncAndAsyncMiddleware, sql_wrapper
+
+logger = logging.getLogger(__name__)
+
+ENABLED = getattr(settings, 'PROFILING', False)
+SAMPLER = getattr(settings, 'PROFILING_SAMPLER', None)
+SLOW_MS = getattr(settings, 'PROFILING_SLOW_MS', 500)
+SAMPLE_INTERVAL_MS = getattr(settings, 'PROFILING_SAMPLE_INTERVAL_MS', 5)
+DIRECTORY = getattr(settings, 'PROFILING_DIR', os.path.join(settings.BASE_DIR, 'profiles'))
+# how many of the most repeated queries to log
+TOP_DUPLICATES = 5
+
+_current = ContextVar('parasitologyTool.profiling', default=None)
+_IN_LIST = re.compile(r'\((?:%s, )*%s\)')
+
+
+def fingerprint(sql):
+    """The query with runs of whitespace and IN lists of any length made the same."""
+    return _IN_LIST.sub('(...)', ' '.join(sql.split()))
+
+
+class RequestProfile:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.seconds = None
+        self.sql_seconds = 0.0
+        self.queries = 0
+        self.fingerprints = Counter()
+        # template name: [seconds, renders], where the time includes templates it includes or extends
+        self.templates = {}
+        # time in templates rendered directly by the view, so nested ones aren't counted twice
+        self.template_seconds = 0.0
+        self.template_depth = 0
+        self.stacks = Counter()
+
+    def execute(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_seconds += time.perf_counter() - start
+            self.queries += 1
+            self.fingerprints[fingerprint(sql)] += 1
+
+    def finish(self):
+        self.seconds = time.perf_counter() - self.start
+
+    def duplicates(self):
+        return [(sql, count) for sql, count in self.fingerprints.most_common(TOP_DUPLICATES) if count > 1]
+
+    def server_timing(self):
+        return (f'total;dur={self.seconds * 1000:.1f}, '
+                f'sql;dur={self.sql_seconds * 1000:.1f};desc="{self.queries} queries", '
+                f'template;dur={self.template_seconds * 1000:.1f}')
+
+    def as_dict(self):
+        return {
+            'total_ms': round(self.seconds * 1000, 1),
+            'sql_ms': round(self.sql_seconds * 1000, 1),
+            'queries': self.queries,
+            'template_ms': round(self.template_seconds * 1000, 1),
+            'templates': {name: {'ms': round(seconds * 1000, 1), 'renders': renders}
+                          for name, (seconds, renders) in sorted(self.templates.items(), key=lambda item: -item[1][0])},
+            'duplicates': [{'sql': sql, 'count': count} for sql, count in self.duplicates()],
+        }
+
+
+_original_render = None
+
+
+def _timed_render(template, context):
+    profile = _current.get()
+    if profile is None:
+        return _original_render(template, context)
+    profile.template_depth += 1
+    start = time.perf_counter()
+    try:
+        return _original_render(template, context)
+    finally:
+        seconds = time.perf_counter() - start
+        profile.template_depth -= 1
+        timing = profile.templates.setdefault(template.name or '<string>', [0.0, 0])
+        timing[0] += seconds
+        timing[1] += 1
+        if profile.template_depth == 0:
+            profile.template_seconds += seconds
+
+
+def install_template_timing():
+    # Template._render is what Django's own test instrumentation wraps, as it runs for included
+    # templates and the parents of {% extends %} as well as the one the view rendered
+    global _original_render
+    if Template._render is not _timed_render:
+        _original_render = Template._render
+        Template._render = _timed_render
+
+
+def _frame_name(frame):
+    return f'{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}'
+
+
+def folded_stack(frame):
+    """The stack as 'outermost;...;innermost', one entry per function."""
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class StackSampler:
+    """Samples the stacks of the threads serving profiled requests, from one background thread."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._profiles = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def add(self, profile):
+        with self._lock:
+            self._profiles[threading.get_ident()] = profile
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='profiling-sampler', daemon=True)
+                self._thread.start()
+
+    def remove(self):
+        # holding the lock, so no sample lands in the profile once this returns
+        with self._lock:
+            self._profiles.pop(threading.get_ident(), None)
+
+    def sample(self):
+        with self._lock:
+            frames = sys._current_frames()
+            for thread_id, profile in self._profiles.items():
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    profile.stacks[folded_stack(frame)] += 1
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.sample()
+
+
+def _save(request, profile, profiler):
+    os.makedirs(DIRECTORY, exist_ok=True)
+    view = request.resolver_match.view_name if request.resolver_match else 'unresolved'
+    name = f"{datetime.now():%Y%m%d-%H%M%S-%f}-{view.replace(':', '.')}-{profile.seconds * 1000:.0f}ms"
+    if profiler is not None:
+        path = os.path.join(DIRECTORY, name + '.prof')
+        profiler.dump_stats(path)
+    else:
+        path = os.path.join(DIRECTORY, name + '.folded')
+        with open(path, 'w') as file:
+            for stack, count in profile.stacks.most_common():
+                file.write(f'{stack} {count}\n')
+    return path
+
+
+class ProfilingMiddleware(SyncAndAsyncMiddleware):
+    """
+    Records where the time of each request went (see the module docstring).
+    Put it first in MIDDLEWARE, so that the other middleware is counted too.
+    """
+
+    def __init__(self, get_response):
+        if not ENABLED:
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+        install_template_timing()
+        self.sampler = StackSampler(SAMPLE_INTERVAL_MS / 1000) if SAMPLER == 'stacks' else None
+
+    def start(self, request, sync):
+        profile = RequestProfile()
+        # both samplers follow the request's thread, and an async request shares its thread with the others
+        profiler = cProfile.Profile() if SAMPLER == 'cprofile' and sync else None
+        sampler = self.sampler if sync else None
+        token = _current.set(profile)
+        if sampler is not None:
+            sampler.add(profile)
+        stack = ExitStack()
+        stack.enter_context(sql_wrapper(profile.execute, install=sync))
+        if profiler is not None:
+            profiler.enable()
+        return profile, profiler, sampler, stack, token
+
+    def stop(self, request, state):
+        profile, profiler, sampler, stack, token = state
+        if profiler is not None:
+            profiler.disable()
+        stack.close()
+        if sampler is not None:
+            sampler.remove()
+        _current.reset(token)
+        profile.finish()
+
+    def finish(self, request, response, state):
+        profile, profiler, sampler, stack, token = state
+        response['Server-Timing'] = profile.server_timing()
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'view': request.resolver_match.view_name if request.resolver_match else None,
+            'status': response.status_code,
+            **profile.as_dict(),
+        }
+        if SAMPLER and profile.seconds * 1000 >= SLOW_MS:
+            record['profile'] = _save(request, profile, profiler)
+        logger.info(json.dumps(record))
+        return response
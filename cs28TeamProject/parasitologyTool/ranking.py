@@ -0,0 +1,103 @@
+"""
+The "most popular post" leaderboards on the parasite pages.
+
+Every post has a PostScore row holding a "hot" score, in the style of
+Reddit's front page: the log of its net votes (likes - dislikes, with each
+comment worth RANKING_COMMENT_WEIGHT) plus a bonus for how recently it was
+posted. A post needs ten times the votes to outrank one posted
+RANKING_DECAY_SECONDS later, so old posts fall away without ever being
+rewritten. The score only changes when a post is liked, disliked or
+commented on, and the sidebar is an index range scan over
+(parasite, portal, -score) that reads exactly N rows.
+"""
+
+import math
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+
+from . import objcache
+from .models import Comment, Post, PostScore, ResearchPost
+
+EPOCH = datetime(2021, 1, 1, tzinfo=timezone.utc)
+COMMENT_WEIGHT = getattr(settings, 'RANKING_COMMENT_WEIGHT', 2)
+DECAY_SECONDS = getattr(settings, 'RANKING_DECAY_SECONDS', 7 * 24 * 60 * 60)
+POPULAR_POSTS_COUNT = getattr(settings, 'POPULAR_POSTS_COUNT', 5)
+
+PORTALS = {
+    Post: ('clinical', 'clinical_post'),
+    ResearchPost: ('research', 'research_post'),
+}
+
+
+def hot_score(net_votes, date_posted, decay_seconds=DECAY_SECONDS):
+    order = math.log10(1 + abs(net_votes))
+    sign = (net_votes > 0) - (net_votes < 0)
+    return sign * order + (date_posted - EPOCH).total_seconds() / decay_seconds
+
+
+def refresh(model, post_id, create=True):
+    """
+    Recomputes the score of one post after it was liked, disliked or commented on.
+    With create=False a post without a score row is left alone, which is what a
+    cascading delete wants.
+    """
+    portal, field = PORTALS[model]
+    try:
+        post = model.objects.only('parasite_id', 'like_count', 'dislike_count', 'date_posted').get(pk=post_id)
+    except model.DoesNotExist:
+        return
+    comments = Comment.objects.filter(**{field + '_id': post_id}).count()
+    net_votes = post.like_count - post.dislike_count + COMMENT_WEIGHT * comments
+
+    values = {'parasite_id': post.parasite_id, 'portal': portal, 'score': hot_score(net_votes, post.date_posted)}
+    if not PostScore.objects.filter(**{field + '_id': post_id}).update(**values) and create:
+        PostScore.objects.create(**{field + '_id': post_id}, **values)
+
+
+def rebuild():
+    """Recomputes every score, e.g. after changing the weights. Returns how many posts were scored."""
+    total = 0
+    for model in PORTALS:
+        for post_id in model.objects.values_list('pk', flat=True).iterator():
+            refresh(model, post_id)
+            total += 1
+    return total
+
+
+def top_posts(parasite, portal, count=POPULAR_POSTS_COUNT):
+    field = 'clinical_post' if portal == 'clinical' else 'research_post'
+    post_ids = list(PostScore.objects.filter(parasite=parasite, portal=portal)
+                    .order_by('-score')
+                    .values_list(field + '_id', flat=True)[:count])
+    # the posts themselves usually come from the object cache
+    posts = objcache.get_many(field, post_ids)
+    return [posts[post_id] for post_id in post_ids if post_id in posts]
+
+
+def post_saved(sender, instance, created, **kwargs):
+    if created:
+        refresh(sender, instance.pk)
+
+
+def comment_saved(sender, instance, **kwargs):
+    if instance.clinical_post_id:
+        refresh(Post, instance.clinical_post_id)
+    if instance.research_post_id:
+        refresh(ResearchPost, instance.research_post_id)
+
+
+def comment_deleted(sender, instance, **kwargs):
+    # the post itself may be being deleted too, in which case its score row is already gone
+    if instance.clinical_post_id:
+        refresh(Post, instance.clinical_post_id, create=False)
+    if instance.research_post_id:
+        refresh(ResearchPost, instance.research_post_id, create=False)
+
+
+def connect_signals():
+    for model in PORTALS:
+        post_save.connect(post_saved, sender=model, dispatch_uid=f'ranking.{model.__name__}')
+    post_save.connect(comment_saved, sender=Comment, dispatch_uid='ranking.comment_saved')
+    post_delete.connect(comment_deleted, sender=Comment, dispatch_uid='ranking.comment_deleted')
@@ -0,0 +1,132 @@
+"""
+Likes and dislikes on clinical and research posts.
+
+Each post stores its like_count and dislike_count so feeds never count the
+likes tables. toggle() is the only thing the views use: it flips a user's
+like (or dislike) with one indexed lookup on the likes table and moves the
+stored counter with an F() expression, all in one transaction, then
+re-scores the post for the popular posts sidebar (see ranking.py). The
+update() sends no signal, so the cached post (see objcache.py) is dropped
+here too.
+
+Anything else that edits post.likes / post.dislikes directly (the admin,
+the shell, tests) is caught by the m2m_changed receiver, and
+`manage.py reconcile_reaction_counts` repairs whatever drift is left.
+"""
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from . import objcache, ranking
+from .models import Post, ResearchPost
+
+REACTIONS = {
+    'likes': 'like_count',
+    'dislikes': 'dislike_count',
+}
+
+POST_MODELS = {
+    'Post': Post,
+    'ResearchPost': ResearchPost,
+}
+
+
+def post_model(name):
+    # the models as named in the like/dislike URLs, anything unknown being a clinical post
+    return POST_MODELS.get(name, Post)
+
+
+def _through_filter(model, post_id, user_id):
+    return {model._meta.model_name + '_id': post_id, 'user_id': user_id}
+
+
+def toggle(model, post_id, user, reaction):
+    """
+    Adds the user's like or dislike (`reaction` is 'likes' or 'dislikes') to
+    the post, or takes it away if it was already there. Returns the post's
+    new (like_count, dislike_count) and whether the reaction was added.
+    """
+    through = getattr(model, reaction).through
+    counter = REACTIONS[reaction]
+    lookup = _through_filter(model, post_id, user.id)
+
+    with transaction.atomic():
+        removed, _ = through.objects.filter(**lookup).delete()
+        added = False
+        if removed:
+            model.objects.filter(pk=post_id).update(**{counter: F(counter) - 1})
+        else:
+            if not model.objects.filter(pk=post_id).update(**{counter: F(counter) + 1}):
+                raise model.DoesNotExist
+            try:
+                with transaction.atomic():
+                    through.objects.create(**lookup)
+                added = True
+            except IntegrityError:
+                # a concurrent request added the same reaction first, so undo our increment
+                model.objects.filter(pk=post_id).update(**{counter: F(counter) - 1})
+
+        ranking.refresh(model, post_id)
+        objcache.bump_on_commit(model, post_id)
+        likes, dislikes = model.objects.values_list('like_count', 'dislike_count').get(pk=post_id)
+        return likes, dislikes, added
+
+
+def _count_subquery(model, reaction):
+    through = getattr(model, reaction).through
+    fk_name = model._meta.model_name
+    counts = (through.objects.filter(**{fk_name: OuterRef('pk')})
+              .order_by()
+              .values(fk_name)
+              .annotate(total=Count('pk'))
+              .values('total'))
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
+def recount(model, post_ids=None):
+    """Recomputes the stored counters from the likes tables. Returns how many posts were wrong."""
+    queryset = model.objects.all()
+    if post_ids is not None:
+        queryset = queryset.filter(pk__in=post_ids)
+
+    drifted = queryset.annotate(
+        actual_likes=_count_subquery(model, 'likes'),
+        actual_dislikes=_count_subquery(model, 'dislikes'),
+    ).exclude(like_count=F('actual_likes'), dislike_count=F('actual_dislikes'))
+
+    fixed = 0
+    for post in drifted.only('pk'):
+        model.objects.filter(pk=post.pk).update(like_count=post.actual_likes, dislike_count=post.actual_dislikes)
+        ranking.refresh(model, post.pk)
+        objcache.bump_on_commit(model, post.pk)
+        fixed += 1
+    return fixed
+
+
+def reactions_changed(sender, instance, action, reverse, model, pk_set, **kwargs):
+    if reverse and action == 'pre_clear':
+        # a clear doesn't say which posts it touched, so note them before they're gone
+        cleared = sender.objects.filter(**{type(instance)._meta.model_name: instance})
+        instance.__dict__.setdefault('_cleared_reactions', {})[sender] = list(
+            cleared.values_list(model._meta.model_name, flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        recount(type(instance), [instance.pk])
+        return
+    if action == 'post_clear':
+        pk_set = instance.__dict__.get('_cleared_reactions', {}).pop(sender, None)
+    if pk_set:
+        # changed from the user's side, e.g. user.clinical_likes.add(post)
+        recount(model, pk_set)
+
+
+def connect_signals():
+    from django.db.models.signals import m2m_changed
+
+    for post_class in POST_MODELS.values():
+        for reaction in REACTIONS:
+            m2m_changed.connect(reactions_changed, sender=getattr(post_class, reaction).through,
+                                dispatch_uid=f'{post_class.__name__}.{reaction}')
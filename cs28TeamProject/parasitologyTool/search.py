@@ -0,0 +1,257 @@
+"""
+Full-text search over parasites, articles, clinical and research posts and
+comments.
+
+Everything searchable is copied into one SQLite FTS5 table (created by
+migration 0060), which keeps an inverted index of its words, so a search
+costs about the same however much content there is. The table is kept up to
+date from post_save/post_delete signals; `manage.py rebuild_search_index`
+rebuilds it from scratch.
+
+Each row's rowid is derived from the object it indexes (see _rowid), so
+updating or removing one object is a primary key lookup. Every row is
+tagged with the portal it belongs to, and results are filtered to the
+portals the searching user has access to.
+
+Users are searched separately, by username prefix (search_users), against
+the indexed UserProfile.username_normalized column.
+"""
+
+import re
+import sys
+from collections import namedtuple
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models.signals import post_delete, post_save
+from django.urls import reverse
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from . import permissions
+from .models import Article, Comment, Parasite, Post, ResearchPost, UserProfile, normalize_username
+
+TABLE = 'parasitologyTool_searchindex'
+PAGE_SIZE = getattr(settings, 'SEARCH_PAGE_SIZE', 20)
+USER_PAGE_SIZE = getattr(settings, 'USER_SEARCH_PAGE_SIZE', 20)
+AUTOCOMPLETE_SIZE = getattr(settings, 'USER_AUTOCOMPLETE_SIZE', 10)
+
+# kinds of indexed object; the number is part of the rowid, so never renumber them
+KINDS = {
+    'parasite': 1,
+    'article': 2,
+    'post': 3,
+    'researchpost': 4,
+    'comment': 5,
+}
+KIND_COUNT = 8
+
+SearchResult = namedtuple('SearchResult', ['kind', 'object_id', 'label', 'snippet', 'url', 'portal'])
+SearchPage = namedtuple('SearchPage', ['results', 'page', 'has_next'])
+UserMatch = namedtuple('UserMatch', ['username', 'role'])
+
+# snippet() marks matches with these, so the rest of the text can be escaped safely
+_MATCH_START = '\x02'
+_MATCH_END = '\x03'
+
+
+def _rowid(kind, object_id):
+    return object_id * KIND_COUNT + KINDS[kind]
+
+
+def document(kind, obj):
+    """
+    The row for one object: (title, body, label, parasite_id, post_id,
+    portal), or None for a comment on no post, which has nowhere to link to.
+    """
+    if kind == 'parasite':
+        return obj.name, obj.intro, obj.name, obj.id, None, 'public'
+    if kind == 'article':
+        return obj.title, obj.content, obj.title, obj.parasite_id, None, 'public'
+    if kind == 'post':
+        return obj.title, obj.content, obj.title, obj.parasite_id, None, 'clinical'
+    if kind == 'researchpost':
+        return obj.title, obj.content, obj.title, obj.parasite_id, None, 'research'
+    if kind == 'comment':
+        post = obj.clinical_post if obj.clinical_post_id else obj.research_post
+        if post is None:
+            return None
+        portal = 'clinical' if obj.clinical_post_id else 'research'
+        return '', obj.comment_text, post.title, post.parasite_id, post.id, portal
+    raise ValueError(f"unknown kind {kind!r}")
+
+
+def index_object(kind, obj, cursor=None):
+    """(Re-)indexes the object. Returns whether it is in the index."""
+    row = document(kind, obj)
+    rowid = _rowid(kind, obj.pk)
+    cursor = cursor or connection.cursor()
+    cursor.execute(f'DELETE FROM "{TABLE}" WHERE rowid = %s', [rowid])
+    if row is None:
+        return False
+    title, body, label, parasite_id, post_id, portal = row
+    cursor.execute(
+        f'INSERT INTO "{TABLE}" (rowid, title, body, kind, object_id, label, parasite_id, post_id, portal) '
+        f'VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)',
+        [rowid, title, body, kind, obj.pk, label, parasite_id, post_id, portal],
+    )
+    return True
+
+
+def _relabel_comments(kind, post):
+    # comment rows carry their post's title and parasite, so a renamed or moved post changes them
+    field = 'clinical_post' if kind == 'post' else 'research_post'
+    rowids = [_rowid('comment', pk) for pk in Comment.objects.filter(**{field: post}).values_list('pk', flat=True)]
+    if rowids:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'UPDATE "{TABLE}" SET label = %s, parasite_id = %s '
+                f'WHERE rowid IN ({", ".join(["%s"] * len(rowids))})',
+                [post.title, post.parasite_id, *rowids],
+            )
+
+
+def remove_object(kind, object_id):
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM "{TABLE}" WHERE rowid = %s', [_rowid(kind, object_id)])
+
+
+def rebuild(models=None):
+    """Re-indexes everything. `models` maps kinds to models, for use from migrations."""
+    models = models or MODELS
+    total = 0
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM "{TABLE}"')
+        for kind, model in models.items():
+            queryset = model.objects.all()
+            if kind == 'comment':
+                queryset = queryset.select_related('clinical_post', 'research_post')
+            for obj in queryset.iterator():
+                total += index_object(kind, obj, cursor)
+    return total
+
+
+def match_expression(query):
+    """
+    Turns what the user typed into an FTS5 query: every word must appear, and
+    the last one may be the start of a word. Returns None if there are no words.
+    """
+    words = re.findall(r'\w+', query or '')
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def allowed_portals(user):
+    return ['public'] + [portal for portal in permissions.PORTALS if permissions.has_portal_access(user, portal)]
+
+
+def _url(kind, object_id, parasite_id, post_id, portal):
+    if kind == 'parasite':
+        return reverse('parasitologyTool:public_parasite_page', args=[object_id])
+    if kind == 'article':
+        return reverse('parasitologyTool:goto_article') + f'?article_id={object_id}'
+    if kind == 'comment':
+        object_id = post_id
+    return reverse(f'parasitologyTool:{portal}_post_page', args=[parasite_id, object_id])
+
+
+def _highlight(snippet):
+    return mark_safe(escape(snippet).replace(_MATCH_START, '<mark>').replace(_MATCH_END, '</mark>'))
+
+
+def search(user, query, page=1, page_size=PAGE_SIZE):
+    """The given page of results the user may see, best matches first."""
+    expression = match_expression(query)
+    if expression is None:
+        return SearchPage([], page, False)
+
+    portals = allowed_portals(user)
+    placeholders = ', '.join(['%s'] * len(portals))
+    # bm25 weights: a match in the title counts for three in the body
+    sql = (
+        f'SELECT kind, object_id, label, parasite_id, post_id, portal, '
+        f"snippet(\"{TABLE}\", 1, %s, %s, '...', 16) "
+        f'FROM "{TABLE}" WHERE "{TABLE}" MATCH %s AND portal IN ({placeholders}) '
+        f'ORDER BY bm25("{TABLE}", 3.0, 1.0) LIMIT %s OFFSET %s'
+    )
+    params = [_MATCH_START, _MATCH_END, expression, *portals, page_size + 1, (page - 1) * page_size]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+
+    results = [
+        SearchResult(kind, object_id, label, _highlight(snippet),
+                     _url(kind, object_id, parasite_id, post_id, portal), portal)
+        for kind, object_id, label, parasite_id, post_id, portal, snippet in rows[:page_size]
+    ]
+    return SearchPage(results, page, len(rows) > page_size)
+
+
+def _prefix_range(prefix):
+    # prefix <= username_normalized < upper matches exactly the names starting
+    # with prefix, and unlike LIKE 'prefix%' it can always use the index
+    stem = prefix.rstrip(chr(sys.maxunicode))
+    if not stem:
+        # every character is the last one there is, so nothing sorts above the matches
+        return {'username_normalized__gte': prefix}
+    upper = stem[:-1] + chr(ord(stem[-1]) + 1)
+    return {'username_normalized__gte': prefix, 'username_normalized__lt': upper}
+
+
+def matching_users(prefix):
+    """(username, role) of the users whose username starts with prefix, in name order."""
+    prefix = normalize_username((prefix or '').strip())
+    if not prefix:
+        return UserProfile.objects.none().values_list('user__username', 'role')
+    return (UserProfile.objects.filter(**_prefix_range(prefix))
+            .order_by('username_normalized', 'pk')
+            .values_list('user__username', 'role'))
+
+
+def search_users(prefix, page=1, page_size=USER_PAGE_SIZE):
+    """The given page of users whose username starts with prefix, ignoring case."""
+    offset = (page - 1) * page_size
+    rows = list(matching_users(prefix)[offset:offset + page_size + 1])
+    return SearchPage([UserMatch(*row) for row in rows[:page_size]], page, len(rows) > page_size)
+
+
+def autocomplete_users(prefix, count=AUTOCOMPLETE_SIZE):
+    return [username for username, role in matching_users(prefix)[:count]]
+
+
+MODELS = {
+    'parasite': Parasite,
+    'article': Article,
+    'post': Post,
+    'researchpost': ResearchPost,
+    'comment': Comment,
+}
+
+
+def object_saved(sender, instance, created=False, update_fields=None, **kwargs):
+    kind = sender._meta.model_name
+    index_object(kind, instance)
+    if kind in ('post', 'researchpost') and not created and (
+            update_fields is None or {'title', 'parasite'} & set(update_fields)):
+        _relabel_comments(kind, instance)
+
+
+def object_deleted(sender, instance, **kwargs):
+    remove_object(sender._meta.model_name, instance.pk)
+
+
+def user_saved(sender, instance, update_fields=None, **kwargs):
+    # a login only saves last_login, so skip the UPDATE unless the username may have changed
+    if update_fields is None or 'username' in update_fields:
+        UserProfile.objects.filter(user=instance).update(username_normalized=normalize_username(instance.username))
+
+
+def connect_signals():
+    for kind, model in MODELS.items():
+        post_save.connect(object_saved, sender=model, dispatch_uid=f'search.{kind}_saved')
+        post_delete.connect(object_deleted, sender=model, dispatch_uid=f'search.{kind}_deleted')
+    post_save.connect(user_saved, sender=User, dispatch_uid='search.user_saved')
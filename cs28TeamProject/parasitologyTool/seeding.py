@@ -0,0 +1,241 @@
+"""
+Synthetic data at production scale, for load tests and benchmarks.
+
+seed() adds parasites, users, articles, clinical and research posts with
+attachments, comments, replies, likes and dislikes, all with bulk_create,
+one parasite at a time so memory stays bounded. Activity is spread with a
+Zipf-like skew: with skew=0 every parasite gets about the same number of
+posts (and every post the same number of comments), and the higher it is
+the more of it goes to a few popular ones, as on the real site.
+
+bulk_create sends no signals, so what the signal handlers would have kept
+up to date is written here as well: like/dislike counts, post scores (see
+ranking.py), the search index (see search.py) and
+UserProfile.username_normalized. Seeded users are named
+SEED_USERNAME_PREFIX and a number, and have the password SEED_PASSWORD.
+The attachments and pictures are a few small generated files, stored
+once and shared by every row (see storage.py).
+
+Run it with `manage.py seed_data`; `populate_tool.py` adds just the five
+parasites in PARASITE_NAMES.
+"""
+
+import random
+from datetime import timedelta
+from io import BytesIO
+
+from PIL import Image
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from . import page_cache, ranking, search
+from .models import (Article, ClinicalImage, Comment, Parasite, Post, PostScore, Reply, ResearchFile, ResearchImage,
+                     ResearchPost, UserProfile, normalize_username)
+
+PARASITE_NAMES = ['Trypanosoma', 'Plasmodium', 'Leishmania', 'Toxoplasma', 'Helminths']
+SEED_PASSWORD = 'password'
+SEED_USERNAME_PREFIX = 'seed'
+# role: share of the seeded users
+ROLE_MIX = {'clinician': 0.4, 'researcher': 0.4, 'public': 0.2}
+
+WORDS = ('malaria parasite infection vector mosquito blood smear sample treatment resistance drug dose trial '
+         'patient case diagnosis symptom fever anaemia liver spleen genome sequence strain culture microscopy '
+         'antigen antibody vaccine chloroquine artemisinin quinine miltefosine benznidazole lesion tissue cyst '
+         'larva egg host reservoir transmission outbreak region travel clinic ward report study result').split()
+
+
+def skewed_counts(total, buckets, skew, rng):
+    """Splits `total` between `buckets`, giving bucket i a share proportional to 1 / (i + 1) ** skew."""
+    if buckets == 0:
+        return []
+    weights = [1 / (i + 1) ** skew for i in range(buckets)]
+    counts = [0] * buckets
+    for i in rng.choices(range(buckets), weights=weights, k=total):
+        counts[i] += 1
+    return counts
+
+
+def _text(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+
+def _title(rng):
+    return _text(rng, rng.randint(3, 7)).capitalize()
+
+
+def _insert(model, objects, batch_size):
+    """bulk_create, making sure the objects have their new pks."""
+    last = model.objects.aggregate(last=Max('pk'))['last'] or 0
+    model.objects.bulk_create(objects, batch_size=batch_size)
+    if objects and objects[0].pk is None:
+        # Django 3.2 only gets the new pks back from PostgreSQL; the rows were inserted in order
+        pks = model.objects.filter(pk__gt=last).order_by('pk').values_list('pk', flat=True)
+        for obj, pk in zip(objects, pks.iterator()):
+            obj.pk = pk
+    return objects
+
+
+def _picture(name, colour):
+    buffer = BytesIO()
+    Image.new('RGB', (64, 64), colour).save(buffer, 'JPEG')
+    return default_storage.save(name, ContentFile(buffer.getvalue()))
+
+
+def _media():
+    # stored under their hash, so seeding again reuses the same files
+    return {
+        'parasite': _picture('parasite_pic/seed.jpg', (120, 40, 40)),
+        'article': _picture('article_pic/seed.jpg', (40, 120, 40)),
+        'image': _picture('private/clinical_pictures/seed.jpg', (40, 40, 120)),
+        'file': default_storage.save('private/files/seed.pdf', ContentFile(b'%PDF-1.4\n%%EOF\n')),
+    }
+
+
+def _seed_users(count, rng, batch_size):
+    password = make_password(SEED_PASSWORD)
+    first = (User.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+    users = _insert(User, [User(username=f'{SEED_USERNAME_PREFIX}{first + i}', password=password) for i in range(count)], batch_size)
+    roles = rng.choices(list(ROLE_MIX), weights=list(ROLE_MIX.values()), k=count)
+    profiles = [UserProfile(user=user, role=role, username_normalized=normalize_username(user.username))
+                for user, role in zip(users, roles)]
+    return _insert(UserProfile, profiles, batch_size)
+
+
+def _seed_posts(model, parasite, count, profiles, users, options, rng, cursor, media):
+    days = options['days']
+    now = timezone.now()
+    posts = [model(title=_title(rng), content=_text(rng, rng.randint(20, 80)), parasite=parasite,
+                   user=rng.choice(profiles), date_posted=now - timedelta(seconds=rng.uniform(0, days * 86400)))
+             for _ in range(count)]
+
+    # reactions, worked out first so the counters can be inserted with the posts
+    rng.shuffle(posts)
+    likes = skewed_counts(count * options['likes'], count, options['skew'], rng)
+    dislikes = skewed_counts(count * options['likes'] // 4, count, options['skew'], rng)
+    reactions = []
+    for post, like_count, dislike_count in zip(posts, likes, dislikes):
+        reacting = rng.sample(users, min(like_count + dislike_count, len(users)))
+        post.like_count = min(like_count, len(reacting))
+        post.dislike_count = len(reacting) - post.like_count
+        reactions.append(reacting)
+    _insert(model, posts, options['batch_size'])
+
+    name = model._meta.model_name
+    for reaction in ('likes', 'dislikes'):
+        through = getattr(model, reaction).through
+        rows = []
+        for post, reacting in zip(posts, reactions):
+            chosen = reacting[:post.like_count] if reaction == 'likes' else reacting[post.like_count:]
+            rows.extend(through(**{f'{name}_id': post.pk, 'user_id': user.pk}) for user in chosen)
+        through.objects.bulk_create(rows, batch_size=options['batch_size'])
+
+    post_field = 'clinical_post' if model is Post else 'research_post'
+    attachments = []
+    for post in posts:
+        for _ in range(options['attachments']):
+            if model is Post:
+                attachments.append(ClinicalImage(clinical_post=post, image=media['image'], status='ready'))
+            elif rng.random() < 0.5:
+                attachments.append(ResearchImage(research_post=post, image=media['image'], status='ready'))
+            else:
+                attachments.append(ResearchFile(research_post=post, file=media['file'], status='ready',
+                                                original_name='report.pdf'))
+    for attachment_model in (ClinicalImage, ResearchImage, ResearchFile):
+        attachment_model.objects.bulk_create([a for a in attachments if isinstance(a, attachment_model)],
+                                             batch_size=options['batch_size'])
+
+    comment_counts = skewed_counts(count * options['comments'], count, options['skew'], rng)
+    comments = []
+    for post, comment_count in zip(posts, comment_counts):
+        for _ in range(comment_count):
+            comment = Comment(comment_text=_text(rng, rng.randint(5, 30)), user=rng.choice(profiles),
+                              date_posted=post.date_posted + timedelta(seconds=rng.uniform(0, 7 * 86400)))
+            setattr(comment, post_field, post)
+            comments.append(comment)
+    _insert(Comment, comments, options['batch_size'])
+
+    reply_counts = skewed_counts(len(comments) * options['replies'], len(comments), options['skew'], rng)
+    replies = [Reply(reply_text=_text(rng, rng.randint(3, 15)), parent_comment=comment, user=rng.choice(profiles))
+               for comment, reply_count in zip(comments, reply_counts) for _ in range(reply_count)]
+    Reply.objects.bulk_create(replies, batch_size=options['batch_size'])
+
+    PostScore.objects.bulk_create([
+        PostScore(**{post_field: post}, parasite=parasite, portal=ranking.PORTALS[model][0],
+                  score=ranking.hot_score(post.like_count - post.dislike_count
+                                          + ranking.COMMENT_WEIGHT * comment_count, post.date_posted))
+        for post, comment_count in zip(posts, comment_counts)
+    ], batch_size=options['batch_size'])
+
+    for post in posts:
+        search.index_object(name, post, cursor)
+    for comment in comments:
+        search.index_object('comment', comment, cursor)
+    return {name: len(posts), 'comment': len(comments), 'reply': len(replies),
+            'reaction': sum(map(len, reactions)), 'attachment': len(attachments)}
+
+
+def seed(parasites=10, users=100, posts=100, articles=10, comments=5, replies=2, likes=5, attachments=1,
+         skew=1.0, days=365, batch_size=1000, random_seed=None, progress=None):
+    """
+    Adds `parasites` parasites (the ones in PARASITE_NAMES first), `users`
+    users, and per parasite on average `posts` clinical and `posts` research
+    posts and `articles` articles; per post on average `comments` comments,
+    `likes` likes, a quarter as many dislikes and `attachments` attachments;
+    per comment on average `replies` replies. Returns the number of rows
+    added of each kind.
+    """
+    rng = random.Random(random_seed)
+    options = {'comments': comments, 'replies': replies, 'likes': likes, 'attachments': attachments,
+               'skew': skew, 'days': days, 'batch_size': batch_size}
+    totals = {}
+
+    def add(counts):
+        for kind, count in counts.items():
+            totals[kind] = totals.get(kind, 0) + count
+
+    media = _media()
+    with transaction.atomic():
+        profiles = _seed_users(users, rng, batch_size)
+        user_rows = [profile.user for profile in profiles]
+        add({'user': len(profiles)})
+
+        existing = set(Parasite.objects.values_list('name', flat=True))
+        names = [name for name in PARASITE_NAMES if name not in existing]
+        number = 1
+        while len(names) < parasites:
+            if f'Parasite {number}' not in existing:
+                names.append(f'Parasite {number}')
+            number += 1
+        new_parasites = _insert(Parasite, [Parasite(name=name, intro=_text(rng, 40), picture=media['parasite'])
+                                           for name in names[:parasites]], batch_size)
+        add({'parasite': len(new_parasites)})
+
+        post_counts = skewed_counts(parasites * posts, len(new_parasites), skew, rng)
+        article_counts = skewed_counts(parasites * articles, len(new_parasites), skew, rng)
+        with connection.cursor() as cursor:
+            for parasite in new_parasites:
+                search.index_object('parasite', parasite, cursor)
+            for i, parasite in enumerate(new_parasites):
+                now = timezone.now()
+                parasite_articles = _insert(Article, [
+                    Article(parasite=parasite, title=f'{_title(rng)} ({parasite.pk}.{n})', content=_text(rng, 60),
+                            user=rng.choice(profiles), url='https://example.com/', picture=media['article'],
+                            date_posted=now - timedelta(seconds=rng.uniform(0, days * 86400)))
+                    for n in range(article_counts[i])], batch_size)
+                for article in parasite_articles:
+                    search.index_object('article', article, cursor)
+                add({'article': len(parasite_articles)})
+                for model in (Post, ResearchPost):
+                    add(_seed_posts(model, parasite, post_counts[i], profiles, user_rows, options, rng, cursor,
+                                    media))
+                if progress:
+                    progress(parasite, totals)
+
+    page_cache.invalidate()
+    return totals
@@ -0,0 +1,61 @@
+"""
+Signed URLs for the attachments of clinical and research posts.
+
+Attachments are stored under private/ (older ones under clinical_pictures/
+and files/), and media.serve() only sends those with a valid signature in
+the query string:
+
+    /media/private/blobs/3f/3f9a...c2.jpg?expires=1700000000&signature=...
+
+The signature is an HMAC of the name and expiry time keyed from
+SECRET_KEY, so checking it needs neither the database nor the session.
+The storage's url() (see storage.py) signs these names, so templates just
+use {{ image.image.url }} on pages that are already gated. Expiry times
+are rounded up to a multiple of SIGNED_MEDIA_ROUNDING_SECONDS so that pages
+rendered close together link the same URL and browsers can reuse what
+they have cached.
+"""
+
+import time
+
+from django.conf import settings
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+LIFETIME_SECONDS = getattr(settings, 'SIGNED_MEDIA_SECONDS', 60 * 60)
+ROUNDING_SECONDS = getattr(settings, 'SIGNED_MEDIA_ROUNDING_SECONDS', 5 * 60)
+
+PRIVATE_DIR = 'private'
+GATED_PREFIXES = (PRIVATE_DIR + '/', 'clinical_pictures/', 'files/')
+
+_SALT = 'parasitologyTool.signing'
+
+
+def is_gated(name):
+    return name.startswith(GATED_PREFIXES)
+
+
+def signature(name, expires):
+    return salted_hmac(_SALT, f'{name}:{expires}', algorithm='sha256').hexdigest()
+
+
+def expiry(now=None):
+    now = int(now if now is not None else time.time())
+    expires = now + LIFETIME_SECONDS
+    return expires + (-expires % ROUNDING_SECONDS)
+
+
+def query_string(name, now=None):
+    expires = expiry(now)
+    return f'expires={expires}&signature={signature(name, expires)}'
+
+
+def verify(name, expires, given_signature, now=None):
+    """Seconds left on a valid signature for the file, or None if it isn't valid."""
+    try:
+        expires = int(expires)
+    except (TypeError, ValueError):
+        return None
+    remaining = expires - int(now if now is not None else time.time())
+    if remaining <= 0 or not constant_time_compare(signature(name, expires), given_signature or ''):
+        return None
+    return remaining
@@ -0,0 +1,119 @@
+"""
+Measures how long django.setup() and each of our app modules take to import,
+and how much memory they add to the process.
+
+This is run in a fresh interpreter by `manage.py startup_profile` so that
+nothing the management command itself imports is counted. Keep the imports
+at the top of this file to the standard library only.
+"""
+
+import importlib
+import importlib.abc
+import importlib.machinery
+import json
+import os
+import pkgutil
+import sys
+import time
+
+# submodules that are never imported when a worker boots
+SKIPPED_SUBMODULES = ('migrations', 'tests', 'management', 'startup_profile')
+
+
+def is_skipped(name):
+    return bool(set(name.split('.')[1:]) & set(SKIPPED_SUBMODULES))
+
+
+def rss_bytes():
+    # current resident set size, falling back to the peak where /proc is missing
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def timed(callable_):
+    rss_before = rss_bytes()
+    start = time.perf_counter()
+    callable_()
+    return {'seconds': time.perf_counter() - start,
+            'rss_bytes': max(rss_bytes() - rss_before, 0)}
+
+
+class _TimedLoader(importlib.abc.Loader):
+    def __init__(self, loader, results):
+        self.loader = loader
+        self.results = results
+
+    def create_module(self, spec):
+        return self.loader.create_module(spec)
+
+    def exec_module(self, module):
+        self.results[module.__name__] = timed(lambda: self.loader.exec_module(module))
+
+
+class _TimedFinder(importlib.abc.MetaPathFinder):
+    """
+    Records the cumulative import cost of every module under the given
+    packages, including the ones django.setup() pulls in by itself.
+    """
+
+    def __init__(self, packages):
+        self.packages = packages
+        self.results = {}
+
+    def find_spec(self, fullname, path, target=None):
+        if fullname.split('.')[0] not in self.packages or is_skipped(fullname):
+            return None
+        spec = importlib.machinery.PathFinder.find_spec(fullname, path, target)
+        if spec is not None and spec.loader is not None:
+            spec.loader = _TimedLoader(spec.loader, self.results)
+        return spec
+
+
+def local_packages(base_dir):
+    return [name for _, name, is_package in pkgutil.iter_modules([base_dir]) if is_package]
+
+
+def app_modules(base_dir):
+    # every module of the apps that live in this project (not third party apps)
+    from django.apps import apps
+
+    for app_config in apps.get_app_configs():
+        if not os.path.abspath(app_config.path).startswith(base_dir):
+            continue
+        yield app_config.name
+        for module in pkgutil.walk_packages([app_config.path], prefix=app_config.name + '.'):
+            if is_skipped(module.name):
+                continue
+            yield module.name
+
+
+def measure(base_dir):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'cs28TeamProject.settings')
+    start_rss = rss_bytes()
+
+    finder = _TimedFinder(local_packages(base_dir))
+    sys.meta_path.insert(0, finder)
+
+    import django
+    setup = timed(django.setup)
+
+    for name in app_modules(base_dir):
+        importlib.import_module(name)
+
+    sys.meta_path.remove(finder)
+    return {
+        'setup': setup,
+        'modules': finder.results,
+        'total_rss_bytes': rss_bytes() - start_rss,
+        'loaded_modules': sorted(sys.modules),
+    }
+
+
+if __name__ == '__main__':
+    json.dump(measure(os.path.abspath(sys.argv[1])), sys.stdout)
@@ -0,0 +1,211 @@
+"""
+Content-addressed storage for uploads.
+
+Every uploaded file is stored under the SHA-256 of its contents,
+
+    blobs/3f/3f9a...c2.jpg
+
+whatever field it was uploaded to, so a picture uploaded several times (as
+a profile picture, a clinical image and an article picture, say) is kept
+on disk once and every row points at the same blob. Django's renaming of
+clashing uploads (Helminths_E5eKori.jpg) no longer happens.
+
+A blob can be shared, so it is only removed once no row of any model
+references it any more: django_cleanup calls delete() after the row that
+used a file is deleted or changed, and delete() queues a 'delete_blob'
+job (see jobs.py) to remove the blob BLOB_DELETE_GRACE_SECONDS later if
+nothing references it by then. The count is taken from the database when
+needed rather than kept in a counter, so it can't drift.
+
+Checking and removing can't be one step with an upload of the same file
+saving its row, which happens after the file is stored and in another
+transaction. So an upload that finds its blob already stored touches it,
+and the job leaves alone blobs touched within the grace period, which is
+longer than any upload's transaction: either the upload's row is there
+by the time the job looks, or the blob was touched too recently. The
+touch and the job's check-and-remove hold the same file lock, so one
+can't happen in the middle of the other. blob_deleted is sent once a
+blob is removed.
+
+Attachments of clinical and research posts get blobs of their own under
+private/, whose URLs are signed (see signing.py). Names already inside a
+blob directory (e.g. the thumbnails made from a blob) and copies in a
+thumbs/ directory are stored under the name given.
+`manage.py dedupe_media` moves files uploaded before this storage into
+blobs.
+"""
+
+import hashlib
+import os
+import posixpath
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.db import models
+from django.dispatch import Signal
+
+from . import jobs, signing
+
+try:
+    import fcntl
+except ImportError:
+    # not on Windows, where a lock only covers this process
+    fcntl = None
+
+BLOB_DIR = 'blobs'
+DELETE_GRACE_SECONDS = getattr(settings, 'BLOB_DELETE_GRACE_SECONDS', 60 * 60)
+LOCK_NAME = '.blob-lock'
+
+# sent with the blob's name once the delete_blob job has removed it
+blob_deleted = Signal()
+
+_thread_lock = threading.Lock()
+
+
+def content_hash(content):
+    # the upload handler (see uploads.py) hashes files as they arrive
+    digest = getattr(content, 'sha256', None)
+    if digest:
+        return digest
+    sha256 = hashlib.sha256()
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    for chunk in content.chunks():
+        sha256.update(chunk)
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    return sha256.hexdigest()
+
+
+def blob_name(digest, original_name):
+    extension = posixpath.splitext(original_name)[1].lower()
+    name = posixpath.join(BLOB_DIR, digest[:2], digest + extension)
+    # gated files get blobs of their own, so a public URL can never reach one
+    return posixpath.join(signing.PRIVATE_DIR, name) if signing.is_gated(original_name) else name
+
+
+def is_blob(name):
+    return name.startswith((BLOB_DIR + '/', f'{signing.PRIVATE_DIR}/{BLOB_DIR}/'))
+
+
+def is_shared(name):
+    # a blob that rows may point at, not a thumbnail made from one
+    return is_blob(name) and 'thumbs' not in name.split('/')[:-1]
+
+
+def file_fields():
+    """(model, field name) of every file and image field in the project."""
+    return [(model, field.name)
+            for model in apps.get_models()
+            for field in model._meta.get_fields()
+            if isinstance(field, models.FileField)]
+
+
+def references(name):
+    """How many rows, across all models, point at the file."""
+    return sum(model._default_manager.filter(**{field_name: name}).count() for model, field_name in file_fields())
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    @contextmanager
+    def blob_lock(self):
+        # across the processes sharing MEDIA_ROOT; held only for a stat, a touch or a rename
+        os.makedirs(self.location, exist_ok=True)
+        with _thread_lock, open(os.path.join(self.location, LOCK_NAME), 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    def is_addressed(self, name):
+        # names that were worked out from a blob's hash already
+        return is_blob(name) or 'thumbs' in name.split('/')[:-1]
+
+    def get_available_name(self, name, max_length=None):
+        if self.is_addressed(name):
+            return name
+        return super().get_available_name(name, max_length)
+
+    def _save(self, name, content):
+        if not self.is_addressed(name):
+            name = blob_name(content_hash(content), name)
+            with self.blob_lock():
+                if self.exists(name):
+                    # so a pending delete_blob job leaves it alone
+                    os.utime(self.path(name))
+                    return name
+        self._write(name, content)
+        return name
+
+    def _write(self, name, content):
+        full_path = self.path(name)
+        directory = os.path.dirname(full_path)
+        os.makedirs(directory, exist_ok=True)
+
+        if hasattr(content, 'temporary_file_path'):
+            try:
+                # a streamed upload (see uploads.py) is moved into place rather than copied
+                with self.blob_lock():
+                    os.replace(content.temporary_file_path(), full_path)
+                    os.utime(full_path)
+            except OSError:
+                # on another disk
+                pass
+            else:
+                self._set_permissions(full_path)
+                return
+
+        # otherwise write to a temporary name and rename, so a half-written blob is never
+        # visible and two uploads of the same file at once both put the same bytes in place
+        fd, temporary_path = tempfile.mkstemp(dir=directory, prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as output:
+                if hasattr(content, 'seek'):
+                    content.seek(0)
+                for chunk in content.chunks():
+                    output.write(chunk)
+            self._set_permissions(temporary_path)
+            with self.blob_lock():
+                os.replace(temporary_path, full_path)
+        except BaseException:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            raise
+
+    def _set_permissions(self, path):
+        if self.file_permissions_mode is not None:
+            os.chmod(path, self.file_permissions_mode)
+
+    def delete(self, name):
+        if name and is_shared(name):
+            jobs.enqueue('delete_blob', name, delay_seconds=DELETE_GRACE_SECONDS)
+            return
+        super().delete(name)
+
+    def delete_unreferenced(self, name):
+        """Removes the blob if no row references it and no upload touched it lately. Returns whether it did."""
+        with self.blob_lock():
+            try:
+                touched = os.path.getmtime(self.path(name))
+            except FileNotFoundError:
+                return False
+            if time.time() - touched < DELETE_GRACE_SECONDS or references(name):
+                return False
+            super().delete(name)
+        blob_deleted.send(sender=type(self), name=name)
+        return True
+
+    def url(self, name):
+        url = super().url(name)
+        if name and signing.is_gated(name):
+            url += '?' + signing.query_string(name)
+        return url
+
+
+@jobs.task('delete_blob')
+def delete_blob(name):
+    default_storage.delete_unreferenced(name)
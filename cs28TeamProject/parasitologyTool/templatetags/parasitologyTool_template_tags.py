@@ -1,9 +1,36 @@
 from django import template
+from django.template.loader import render_to_string
+from django.utils.html import format_html
+from parasitologyTool import page_cache, thumbnails
 from parasitologyTool.models import Parasite
 
 register = template.Library()
 
-@register.inclusion_tag('parasitologyTool/parasite_list.html')
+@register.simple_tag
 def get_parasite_list(current_category=None):
-	return {'parasites': Parasite.objects.all(),
-	        'current_category':current_category}
\ No newline at end of file
+	# the same for every visitor, so it is cached until a parasite changes (see page_cache)
+	def render():
+		return render_to_string('parasitologyTool/parasite_list.html',
+		                        {'parasites': list(Parasite.objects.all()),
+		                         'current_category': current_category})
+	return page_cache.fragment('parasite_list', render, getattr(current_category, 'pk', None))
+
+@register.simple_tag
+def responsive_image(picture, sizes='100vw', alt=''):
+	"""
+	An <img> for an uploaded picture that lets the browser pick the smallest
+	copy from parasitologyTool.thumbnails that fills `sizes`, in WebP where
+	it can. Just the original until the copies have been made.
+	"""
+	if not picture:
+		return ''
+	if not thumbnails.has_variants(picture.name, picture.storage):
+		return format_html('<img src="{}" alt="{}"/>', picture.url, alt)
+
+	fallback = thumbnails.fallback_format(picture.name)
+	return format_html(
+		'<picture><source type="image/webp" srcset="{}" sizes="{}">'
+		'<img src="{}" srcset="{}" sizes="{}" alt="{}" loading="lazy"/></picture>',
+		thumbnails.srcset(picture.name, 'webp', picture.storage), sizes,
+		picture.url, thumbnails.srcset(picture.name, fallback, picture.storage), sizes, alt,
+	)
@@ -1,3 +1,1542 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import importlib
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from PIL import Image
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.http import HttpResponse
+from django.template import Context as TemplateContext, Template
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import clear_url_caches, resolve, reverse
+from django.utils import timezone
+
+from cs28TeamProject import urls as project_urls
+
+from . import async_views, benchmarks, jobs, loadtest, media, metrics, objcache, page_cache, permissions, profiling, ranking, reactions, search, seeding, signing, storage, thumbnails, uploads, view_counts, views
+from . import urls as app_urls
+from .feeds import comment_thread, reply_page, with_replies
+from .forms import ArticleForm
+from .middleware import get_profile
+from .models import (Article, ClinicalImage, Comment, Job, Parasite, Post, PostScore, Reply, ResearchFile, ResearchImage, ResearchPost,
+                     UserProfile)
+from .pagination import PAGE_SIZE, InvalidCursor, decode_cursor, encode_cursor, paginate, paginate_merged
+
+
+def make_user(username, role='clinician'):
+    user = User.objects.create_user(username=username, password='password')
+    UserProfile.objects.create(user=user, role=role)
+    return user
+
+
+class TempMediaRootMixin:
+    """
+    Points MEDIA_ROOT at a new temporary directory, self.media_root, for
+    each test, or for the whole class if class_media_root is set.
+    """
+    class_media_root = False
+
+    @staticmethod
+    def make_media_root(add_cleanup):
+        media_root = tempfile.mkdtemp()
+        add_cleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        add_cleanup(settings_override.disable)
+        return media_root
+
+    @classmethod
+    def setUpClass(cls):
+        if cls.class_media_root:
+            cls.media_root = cls.make_media_root(cls.addClassCleanup)
+        super().setUpClass()
+
+    def setUp(self):
+        if not self.class_media_root:
+            self.media_root = self.make_media_root(self.addCleanup)
+        super().setUp()
+
+
+def run_blob_deletions():
+    """Runs the delete_blob jobs (see storage.py) as if their grace period were over."""
+    later = timezone.now() + timedelta(seconds=storage.DELETE_GRACE_SECONDS)
+    with mock.patch.object(storage, 'DELETE_GRACE_SECONDS', 0), \
+            mock.patch.object(jobs, 'timezone', mock.Mock(now=lambda: later)):
+        jobs.run_pending()
+
+
+class StartupProfileTests(SimpleTestCase):
+    def test_startup_is_within_budget(self):
+        # raises CommandError when a budget is exceeded or a forbidden module is loaded
+        call_command('startup_profile', stdout=StringIO())
+
+
+class FeedQueryTests(TestCase):
+    def setUp(self):
+        self.user = make_user('clinician')
+        self.profile = self.user.userprofile
+        self.parasite = Parasite.objects.create(name='Plasmodium', picture='parasite_pic/Plasmodium.jpg')
+        self.client.login(username='clinician', password='password')
+
+    def add_posts(self, count):
+        for i in range(count):
+            author = make_user(f'author{Post.objects.count()}')
+            post = Post.objects.create(title='post', content='content', parasite=self.parasite,
+                                       user=author.userprofile)
+            research_post = ResearchPost.objects.create(title='post', content='content', parasite=self.parasite,
+                                                        user=author.userprofile)
+            for target in (post, research_post):
+                target.likes.add(self.user, author)
+                target.dislikes.add(author)
+            ClinicalImage.objects.create(clinical_post=post, image='clinical_pictures/Helminths.jpg')
+            ResearchImage.objects.create(research_post=research_post, image='clinical_pictures/Helminths.jpg')
+            ResearchFile.objects.create(research_post=research_post, file='files/sample.pdf')
+            Comment.objects.create(comment_text='comment', clinical_post=post, user=self.profile)
+            Comment.objects.create(comment_text='comment', research_post=research_post, user=self.profile)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response
+
+    def assert_constant_queries(self, url_name):
+        url = reverse(url_name, args=[self.parasite.id])
+        self.add_posts(2)
+        # the first request caches the user's role, and the popular posts (see objcache)
+        self.client.get(url)
+        small, _ = self.count_queries(url)
+        self.add_posts(10)
+        self.client.get(url)
+        large, response = self.count_queries(url)
+        self.assertEqual(small, large)
+        return large, response
+
+    def test_clinical_feed_query_count_is_constant(self):
+        queries, response = self.assert_constant_queries('parasitologyTool:clinical_parasite_page')
+        # session, user, parasite, parasite list, posts, images, popular posts
+        self.assertLessEqual(queries, 7)
+        self.assertEqual(response.context['posts'][0].like_count, 2)
+        self.assertEqual(response.context['posts'][0].dislike_count, 1)
+
+    def test_research_feed_query_count_is_constant(self):
+        queries, response = self.assert_constant_queries('parasitologyTool:research_parasite_page')
+        # session, user, parasite, parasite list, posts, images, files, popular posts
+        self.assertLessEqual(queries, 8)
+        self.assertEqual(response.context['research_posts'][0].like_count, 2)
+
+
+class CommentThreadTests(TestCase):
+    def setUp(self):
+        self.user = make_user('clinician')
+        self.profile = self.user.userprofile
+        self.parasite = Parasite.objects.create(name='Plasmodium', picture='parasite_pic/Plasmodium.jpg')
+        self.post = Post.objects.create(title='post', content='content', parasite=self.parasite, user=self.profile)
+        self.replier = make_user('replier').userprofile
+        self.client.login(username='clinician', password='password')
+
+    def add_comments(self, count, replies):
+        for i in range(count):
+            comment = Comment.objects.create(comment_text=f'comment {i}', clinical_post=self.post, user=self.profile)
+            Reply.objects.bulk_create([Reply(reply_text=f'reply {j}', parent_comment=comment, user=self.replier)
+                                       for j in range(replies)])
+
+    def count_queries(self):
+        url = reverse('parasitologyTool:clinical_post_page', args=[self.parasite.id, self.post.id])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        return len(queries), response
+
+    def test_query_count_does_not_depend_on_replies(self):
+        self.add_comments(2, replies=1)
+        self.count_queries()
+        small, _ = self.count_queries()
+        self.add_comments(10, replies=8)
+        large, response = self.count_queries()
+        self.assertEqual(small, large)
+        self.assertContains(response, '5 more replies')
+        self.assertContains(response, 'reply 2')
+        self.assertNotContains(response, 'reply 3')
+
+    def test_with_replies(self):
+        self.add_comments(3, replies=5)
+        with self.assertNumQueries(2):
+            comments = with_replies(comment_thread(self.post.comment_set.all()), count=2)
+            self.assertEqual([(reply.user.username, reply.reply_text) for reply in comments[0].first_replies],
+                             [('replier', 'reply 0'), ('replier', 'reply 1')])
+        self.assertEqual({comment.more_replies for comment in comments}, {3})
+
+    def test_reply_endpoint(self):
+        self.add_comments(1, replies=5)
+        comment = Comment.objects.get()
+        first = with_replies([comment_thread().get()])[0]
+        url = reverse('parasitologyTool:comment_replies', args=[comment.id])
+        data = self.client.get(url, {'after': first.last_reply_id}).json()
+        self.assertEqual([reply['reply_text'] for reply in data['replies']], ['reply 3', 'reply 4'])
+        self.assertFalse(data['has_more'])
+
+        replies, has_more = reply_page(comment.id, page_size=2)
+        self.assertEqual(len(replies), 2)
+        self.assertTrue(has_more)
+
+        self.assertEqual(self.client.get(url, {'after': 'x'}).status_code, 400)
+        missing = reverse('parasitologyTool:comment_replies', args=[comment.id + 1000])
+        self.assertEqual(self.client.get(missing).status_code, 404)
+        make_user('researcher', role='researcher')
+        self.client.login(username='researcher', password='password')
+        self.assertContains(self.client.get(url), 'not authorised')
+
+    def test_replying_needs_a_login(self):
+        self.add_comments(1, replies=0)
+        comment = Comment.objects.get()
+        url = reverse('parasitologyTool:comment-reply', args=[self.post.id, comment.id])
+        self.assertEqual(self.client.post(url, {'reply_text': 'a reply'}).json()['username'], 'clinician')
+        self.client.logout()
+        self.assertEqual(self.client.post(url, {'reply_text': 'anonymous'}).status_code, 302)
+        self.assertEqual(list(Reply.objects.values_list('reply_text', flat=True)), ['a reply'])
+
+
+@skipUnless(connection.vendor == 'sqlite', "reads SQLite's EXPLAIN QUERY PLAN output")
+class QueryPlanTests(TestCase):
+    """
+    Runs EXPLAIN QUERY PLAN on every query the hot views make and fails if
+    one reads a whole table, or sorts every matching row to return the first
+    page of them. The tables are small and have no ANALYZE statistics, so
+    SQLite plans as if they were big, which is the case that matters.
+    """
+    # listed in full on every page by design
+    FULL_LISTINGS = {'parasitologyTool_parasite'}
+    # ordered by relevance, which no index can give
+    RANKED = {'parasitologyTool_searchindex'}
+    # named subqueries, which SQLite plans as SCAN <alias>
+    SUBQUERIES = {'ranked'}
+
+    def setUp(self):
+        cache.clear()
+        self.user = make_user('clinician')
+        profile = self.user.userprofile
+        self.parasite = Parasite.objects.create(name='Plasmodium', picture='parasite_pic/Plasmodium.jpg')
+        Parasite.objects.create(name='Toxoplasma', picture='parasite_pic/Toxoplasma.jpg')
+        for i in range(3):
+            self.post = Post.objects.create(title=f'post {i}', content='content', parasite=self.parasite, user=profile)
+            self.research_post = ResearchPost.objects.create(title=f'post {i}', content='content',
+                                                             parasite=self.parasite, user=profile)
+            self.comment = Comment.objects.create(comment_text='comment', clinical_post=self.post, user=profile)
+            Comment.objects.create(comment_text='comment', research_post=self.research_post, user=profile)
+            Reply.objects.create(reply_text='reply', parent_comment=self.comment, user=profile)
+            self.article = Article.objects.create(parasite=self.parasite, title=f'article {i}', content='content',
+                                                  user=profile, url='https://example.com',
+                                                  picture='article_pic/a.jpg')
+        self.client.login(username='clinician', password='password')
+
+    def urls(self):
+        parasite_id, post_id, research_post_id = self.parasite.id, self.post.id, self.research_post.id
+        return [
+            (reverse('parasitologyTool:index'), {}),
+            (reverse('parasitologyTool:public_content'), {}),
+            (reverse('parasitologyTool:more_articles'), {'cursor': encode_cursor(self.article)}),
+            (reverse('parasitologyTool:public_parasite_page', args=[parasite_id]), {}),
+            (reverse('parasitologyTool:more_parasite_articles', args=[parasite_id]),
+             {'cursor': encode_cursor(self.article)}),
+            (reverse('parasitologyTool:clinical_parasite_page', args=[parasite_id]), {}),
+            (reverse('parasitologyTool:more_clinical_posts', args=[parasite_id]), {'cursor': encode_cursor(self.post)}),
+            (reverse('parasitologyTool:research_parasite_page', args=[parasite_id]), {}),
+            (reverse('parasitologyTool:more_research_posts', args=[parasite_id]),
+             {'cursor': encode_cursor(self.research_post)}),
+            (reverse('parasitologyTool:clinical_post_page', args=[parasite_id, post_id]), {}),
+            (reverse('parasitologyTool:more_clinical_comments', args=[parasite_id, post_id]),
+             {'cursor': encode_cursor(self.comment)}),
+            (reverse('parasitologyTool:research_post_page', args=[parasite_id, research_post_id]), {}),
+            (reverse('parasitologyTool:comment_replies', args=[self.comment.id]), {'after': 0}),
+            (reverse('parasitologyTool:user_posts', args=['clinician']), {}),
+            (reverse('parasitologyTool:more_user_posts', args=['clinician']), {'cursor': encode_cursor(self.post)}),
+            (reverse('parasitologyTool:search_results'), {'q': 'clin'}),
+            (reverse('parasitologyTool:content_search'), {'q': 'post'}),
+        ]
+
+    def plan(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def problems(self, sql, plan):
+        # a sort is only a problem for a page of rows (prefetches sort what they fetched, a page at most)
+        paged = ' LIMIT ' in sql and not any(f'"{table}"' in sql for table in self.RANKED)
+        for step in plan:
+            words = step.split()
+            if step.startswith('USE TEMP B-TREE FOR') and 'ORDER BY' in step and paged:
+                yield step
+            # SCAN of a subquery, or along an index in order, is fine
+            elif (words[0] == 'SCAN' and not words[1].startswith('(') and 'INDEX' not in step
+                  and words[1] not in self.FULL_LISTINGS | self.SUBQUERIES):
+                yield step
+
+    def test_hot_views_use_indexes(self):
+        for url, params in self.urls():
+            # nothing served from the caches, so every query is seen
+            cache.clear()
+            objcache.clear_local()
+            with self.subTest(url=url), CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.client.get(url, params).status_code, 200)
+                for query in queries.captured_queries:
+                    problems = list(self.problems(query['sql'], self.plan(query['sql'])))
+                    self.assertFalse(problems, f"{query['sql']}\n{problems}")
+
+
+class CursorPaginationTests(TestCase):
+    def setUp(self):
+        self.user = make_user('clinician')
+        self.profile = self.user.userprofile
+        self.parasite = Parasite.objects.create(name='Plasmodium', picture='parasite_pic/Plasmodium.jpg')
+        self.client.login(username='clinician', password='password')
+        # all posted at the same moment, so the id tie-break decides the order
+        posted = timezone.now()
+        self.posts = [Post.objects.create(title=f'post {i}', content='content', parasite=self.parasite,
+                                          user=self.profile, date_posted=posted) for i in range(25)]
+        self.research_posts = [ResearchPost.objects.create(title=f'post {i}', content='content',
+                                                           parasite=self.parasite, user=self.profile)
+                               for i in range(5)]
+
+    def test_pages_cover_every_post_once(self):
+        first = paginate(Post.objects.all(), page_size=10)
+        second = paginate(Post.objects.all(), first.next_cursor, page_size=10)
+        third = paginate(Post.objects.all(), second.next_cursor, page_size=10)
+        ids = [post.id for post in first.items + second.items + third.items]
+        self.assertEqual(ids, [post.id for post in reversed(self.posts)])
+        self.assertIsNone(third.next_cursor)
+
+    def test_merged_pages_interleave_by_date(self):
+        first = paginate_merged([Post.objects.all(), ResearchPost.objects.all()], page_size=20)
+        second = paginate_merged([Post.objects.all(), ResearchPost.objects.all()], first.next_cursor, page_size=20)
+        self.assertEqual(len(first.items) + len(second.items), 30)
+        self.assertIsNone(second.next_cursor)
+
+    def test_merged_pages_break_ties_across_models(self):
+        # posted at the same moment as the clinical posts, with the same ids as some of them
+        ResearchPost.objects.update(date_posted=self.posts[0].date_posted)
+        querysets = [Post.objects.all(), ResearchPost.objects.all()]
+        seen, cursor = [], None
+        while True:
+            page = paginate_merged(querysets, cursor, page_size=3)
+            seen.extend((post._meta.model_name, post.pk) for post in page.items)
+            cursor = page.next_cursor
+            if cursor is None:
+                break
+        self.assertEqual(len(seen), 30)
+        self.assertEqual(len(set(seen)), 30)
+
+    def test_invalid_cursor_is_rejected(self):
+        with self.assertRaises(InvalidCursor):
+            decode_cursor('not a cursor')
+        url = reverse('parasitologyTool:more_clinical_posts', args=[self.parasite.id])
+        self.assertEqual(self.client.get(url, {'cursor': 'not a cursor'}).status_code, 400)
+
+    def test_load_more_of_something_missing_is_not_found(self):
+        url = reverse('parasitologyTool:more_clinical_comments', args=[self.parasite.id, self.posts[-1].id + 1000])
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertEqual(self.client.get(reverse('parasitologyTool:more_user_posts', args=['nobody'])).status_code, 404)
+        make_user('researcher', role='researcher')
+        self.client.login(username='researcher', password='password')
+        url = reverse('parasitologyTool:more_research_comments',
+                      args=[self.parasite.id, self.research_posts[-1].id + 1000])
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_load_more_endpoint_continues_the_page(self):
+        response = self.client.get(reverse('parasitologyTool:clinical_parasite_page', args=[self.parasite.id]))
+        self.assertEqual(len(response.context['posts']), PAGE_SIZE)
+        url = reverse('parasitologyTool:more_clinical_posts', args=[self.parasite.id])
+        data = self.client.get(url, {'cursor': response.context['next_cursor']}).json()
+        self.assertIsNone(data['next_cursor'])
+        self.assertIn(reverse('parasitologyTool:clinical_post_page', args=[self.parasite.id, self.posts[0].id]),
+                      data['html'])
+        self.assertEqual(data['html'].count('class="a-box"'), len(self.posts) - PAGE_SIZE)
+
+    def test_comment_pages(self):
+        post = self.posts[0]
+        for i in range(PAGE_SIZE + 1):
+            Comment.objects.create(comment_text=f'comment {i}', clinical_post=post, user=self.profile)
+        response = self.client.get(reverse('parasitologyTool:clinical_post_page', args=[self.parasite.id, post.id]))
+        self.assertEqual(len(response.context['comments']), PAGE_SIZE)
+        url = reverse('parasitologyTool:more_clinical_comments', args=[self.parasite.id, post.id])
+        data = self.client.get(url, {'cursor': response.context['next_cursor']}).json()
+        self.assertIn('comment 0', data['html'])
+        self.assertIsNone(data['next_cursor'])
+
+
+class ReactionTests(TestCase):
+    def setUp(self):
+        self.user = make_user('clinician')
+        parasite = Parasite.objects.create(name='Plasmodium', picture='parasite_pic/Plasmodium.jpg')
+        self.post = Post.objects.create(title='post', content='content', parasite=parasite,
+                                        user=self.user.userprofile)
+        self.client.login(username='clinician', password='password')
+
+    def test_like_toggles(self):
+        url = reverse('parasitologyTool:like', args=['Post', self.post.id])
+        self.assertEqual(self.client.post(url).json()['likes'], 1)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.like_count, 1)
+        self.assertTrue(self.post.likes.filter(id=self.user.id).exists())
+
+        self.assertEqual(self.client.post(url).json()['likes'], 0)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.like_count, 0)
+        self.assertFalse(self.post.likes.exists())
+
+    def test_dislike_of_missing_post(self):
+        url = reverse('parasitologyTool:dislike', args=['ResearchPost', 1000])
+        self.assertEqual(self.client.post(url).status_code, 404)
+
+    def test_direct_m2m_changes_update_counts(self):
+        other = make_user('other')
+        self.post.likes.add(self.user, other)
+        other.clinical_dislikes.add(self.post)
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.like_count, self.post.dislike_count), (2, 1))
+
+        other.clinical_dislikes.clear()
+        self.user.clinical_likes.clear()
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.like_count, self.post.dislike_count), (1, 0))
+
+    def test_reconcile_repairs_drift(self):
+        self.post.likes.add(self.user)
+        Post.objects.filter(pk=self.post.pk).update(like_count=7, dislike_count=3)
+        call_command('reconcile_reaction_counts', stdout=StringIO())
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.like_count, self.post.dislike_count), (1, 0))
+
+
+class RankingTests(TestCase):
+    def setUp(self):
+        self.user = make_user('clinician')
+        self.profile = self.user.userprofile
+        self.parasite = Parasite.objects.create(name='Plasmodium', picture='parasite_pic/Plasmodium.jpg')
+        self.other_parasite = Parasite.objects.create(name='Toxoplasma', picture='parasite_pic/Toxoplasma.jpg')
+        posted = timezone.now()
+        self.posts = [Post.objects.create(title=f'post {i}', content='content', parasite=self.parasite,
+                                          user=self.profile, date_posted=posted) for i in range(3)]
+        self.client.login(username='clinician', password='password')
+
+    def like(self, post, count):
+        for i in range(count):
+            reactions.toggle(Post, post.id, make_user(f'liker{post.id}-{i}'), 'likes')
+
+    def test_most_liked_post_ranks_first(self):
+        self.like(self.posts[1], 3)
+        self.like(self.posts[2], 1)
+        self.assertEqual(ranking.top_posts(self.parasite, 'clinical'), [self.posts[1], self.posts[2], self.posts[0]])
+        self.assertEqual(ranking.top_posts(self.other_parasite, 'clinical'), [])
+        self.assertEqual(ranking.top_posts(self.parasite, 'research'), [])
+
+    def test_comments_count_towards_score(self):
+        self.like(self.posts[0], 1)
+        Comment.objects.create(comment_text='comment', clinical_post=self.posts[2], user=self.profile)
+        self.assertEqual(ranking.top_posts(self.parasite, 'clinical')[0], self.posts[2])
+
+    def test_newer_posts_outrank_older_ones_with_the_same_votes(self):
+        older = Post.objects.create(title='older', content='content', parasite=self.parasite, user=self.profile,
+                                    date_posted=timezone.now() - timezone.timedelta(days=30))
+        self.like(older, 5)
+        self.like(self.posts[0], 5)
+        self.assertEqual(ranking.top_posts(self.parasite, 'clinical', count=1), [self.posts[0]])
+
+    def test_sidebar_reads_the_leaderboard(self):
+        self.like(self.posts[2], 2)
+        response = self.client.get(reverse('parasitologyTool:clinical_parasite_page', args=[self.parasite.id]))
+        self.assertEqual(response.context['pop_posts'][0], self.posts[2])
+
+    def test_deleting_a_post_with_comments(self):
+        Comment.objects.create(comment_text='comment', clinical_post=self.posts[0], user=self.profile)
+        self.posts[0].delete()
+        self.assertNotIn(self.posts[0], ranking.top_posts(self.parasite, 'clinical'))
+
+
+class ViewCountTests(TestCase):
+    def setUp(self):
+        user = make_user('clinician')
+        self.parasite = Parasite.objects.create(name='Plasmodium', picture='parasite_pic/Plasmodium.jpg')
+        self.article = Article.objects.create(parasite=self.parasite, title='article', content='content',
+                                              user=user.userprofile, url='https://example.com/article',
+                                              picture='article_pic/image1.jpg')
+        view_counts.flush()
+
+    def test_views_are_buffered_then_flushed(self):
+        for i in range(3):
+            response = self.client.get(reverse('parasitologyTool:goto'), {'parasite_id': self.parasite.id})
+            self.assertRedirects(response, reverse('parasitologyTool:public_parasite_page',
+                                                   args=[self.parasite.id]))
+        self.assertEqual(view_counts.pending(Parasite, self.parasite.id), 3)
+
+        self.assertEqual(view_counts.flush(), 3)
+        self.parasite.refresh_from_db()
+        self.assertEqual(self.parasite.views, 3)
+        self.assertEqual(view_counts.pending(Parasite, self.parasite.id), 0)
+
+    def test_article_views_are_counted(self):
+        response = self.client.get(reverse('parasitologyTool:goto_article'), {'article_id': self.article.id})
+        self.assertRedirects(response, self.article.url, fetch_redirect_response=False)
+        view_counts.flush()
+        self.article.refresh_from_db()
+        self.assertEqual(self.article.views, 1)
+
+    def test_articles_only_link_to_web_pages(self):
+        form = ArticleForm({'title': 'ftp', 'content': 'content', 'url': 'ftps://example.com/paper'})
+        self.assertIn('url', form.errors)
+        # saved before the scheme was checked
+        Article.objects.filter(pk=self.article.pk).update(url='ftps://example.com/paper')
+        response = self.client.get(reverse('parasitologyTool:goto_article'), {'article_id': self.article.id})
+        self.assertRedirects(response, reverse('parasitologyTool:public_content'), fetch_redirect_response=False)
+
+    def test_unknown_parasite(self):
+        response = self.client.get(reverse('parasitologyTool:goto'), {'parasite_id': 'nope'})
+        self.assertRedirects(response, reverse('parasitologyTool:public_content'))
+
+    def test_flush_adds_to_the_stored_count(self):
+        view_counts.record(Parasite, self.parasite.id)
+        # another worker's flush landing in between must not be overwritten
+        Parasite.objects.filter(pk=self.parasite.pk).update(views=10)
+        view_counts.flush()
+        self.parasite.refresh_from_db()
+        self.assertEqual(self.parasite.views, 11)
+
+
+class ProfileResolutionTests(TestCase):
+    def setUp(self):
+        self.user = make_user('clinician')
+        self.client.login(username='clinician', password='password')
+
+    def test_profile_is_fetched_once_per_request(self):
+        request = RequestFactory().get('/')
+        request.user = self.user
+        with self.assertNumQueries(1):
+            self.assertEqual(get_profile(request), self.user.userprofile)
+            self.assertEqual(get_profile(request).username, 'clinician')
+
+    def test_request_profile(self):
+        response = self.client.get(reverse('parasitologyTool:index'))
+        self.assertEqual(response.wsgi_request.profile.role, 'clinician')
+        self.assertEqual(response.wsgi_request.profile.username, 'clinician')
+
+    def test_anonymous_users_have_no_profile(self):
+        self.client.logout()
+        response = self.client.get(reverse('parasitologyTool:about'))
+        self.assertFalse(response.wsgi_request.profile)
+
+
+class PermissionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = make_user('researcher', role='researcher')
+        self.client.login(username='researcher', password='password')
+
+    def test_roles_map_to_portals(self):
+        clinician = make_user('clinician')
+        self.assertTrue(permissions.has_portal_access(clinician, 'clinical'))
+        self.assertTrue(permissions.has_portal_access(clinician, 'research'))
+        self.assertFalse(permissions.has_portal_access(self.user, 'clinical'))
+        self.assertTrue(permissions.has_portal_access(self.user, 'research'))
+        self.assertFalse(permissions.has_portal_access(AnonymousUser(), 'research'))
+
+    def test_checks_are_cached(self):
+        self.client.get(reverse('parasitologyTool:research_portal'))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('parasitologyTool:research_portal'))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([query for query in queries if 'parasitologyTool_userprofile' in query['sql']])
+
+    def test_role_change_invalidates_the_cache(self):
+        self.assertNotIn(b'not authorised', self.client.get(reverse('parasitologyTool:research_portal')).content)
+        make_user('admin', role='admin')
+        client = Client()
+        client.login(username='admin', password='password')
+        client.post(reverse('parasitologyTool:admin_manage', args=['researcher']), {'role': 'public'})
+        self.assertIn(b'not authorised', self.client.get(reverse('parasitologyTool:research_portal')).content)
+
+    def test_anonymous_users_are_sent_to_login(self):
+        self.client.logout()
+        response = self.client.get(reverse('parasitologyTool:clinical_parasite_page', args=[1]))
+        self.assertEqual(response.status_code, 302)
+
+    def test_user_posts_only_show_portals_the_viewer_may_see(self):
+        author = make_user('clinician').userprofile
+        parasite = Parasite.objects.create(name='Plasmodium', picture='parasite_pic/Plasmodium.jpg')
+        Post.objects.create(title='case', content='clinical case', parasite=parasite, user=author)
+        ResearchPost.objects.create(title='paper', content='research paper', parasite=parasite, user=author)
+        url = reverse('parasitologyTool:user_posts', args=['clinician'])
+        response = self.client.get(url)
+        self.assertContains(response, 'research paper')
+        self.assertNotContains(response, 'clinical case')
+
+        self.client.logout()
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.assertEqual(self.client.get(reverse('parasitologyTool:more_user_posts', args=['clinician'])).status_code,
+                         302)
+
+
+class PageCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = make_user('clinician')
+        self.parasite = Parasite.objects.create(name='Plasmodium', picture='parasite_pic/Plasmodium.jpg')
+
+    def test_anonymous_pages_are_cached(self):
+        url = reverse('parasitologyTool:public_parasite_page', args=[self.parasite.id])
+        first = self.client.get(url)
+        with self.assertNumQueries(0):
+            second = self.client.get(url)
+        self.assertEqual(first.content, second.content)
+        self.assertIn('Cookie', second['Vary'])
+
+    def test_saves_and_deletes_invalidate(self):
+        url = reverse('parasitologyTool:public_content')
+        self.client.get(url)
+        other = Parasite.objects.create(name='Toxoplasma', picture='parasite_pic/Toxoplasma.jpg')
+        self.assertContains(self.client.get(url), 'Toxoplasma')
+        Article.objects.create(parasite=other, title='Cats and mice', content='content', user=self.user.userprofile,
+                               url='https://example.com', picture='article_pic/a.jpg')
+        self.assertContains(self.client.get(url), 'Cats and mice')
+        other.delete()
+        self.assertNotContains(self.client.get(url), 'Toxoplasma')
+
+    def test_logged_in_users_are_not_served_from_the_cache(self):
+        url = reverse('parasitologyTool:index')
+        self.client.get(url)
+        self.client.login(username='clinician', password='password')
+        self.assertContains(self.client.get(url), 'clinician')
+
+    def test_parasite_list_fragment(self):
+        template = Template('{% load parasitologyTool_template_tags %}{% get_parasite_list parasite %}')
+        html = template.render(TemplateContext({'parasite': self.parasite}))
+        self.assertIn('<strong>', html)
+        with self.assertNumQueries(0):
+            self.assertEqual(template.render(TemplateContext({'parasite': self.parasite})), html)
+        # which parasite is highlighted is part of the key
+        self.assertNotIn('<strong>', template.render(TemplateContext({'parasite': None})))
+        self.parasite.name = 'Plasmodium falciparum'
+        self.parasite.save()
+        self.assertIn('Plasmodium falciparum', template.render(TemplateContext({'parasite': self.parasite})))
+
+    def test_generation_survives_eviction(self):
+        before = page_cache.generation()
+        cache.delete('parasitologyTool:public:generation')
+        self.assertGreater(page_cache.generation(), before)
+
+
+class ObjectCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        objcache.clear_local()
+        self.user = make_user('researcher', role='researcher')
+        self.parasite = Parasite.objects.create(name='Plasmodium', picture='parasite_pic/Plasmodium.jpg')
+        self.post = ResearchPost.objects.create(title='Genome', content='content', parasite=self.parasite,
+                                                user=self.user.userprofile)
+        ResearchFile.objects.create(research_post=self.post, file='files/sample.pdf')
+
+    def test_read_through(self):
+        with self.assertNumQueries(4):
+            # post, images, files, author
+            post = objcache.get('research_post', self.post.id)
+        with self.assertNumQueries(0):
+            post = objcache.get('research_post', self.post.id)
+            self.assertEqual(post.user.username, 'researcher')
+            self.assertEqual(len(post.files), 1)
+        self.assertIsNot(objcache.get('research_post', self.post.id), post)
+        with self.assertRaises(ResearchPost.DoesNotExist):
+            objcache.get('research_post', 0)
+
+    def test_changes_bump_the_version(self):
+        objcache.get('research_post', self.post.id)
+        self.post.title = 'Sequencing'
+        self.post.save()
+        self.assertEqual(objcache.get('research_post', self.post.id).title, 'Sequencing')
+
+        ResearchImage.objects.create(research_post=self.post, image='clinical_pictures/Helminths.jpg')
+        self.assertEqual(len(objcache.get('research_post', self.post.id).images), 1)
+
+        reactions.toggle(ResearchPost, self.post.id, self.user, 'likes')
+        self.assertEqual(objcache.get('research_post', self.post.id).like_count, 1)
+
+        self.user.username = 'renamed'
+        self.user.save()
+        self.assertEqual(objcache.get('research_post', self.post.id).user.username, 'renamed')
+
+    def test_get_many(self):
+        other = ResearchPost.objects.create(title='Vaccines', content='content', parasite=self.parasite,
+                                            user=self.user.userprofile)
+        objcache.get('research_post', self.post.id)
+        with self.assertNumQueries(3):
+            # only the post that wasn't cached: post, images, files
+            posts = objcache.get_many('research_post', [other.id, self.post.id, 0])
+        self.assertEqual(list(posts), [other.id, self.post.id])
+
+    def test_article_listings(self):
+        article = Article.objects.create(parasite=self.parasite, user=self.user.userprofile, title='Malaria',
+                                         content='', url='https://example.com', picture='article_pic/a.jpg')
+        listing = Article.objects.only('id', 'date_posted')
+        objcache.cached_page('article', paginate(listing))
+        with self.assertNumQueries(1):
+            # only the page of ids
+            page = objcache.cached_page('article', paginate(listing))
+        self.assertEqual([(item.title, item.user.username) for item in page.items], [('Malaria', 'researcher')])
+
+        article.title = 'Cholera'
+        article.save()
+        self.assertEqual(objcache.cached_page('article', paginate(listing)).items[0].title, 'Cholera')
+        article.delete()
+        with self.assertRaises(Article.DoesNotExist):
+            objcache.get('article', article.id)
+        with self.assertRaises(Article.DoesNotExist):
+            objcache.get('article', None)
+
+    def test_local_tier_is_bounded(self):
+        local = objcache.LocalCache(2)
+        local.set('a', 1)
+        local.set('b', 2)
+        local.get('a')
+        local.set('c', 3)
+        self.assertIsNone(local.get('b'))
+        self.assertEqual((local.get('a'), local.get('c')), (1, 3))
+
+    def test_stats(self):
+        before = objcache.stats()
+        objcache.get('parasite', self.parasite.id)
+        objcache.get('parasite', self.parasite.id)
+        after = objcache.stats()
+        self.assertEqual(after['misses'] - before['misses'], 1)
+        self.assertEqual(after['local_hits'] - before['local_hits'], 1)
+
+        self.client.login(username='researcher', password='password')
+        self.assertContains(self.client.get(reverse('parasitologyTool:cache_stats')), 'not authorised')
+        make_user('admin', role='admin')
+        self.client.login(username='admin', password='password')
+        response = self.client.get(reverse('parasitologyTool:cache_stats'))
+        self.assertIn('hit_ratio', response.json()['objects'])
+
+    def test_post_page(self):
+        self.client.login(username='researcher', password='password')
+        url = reverse('parasitologyTool:research_post_page', args=[self.parasite.id, self.post.id])
+        self.assertContains(self.client.get(url), 'sample.pdf')
+        self.post.content = 'Sequencing the genome'
+        self.post.save()
+        self.assertContains(self.client.get(url), 'Sequencing the genome')
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = make_user('clinician')
+        profile = self.user.userprofile
+        self.parasite = Parasite.objects.create(name='Plasmodium', intro='Causes malaria in humans',
+                                                picture='parasite_pic/Plasmodium.jpg')
+        self.article = Article.objects.create(parasite=self.parasite, user=profile, title='Malaria vaccines',
+                                              content='A review of vaccine trials', url='https://example.com',
+                                              picture='article_pic/a.jpg')
+        self.clinical_post = Post.objects.create(parasite=self.parasite, user=profile, title='Resistant case',
+                                                 content='Chloroquine resistant malaria')
+        self.research_post = ResearchPost.objects.create(parasite=self.parasite, user=profile, title='Genome',
+                                                         content='Sequencing the malaria genome')
+        self.comment = Comment.objects.create(clinical_post=self.clinical_post, user=profile,
+                                              comment_text='Try artemisinin')
+
+    def kinds(self, user, query):
+        return {result.kind for result in search.search(user, query).results}
+
+    def test_results_depend_on_role(self):
+        self.assertEqual(self.kinds(self.user, 'malaria'), {'parasite', 'article', 'post', 'researchpost'})
+        self.assertEqual(self.kinds(make_user('researcher', role='researcher'), 'malaria'),
+                         {'parasite', 'article', 'researchpost'})
+        self.assertEqual(self.kinds(AnonymousUser(), 'malaria'), {'parasite', 'article'})
+
+    def test_index_follows_changes(self):
+        self.assertEqual(self.kinds(self.user, 'artemisinin'), {'comment'})
+        self.comment.comment_text = 'Try quinine'
+        self.comment.save()
+        self.assertEqual(self.kinds(self.user, 'artemisinin'), set())
+        self.assertEqual(self.kinds(self.user, 'quinine'), {'comment'})
+        self.clinical_post.delete()
+        self.assertEqual(self.kinds(self.user, 'quinine'), set())
+        self.assertEqual(self.kinds(self.user, 'chloroquine'), set())
+
+    def test_titles_rank_first_and_prefixes_match(self):
+        results = search.search(self.user, 'vacc').results
+        self.assertEqual([result.kind for result in results], ['article'])
+        Post.objects.create(parasite=self.parasite, user=self.user.userprofile, title='Notes',
+                            content='genome genome genome')
+        self.assertEqual(search.search(self.user, 'genome').results[0].object_id, self.research_post.id)
+
+    def test_results_are_paginated(self):
+        first = search.search(self.user, 'malaria', page_size=3)
+        second = search.search(self.user, 'malaria', page=2, page_size=3)
+        self.assertTrue(first.has_next)
+        self.assertFalse(second.has_next)
+        self.assertEqual(len(first.results) + len(second.results), 4)
+
+    def test_search_page(self):
+        self.client.login(username='clinician', password='password')
+        self.comment.comment_text = 'Try <b>artemisinin</b>'
+        self.comment.save()
+        response = self.client.get(reverse('parasitologyTool:content_search'), {'q': 'artemisinin'})
+        self.assertContains(response, '&lt;b&gt;<mark>artemisinin</mark>&lt;/b&gt;')
+        self.assertContains(response, reverse('parasitologyTool:clinical_post_page',
+                                              args=[self.parasite.id, self.clinical_post.id]))
+        response = self.client.get(reverse('parasitologyTool:content_search'), {'q': '"OR NOT *'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_rebuild(self):
+        Comment.objects.create(user=self.user.userprofile, comment_text='on no post')
+        self.assertEqual(search.rebuild(), 5)
+        self.assertEqual(self.kinds(self.user, 'artemisinin'), {'comment'})
+
+    def test_comments_follow_their_post_title(self):
+        self.clinical_post.title = 'Relapsing case'
+        self.clinical_post.save()
+        [result] = search.search(self.user, 'artemisinin').results
+        self.assertEqual(result.label, 'Relapsing case')
+
+
+class UserSearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        for username in ('Alice', 'alison', 'bob', 'Albert'):
+            make_user(username)
+        self.client.login(username='bob', password='password')
+
+    def test_prefix_match_ignores_case(self):
+        self.assertEqual([match.username for match in search.search_users('AL').results], ['Albert', 'Alice', 'alison'])
+        self.assertEqual(search.search_users('ali').results, [('Alice', 'clinician'), ('alison', 'clinician')])
+        self.assertEqual(search.search_users('').results, [])
+
+    def test_prefix_ending_in_the_last_code_point(self):
+        make_user('al\U0010ffff')
+        self.assertEqual([match.username for match in search.search_users('al\U0010ffff').results], ['al\U0010ffff'])
+        self.assertEqual(search.search_users('\U0010ffff').results, [])
+        self.assertEqual(self.client.get(reverse('parasitologyTool:search_results'), {'q': '\U0010ffff'}).status_code,
+                         200)
+
+    def test_renaming_a_user_updates_the_index(self):
+        user = User.objects.get(username='bob')
+        user.username = 'Robert'
+        user.save()
+        self.assertEqual([match.username for match in search.search_users('rob').results], ['Robert'])
+
+    def test_results_page_takes_a_fixed_number_of_queries(self):
+        url = reverse('parasitologyTool:search_results')
+        self.client.get(url, {'q': 'a'})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'q': 'al'})
+        self.assertContains(response, 'alison')
+        self.assertEqual(len([query for query in queries if 'parasitologyTool_userprofile' in query['sql']]), 1)
+
+    def test_results_are_paginated(self):
+        first = search.search_users('al', page_size=2)
+        second = search.search_users('al', page=2, page_size=2)
+        self.assertTrue(first.has_next)
+        self.assertEqual([match.username for match in second.results], ['alison'])
+        self.assertFalse(second.has_next)
+
+    def test_autocomplete(self):
+        response = self.client.get(reverse('parasitologyTool:autocomplete_users'), {'q': 'al'})
+        self.assertEqual(response.json(), {'usernames': ['Albert', 'Alice', 'alison']})
+
+
+class ThumbnailTests(TempMediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = make_user('clinician')
+
+    def upload(self, name='photo.jpg', size=(2000, 1000)):
+        buffer = BytesIO()
+        Image.new('RGB', size, 'red').save(buffer, 'JPEG')
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+    def test_uploads_get_resized_copies(self):
+        parasite = Parasite.objects.create(name='Plasmodium', picture=self.upload())
+        self.assertFalse(thumbnails.has_variants(parasite.picture.name))
+        self.assertEqual(jobs.run_pending(), 1)
+        for name in thumbnails.variant_names(parasite.picture.name):
+            self.assertTrue(default_storage.exists(name), name)
+        with default_storage.open(thumbnails.variant_name(parasite.picture.name, 320, 'webp')) as copy:
+            self.assertEqual(Image.open(copy).size, (320, 160))
+
+    def test_rows_without_a_file_are_ready(self):
+        parasite = Parasite.objects.create(name='Plasmodium', picture='parasite_pic/Plasmodium.jpg')
+        post = ResearchPost.objects.create(parasite=parasite, user=self.user.userprofile, title='Genome', content='')
+        image = ResearchImage.objects.create(research_post=post)
+        attachment = ResearchFile.objects.create(research_post=post)
+        self.assertEqual(jobs.run_pending(), 0)
+        self.assertEqual(ResearchImage.objects.get(pk=image.pk).status, 'ready')
+        self.assertEqual(ResearchFile.objects.get(pk=attachment.pk).status, 'ready')
+
+    def test_tag_falls_back_to_the_original(self):
+        parasite = Parasite.objects.create(name='Plasmodium', picture='parasite_pic/Plasmodium.jpg')
+        html = Template('{% load parasitologyTool_template_tags %}{% responsive_image p.picture alt="x" %}').render(
+            TemplateContext({'p': parasite}))
+        self.assertEqual(html, f'<img src="{parasite.picture.url}" alt="x"/>')
+
+        parasite.picture = self.upload()
+        parasite.save()
+        jobs.run_pending()
+        html = Template('{% load parasitologyTool_template_tags %}{% responsive_image p.picture sizes="50px" %}').render(
+            TemplateContext({'p': parasite}))
+        self.assertIn('type="image/webp"', html)
+        self.assertIn(default_storage.url(thumbnails.variant_name(parasite.picture.name, 96, 'jpg')) + ' 96w', html)
+        self.assertIn('sizes="50px"', html)
+
+    def test_copies_are_deleted_with_the_original(self):
+        parasite = Parasite.objects.create(name='Plasmodium', picture=self.upload())
+        jobs.run_pending()
+        names = thumbnails.variant_names(parasite.picture.name)
+        with self.captureOnCommitCallbacks(execute=True):
+            parasite.delete()
+        run_blob_deletions()
+        self.assertFalse([name for name in names if default_storage.exists(name)])
+
+
+class JobTests(TempMediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        user = make_user('researcher', role='researcher')
+        parasite = Parasite.objects.create(name='Plasmodium', picture='parasite_pic/Plasmodium.jpg')
+        self.post = ResearchPost.objects.create(parasite=parasite, user=user.userprofile, title='Genome', content='')
+        self.calls = []
+        jobs.task('flaky', on_failure=lambda *args: self.calls.append(('gave up',) + args))(self.flaky)
+        self.addCleanup(jobs._tasks.pop, 'flaky')
+
+    def flaky(self, *args):
+        self.calls.append(args)
+        raise RuntimeError("try again")
+
+    def test_failing_jobs_are_retried_then_given_up(self):
+        job = jobs.enqueue('flaky', 1, max_attempts=2)
+        with self.assertLogs('parasitologyTool.jobs', 'WARNING'):
+            self.assertEqual(jobs.run_pending(), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('pending', 1))
+        self.assertGreater(job.run_after, timezone.now())
+        self.assertIn('try again', job.last_error)
+        # not due yet
+        self.assertIsNone(jobs.claim())
+
+        Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        with self.assertLogs('parasitologyTool.jobs', 'ERROR'):
+            jobs.run_pending()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('failed', 2))
+        self.assertEqual(self.calls, [(1,), (1,), ('gave up', 1)])
+
+    def test_a_job_is_claimed_once(self):
+        jobs.enqueue('flaky')
+        self.assertIsNotNone(jobs.claim())
+        self.assertIsNone(jobs.claim())
+
+    def test_jobs_of_dead_workers_are_taken_up_again(self):
+        job = jobs.enqueue('flaky')
+        jobs.claim()
+        Job.objects.filter(pk=job.pk).update(locked_at=timezone.now() - timedelta(seconds=jobs.TIMEOUT_SECONDS + 1))
+        self.assertEqual(jobs.claim().pk, job.pk)
+
+    def test_attachments_are_processed_in_the_background(self):
+        pdf = ResearchFile.objects.create(research_post=self.post,
+                                          file=SimpleUploadedFile('paper.pdf', b'%PDF-1.4 ...'))
+        fake = ResearchFile.objects.create(research_post=self.post,
+                                           file=SimpleUploadedFile('fake.pdf', b'MZ not a pdf'))
+        buffer = BytesIO()
+        Image.new('RGB', (50, 50)).save(buffer, 'PNG')
+        image = ResearchImage.objects.create(research_post=self.post,
+                                             image=SimpleUploadedFile('scan.png', buffer.getvalue()))
+        self.assertEqual(image.status, 'pending')
+
+        self.assertEqual(jobs.run_pending(), 3)
+        statuses = {obj.pk: obj.status for obj in ResearchFile.objects.all()}
+        self.assertEqual(statuses, {pdf.pk: 'ready', fake.pk: 'failed'})
+        image.refresh_from_db()
+        self.assertEqual(image.status, 'ready')
+        self.assertFalse(Job.objects.exists())
+
+    def test_run_workers_once(self):
+        ResearchFile.objects.create(research_post=self.post, file=SimpleUploadedFile('paper.pdf', b'%PDF-1.4'))
+        out = StringIO()
+        call_command('run_workers', '--once', stdout=out)
+        self.assertIn('ran 1 job(s)', out.getvalue())
+
+
+class UploadTests(TempMediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        make_user('researcher', role='researcher')
+        self.client = Client(enforce_csrf_checks=True)
+        self.client.login(username='researcher', password='password')
+        self.parasite = Parasite.objects.create(name='Plasmodium', picture='parasite_pic/Plasmodium.jpg')
+        self.url = reverse('parasitologyTool:add_research_post', args=[self.parasite.id])
+        self.csrf_token = self.client.get(self.url).context['csrf_token']
+
+    def image(self, name):
+        buffer = BytesIO()
+        Image.new('RGB', (40, 40), 'blue').save(buffer, 'PNG')
+        return SimpleUploadedFile(name, buffer.getvalue())
+
+    def post(self, **files):
+        data = {'title': 'Genome', 'content': 'Sequencing', 'likes': 0, 'csrfmiddlewaretoken': self.csrf_token}
+        return self.client.post(self.url, {**data, **files})
+
+    def test_attachments_are_inserted_together(self):
+        pdf = b'%PDF-1.4 ' + b'x' * 1000
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post(images=[self.image('a.png'), self.image('b.png'), self.image('c.png')],
+                                 files=[SimpleUploadedFile('paper.pdf', pdf)])
+        self.assertEqual(response.status_code, 302)
+        inserts = [query['sql'] for query in queries if query['sql'].startswith('INSERT INTO "parasitologyTool_research')]
+        # the post, the images and the files
+        self.assertEqual(len(inserts), 3)
+
+        post = ResearchPost.objects.get()
+        self.assertEqual(post.researchimage_set.count(), 3)
+        self.assertEqual(post.researchfile_set.get().sha256, hashlib.sha256(pdf).hexdigest())
+        self.assertEqual(Job.objects.get().task, 'process_attachments')
+        jobs.run_pending()
+        self.assertEqual(set(ResearchImage.objects.values_list('status', flat=True)), {'ready'})
+        self.assertEqual(post.researchfile_set.get().status, 'ready')
+
+    def test_disallowed_types_are_refused(self):
+        response = self.post(images=[self.image('a.png')], files=[SimpleUploadedFile('run.exe', b'MZ')])
+        self.assertContains(response, 'run.exe is not a file type that can be uploaded here.')
+        self.assertFalse(ResearchPost.objects.exists())
+
+    def test_oversized_files_are_refused(self):
+        with mock.patch.object(uploads, 'MAX_FILE_BYTES', 100):
+            response = self.post(files=[SimpleUploadedFile('big.pdf', b'%PDF-' + b'x' * 200)])
+        self.assertContains(response, 'big.pdf is too big')
+        self.assertFalse(ResearchPost.objects.exists())
+
+    def test_oversized_requests_are_not_read(self):
+        with mock.patch.object(uploads, 'MAX_REQUEST_BYTES', 100):
+            response = self.post(files=[SimpleUploadedFile('big.pdf', b'%PDF-' + b'x' * 200)])
+        self.assertContains(response, 'The upload is too big', status_code=413)
+        self.assertFalse(ResearchPost.objects.exists())
+
+
+class ContentAddressedStorageTests(TempMediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.profile = make_user('clinician').userprofile
+        buffer = BytesIO()
+        Image.new('RGB', (60, 60), 'green').save(buffer, 'JPEG')
+        self.picture = buffer.getvalue()
+
+    def test_identical_uploads_share_one_blob(self):
+        parasite = Parasite.objects.create(name='Plasmodium', picture=SimpleUploadedFile('a.jpg', self.picture))
+        self.profile.profile_picture = SimpleUploadedFile('b.JPG', self.picture)
+        self.profile.save()
+        self.assertEqual(parasite.picture.name, self.profile.profile_picture.name)
+        self.assertEqual(parasite.picture.name, storage.blob_name(hashlib.sha256(self.picture).hexdigest(), 'a.jpg'))
+        self.assertEqual(storage.references(parasite.picture.name), 2)
+
+        # attachments of gated posts are kept apart
+        post = Post.objects.create(parasite=parasite, user=self.profile, title='Case', content='')
+        image = ClinicalImage.objects.create(clinical_post=post, image=SimpleUploadedFile('c.jpg', self.picture))
+        self.assertEqual(image.image.name, 'private/' + parasite.picture.name)
+
+    def test_blobs_are_deleted_with_their_last_reference(self):
+        parasite = Parasite.objects.create(name='Plasmodium', picture=SimpleUploadedFile('a.jpg', self.picture))
+        article = Article.objects.create(parasite=parasite, user=self.profile, title='Malaria', content='',
+                                         url='https://example.com', picture=SimpleUploadedFile('c.jpg', self.picture))
+        jobs.run_pending()
+        name = parasite.picture.name
+        self.assertTrue(thumbnails.has_variants(name))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            article.delete()
+        self.assertTrue(default_storage.exists(name))
+        self.assertTrue(thumbnails.has_variants(name))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            parasite.delete()
+        # removed by a job once the grace period is over
+        jobs.run_pending()
+        self.assertTrue(default_storage.exists(name))
+        run_blob_deletions()
+        self.assertFalse(default_storage.exists(name))
+        self.assertFalse(thumbnails.has_variants(name))
+
+    def test_blobs_uploaded_again_before_the_job_runs_are_kept(self):
+        parasite = Parasite.objects.create(name='Plasmodium', picture=SimpleUploadedFile('a.jpg', self.picture))
+        name = parasite.picture.name
+        with self.captureOnCommitCallbacks(execute=True):
+            parasite.delete()
+        self.assertEqual(storage.references(name), 0)
+
+        # an upload of the same picture, whose row isn't saved yet
+        self.assertEqual(default_storage.save('b.jpg', ContentFile(self.picture)), name)
+        later = timezone.now() + timedelta(seconds=storage.DELETE_GRACE_SECONDS)
+        with mock.patch.object(jobs, 'timezone', mock.Mock(now=lambda: later)):
+            jobs.run_pending()
+        self.assertTrue(default_storage.exists(name))
+        with mock.patch.object(storage, 'DELETE_GRACE_SECONDS', 0):
+            self.assertTrue(default_storage.delete_unreferenced(name))
+
+    def test_dedupe_media(self):
+        for name in ('parasite_pic/a.jpg', 'article_pic/a_X1y2Z3.jpg', 'clinical_pictures/b.jpg'):
+            path = os.path.join(self.media_root, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as file:
+                file.write(self.picture)
+        parasite = Parasite.objects.create(name='Plasmodium', picture='parasite_pic/a.jpg')
+        article = Article.objects.create(parasite=parasite, user=self.profile, title='Malaria', content='',
+                                         url='https://example.com', picture='article_pic/a_X1y2Z3.jpg')
+        post = Post.objects.create(title='post', content='content', parasite=parasite, user=self.profile)
+        image = ClinicalImage.objects.create(clinical_post=post, image='clinical_pictures/b.jpg')
+
+        call_command('dedupe_media', stdout=StringIO())
+        parasite.refresh_from_db()
+        article.refresh_from_db()
+        image.refresh_from_db()
+        self.assertTrue(image.image.name.startswith('private/blobs/'))
+        self.assertTrue(parasite.picture.name.startswith('blobs/'))
+        self.assertEqual(parasite.picture.name, article.picture.name)
+        self.assertTrue(default_storage.exists(parasite.picture.name))
+        self.assertFalse(default_storage.exists('parasite_pic/a.jpg'))
+        self.assertFalse(default_storage.exists('article_pic/a_X1y2Z3.jpg'))
+        # the default profile picture stays where the field expects it
+        self.assertEqual(self.profile.profile_picture.name, 'profile_pictures/default_pic.png')
+
+        # a second run finds nothing left to move
+        jobs_before = Job.objects.count()
+        output = StringIO()
+        call_command('dedupe_media', stdout=output)
+        self.assertIn('moved 0 file(s)', output.getvalue())
+        self.assertEqual(Job.objects.count(), jobs_before)
+        self.assertTrue(default_storage.exists(image.image.name))
+
+
+class MediaServingTests(TempMediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.content = bytes(range(256)) * 40
+        self.name = default_storage.save('article_pic/guide.pdf', ContentFile(self.content))
+        self.url = settings.MEDIA_URL + self.name
+
+    def test_whole_file(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        # a blob's name is its hash, so it can be cached for good
+        self.assertTrue(self.name.startswith('blobs/'))
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(response['ETag'], f'"{hashlib.sha256(self.content).hexdigest()}"')
+
+    def test_conditional_requests(self):
+        response = self.client.get(self.url)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+
+    def test_ranges(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=100-199')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), self.content[100:200])
+        self.assertEqual(response['Content-Range'], f'bytes 100-199/{len(self.content)}')
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-10')
+        self.assertEqual(b''.join(response.streaming_content), self.content[-10:])
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE=f'bytes={len(self.content)}-').status_code, 416)
+        # a range ending before it starts is invalid, so the header is ignored
+        response = self.client.get(self.url, HTTP_RANGE='bytes=200-100')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        # a stale If-Range gets the whole, current file
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_missing_and_outside_files(self):
+        self.assertEqual(self.client.get(settings.MEDIA_URL + 'article_pic/none.pdf').status_code, 404)
+        self.assertEqual(self.client.get(settings.MEDIA_URL + '../manage.py').status_code, 404)
+
+    def test_offloading_to_the_front_end_server(self):
+        with mock.patch.object(media, 'SERVE_MODE', 'x-accel-redirect'):
+            response = self.client.get(self.url)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/' + self.name)
+        self.assertEqual(response.content, b'')
+
+
+class SignedMediaTests(TempMediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        user = make_user('researcher', role='researcher')
+        parasite = Parasite.objects.create(name='Plasmodium', picture='parasite_pic/Plasmodium.jpg')
+        post = ResearchPost.objects.create(parasite=parasite, user=user.userprofile, title='Genome', content='')
+        self.attachment = ResearchFile.objects.create(research_post=post, original_name='paper.pdf',
+                                                      file=SimpleUploadedFile('paper.pdf', b'%PDF-1.4 data'))
+        self.name = self.attachment.file.name
+
+    def test_attachments_are_stored_privately(self):
+        self.assertTrue(self.name.startswith('private/blobs/'))
+        self.assertEqual(self.client.get(settings.MEDIA_URL + self.name).status_code, 403)
+
+    def test_paths_around_the_gate_are_refused(self):
+        for path in (f'profile_pictures/../{self.name}', f'./{self.name}', f'/{self.name}',
+                     self.name.replace('/', '//', 1)):
+            self.assertEqual(self.client.get(settings.MEDIA_URL + path).status_code, 404, path)
+
+    def test_signed_urls(self):
+        url = self.attachment.file.url
+        self.assertIn('signature=', url)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'%PDF-1.4 data')
+        self.assertTrue(response['Cache-Control'].startswith('private'))
+
+        # for another file
+        other = ResearchFile.objects.create(research_post=self.attachment.research_post,
+                                            file=SimpleUploadedFile('other.pdf', b'%PDF-1.4 other'))
+        self.assertEqual(self.client.get(settings.MEDIA_URL + other.file.name + '?' + url.split('?')[1]).status_code, 403)
+
+    def test_signatures_expire(self):
+        expires = signing.expiry(now=1000)
+        self.assertGreaterEqual(expires, 1000 + signing.LIFETIME_SECONDS)
+        self.assertEqual(expires % signing.ROUNDING_SECONDS, 0)
+        good = signing.signature(self.name, expires)
+        self.assertIsNotNone(signing.verify(self.name, expires, good, now=1000))
+        self.assertIsNone(signing.verify(self.name, expires, good, now=expires))
+        self.assertIsNone(signing.verify(self.name, expires + 1, good, now=1000))
+
+    def test_post_pages_link_signed_urls(self):
+        self.client.login(username='researcher', password='password')
+        post = self.attachment.research_post
+        response = self.client.get(reverse('parasitologyTool:research_post_page', args=[post.parasite_id, post.id]))
+        self.assertContains(response, 'signature=')
+        self.assertContains(response, 'paper.pdf')
+
+
+class SeedDataTests(TempMediaRootMixin, TestCase):
+    def test_seeded_rows_are_consistent(self):
+        totals = seeding.seed(parasites=2, users=10, posts=5, articles=2, comments=2, replies=1, likes=3,
+                              random_seed=1)
+        self.assertEqual(totals['parasite'], 2)
+        self.assertEqual(Post.objects.count(), totals['post'])
+        self.assertEqual(ResearchPost.objects.count(), totals['researchpost'])
+        self.assertEqual(Comment.objects.count(), totals['comment'])
+        self.assertEqual(Reply.objects.count(), totals['reply'])
+        self.assertEqual(PostScore.objects.count(), totals['post'] + totals['researchpost'])
+
+        # the counters written with the posts match the reactions
+        self.assertEqual(reactions.recount(Post) + reactions.recount(ResearchPost), 0)
+        post = Post.objects.order_by('-like_count', 'pk').first()
+        self.assertEqual(post.like_count, post.likes.count())
+
+        # seeded users can log in, and the posts are in the search index
+        self.assertTrue(self.client.login(username=post.user.user.username, password=seeding.SEED_PASSWORD))
+        results = search.search(make_user('reader'), post.title, page_size=100).results
+        self.assertIn(('post', post.pk), {(result.kind, result.object_id) for result in results})
+
+    def test_skew(self):
+        rng = random.Random(1)
+        even = seeding.skewed_counts(10000, 4, 0, rng)
+        skewed = seeding.skewed_counts(10000, 4, 2, rng)
+        self.assertEqual(sum(skewed), 10000)
+        self.assertLess(max(even) - min(even), 1000)
+        self.assertGreater(skewed[0], 5 * skewed[3])
+
+
+class LoadTestReportTests(SimpleTestCase):
+    def test_percentiles(self):
+        values = list(range(1, 101))
+        self.assertEqual(loadtest.percentile(values, 0.5), 50)
+        self.assertEqual(loadtest.percentile(values, 0.99), 99)
+        self.assertEqual(loadtest.percentile([7], 0.95), 7)
+        self.assertIsNone(loadtest.percentile([], 0.5))
+
+    def test_report_groups_by_view(self):
+        samples = [loadtest.Sample('index', 0.010, 200, True), loadtest.Sample('index', 0.030, 200, True),
+                   loadtest.Sample('like', 0.020, 403, False), loadtest.Sample('like', 5.0, None, False)]
+        rows = loadtest.report(samples, elapsed=2)
+        self.assertEqual(rows['index']['requests'], 2)
+        self.assertEqual(rows['index']['errors'], 0)
+        self.assertEqual(rows['index']['p50_ms'], 10)
+        self.assertEqual(rows['like']['errors'], 2)
+        self.assertEqual(rows['like']['per_second'], 1)
+
+    def test_parse_mix(self):
+        self.assertEqual(loadtest.parse_mix('browse=9, like=1'), {'browse': 9, 'like': 1})
+        with self.assertRaises(ValueError):
+            loadtest.parse_mix('browse=9,shop=1')
+
+
+class BenchmarkTests(TempMediaRootMixin, TestCase):
+    # the files are made in setUpTestData, so they have to last the whole class
+    class_media_root = True
+
+    @classmethod
+    def setUpTestData(cls):
+        benchmarks.seed()
+
+    def test_every_route_is_benchmarked_or_skipped(self):
+        self.assertEqual(benchmarks.uncovered(), set())
+
+    def test_counts_are_within_the_baseline(self):
+        # wall time depends on the machine, so only `manage.py benchmark` checks it
+        results = benchmarks.measure(repeat=1)
+        self.assertEqual(benchmarks.compare(results, benchmarks.load_baseline(),
+                                            metrics=('queries', 'rows', 'bytes')), [])
+
+    def test_regressions_are_reported(self):
+        baseline = {'dataset': benchmarks.DATASET,
+                    'routes': {'index': {'seconds': 0.010, 'queries': 3, 'rows': 3, 'bytes': 1000}}}
+        result = {'status': 200, 'seconds': 0.012, 'queries': 4, 'rows': 3, 'bytes': 1050}
+        failures = benchmarks.compare({'index': result}, baseline)
+        self.assertEqual(len(failures), 1)
+        self.assertIn('queries went from 3 to 4', failures[0])
+
+        self.assertEqual(len(benchmarks.compare({'index': result}, dict(baseline, dataset={}))), 1)
+
+
+class ProfilingTests(TestCase):
+    def setUp(self):
+        self.user = make_user('clinician')
+        self.parasite = Parasite.objects.create(name='Plasmodium', picture='parasite_pic/Plasmodium.jpg')
+        for i in range(3):
+            Post.objects.create(title=f'post {i}', content='content', parasite=self.parasite,
+                                user=self.user.userprofile)
+        enabled = mock.patch.object(profiling, 'ENABLED', True)
+        enabled.start()
+        self.addCleanup(enabled.stop)
+        # the middleware is loaded by the first request of a new client
+        self.client = Client()
+        self.client.force_login(self.user)
+
+    def get(self, url):
+        with self.assertLogs('parasitologyTool.profiling', 'INFO') as logs:
+            response = self.client.get(url)
+        return response, json.loads(logs.records[-1].getMessage())
+
+    def test_timings_are_reported(self):
+        url = reverse('parasitologyTool:clinical_parasite_page', args=[self.parasite.id])
+        response, record = self.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertRegex(response['Server-Timing'],
+                         r'^total;dur=[\d.]+, sql;dur=[\d.]+;desc="\d+ queries", template;dur=[\d.]+$')
+        self.assertEqual(record['view'], 'parasitologyTool:clinical_parasite_page')
+        self.assertEqual(record['status'], 200)
+        self.assertGreater(record['queries'], 0)
+        self.assertIn('parasitologyTool/clinical_parasite_page.html', record['templates'])
+        self.assertIn('parasitologyTool/base.html', record['templates'])
+        self.assertLessEqual(record['template_ms'], record['total_ms'])
+        # the page still renders for the test client's own template instrumentation
+        self.assertEqual(len(response.context['posts']), 3)
+
+    def test_repeated_queries_are_fingerprinted(self):
+        def n_plus_one(request):
+            return HttpResponse(str([post.user.user.username for post in Post.objects.all()]))
+
+        with self.assertLogs('parasitologyTool.profiling', 'INFO') as logs:
+            profiling.ProfilingMiddleware(n_plus_one)(RequestFactory().get('/'))
+        duplicates = json.loads(logs.records[-1].getMessage())['duplicates']
+        self.assertEqual(duplicates[0]['count'], 3)
+        self.assertIn('FROM "parasitologyTool_userprofile"', duplicates[0]['sql'])
+        self.assertEqual(profiling.fingerprint('SELECT 1 WHERE id IN (%s, %s,  %s)'),
+                         profiling.fingerprint('SELECT 1 WHERE id IN (%s)'))
+
+    def test_slow_requests_are_sampled(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        def slow(request):
+            time.sleep(0.05)
+            return HttpResponse()
+
+        with mock.patch.multiple(profiling, SAMPLER='stacks', SLOW_MS=20, SAMPLE_INTERVAL_MS=1,
+                                 DIRECTORY=directory), self.assertLogs('parasitologyTool.profiling', 'INFO') as logs:
+            profiling.ProfilingMiddleware(slow)(RequestFactory().get('/'))
+        path = json.loads(logs.records[-1].getMessage())['profile']
+        with open(path) as file:
+            self.assertIn('tests.py:slow', file.read())
+
+    def test_off_by_default(self):
+        with mock.patch.object(profiling, 'ENABLED', False), self.assertRaises(MiddlewareNotUsed):
+            profiling.ProfilingMiddleware(lambda request: HttpResponse())
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+        self.user = make_user('clinician')
+        parasite = Parasite.objects.create(name='Plasmodium', picture='parasite_pic/Plasmodium.jpg')
+        self.post = Post.objects.create(title='post', content='content', parasite=parasite,
+                                        user=self.user.userprofile)
+        self.client.login(username='clinician', password='password')
+
+    def scrape(self):
+        with mock.patch.object(metrics, 'ALLOWED_IPS', ['127.0.0.1']):
+            response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+        return response.content.decode()
+
+    def test_views_are_counted(self):
+        self.client.post(reverse('parasitologyTool:like', args=['Post', self.post.id]))
+        self.client.get(reverse('parasitologyTool:clinical_post_page', args=[self.post.parasite_id, self.post.id]))
+        text = self.scrape()
+        self.assertIn('parasitology_interactions_total{kind="like"} 1\n', text)
+        self.assertIn('parasitology_http_requests_total{view="parasitologyTool:like",method="POST",status="200"} 1\n',
+                      text)
+        self.assertIn('parasitology_http_request_duration_seconds_count{view="parasitologyTool:like"} 1\n', text)
+        self.assertIn('parasitology_http_request_duration_seconds_bucket{view="parasitologyTool:like",le="+Inf"} 1\n',
+                      text)
+        self.assertIn('parasitology_cache_lookups_total{cache="object",result="miss"} ', text)
+        self.assertIn('parasitology_active_users{role="clinician"} 1\n', text)
+        self.assertIn('# TYPE parasitology_db_queries_per_request histogram\n', text)
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = metrics.Histogram('test_seconds', "Test.", ['view'], buckets=(1, 2))
+        self.addCleanup(metrics.REGISTRY.pop, histogram.name)
+        for value in (0.5, 1.5, 1.5, 3):
+            histogram.observe(value, view='a')
+        samples = list(histogram.samples(*metrics.collect()))
+        self.assertEqual(samples, [
+            'parasitology_test_seconds_bucket{view="a",le="1"} 1',
+            'parasitology_test_seconds_bucket{view="a",le="2"} 3',
+            'parasitology_test_seconds_bucket{view="a",le="+Inf"} 4',
+            'parasitology_test_seconds_sum{view="a"} 6.5',
+            'parasitology_test_seconds_count{view="a"} 4',
+        ])
+
+    def test_processes_are_added_up(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with mock.patch.object(metrics, 'DIRECTORY', directory):
+            metrics.INTERACTIONS.inc(kind='reply')
+            metrics.ACTIVE_USERS.seen('clinician', self.user.pk)
+            metrics.flush()
+            # what a second worker process would start from
+            metrics.reset()
+            metrics.INTERACTIONS.inc(2, kind='reply')
+            metrics.ACTIVE_USERS.seen('clinician', self.user.pk)
+            values, active = metrics.collect()
+        self.assertEqual(len(os.listdir(directory)), 2)
+        self.assertEqual(values[('parasitology_interactions_total', ('reply',))], 3)
+        self.assertEqual(active, {'clinician': 1})
+
+    def test_only_admins_and_scrapers_are_served(self):
+        # local too, as behind a proxy every request is
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        with mock.patch.object(metrics, 'TOKEN', 'secret'):
+            self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+            self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+        admin = make_user('admin', role='admin')
+        self.client.force_login(admin)
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.0.0.1').status_code, 200)
+
+
+FORM_ENCODED = 'application/x-www-form-urlencoded'
+
+
+class AsyncViewTests(TransactionTestCase):
+    # the views query from the ORM thread pool, whose connections can't see a test's uncommitted transaction
+
+    def setUp(self):
+        cache.clear()
+        objcache.clear_local()
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+        self.user = make_user('clinician')
+        parasite = Parasite.objects.create(name='Plasmodium', picture='parasite_pic/Plasmodium.jpg')
+        self.post = Post.objects.create(title='post', content='content', parasite=parasite,
+                                        user=self.user.userprofile)
+        self.comment = Comment.objects.create(comment_text='comment', clinical_post=self.post,
+                                              user=self.user.userprofile)
+        # the URLs as asgi.py serves them
+        with override_settings(ASYNC_VIEWS=True):
+            self.reload_urls()
+        self.addCleanup(self.reload_urls)
+        self.async_client.force_login(self.user)
+
+    def reload_urls(self):
+        importlib.reload(app_urls)
+        importlib.reload(project_urls)
+        clear_url_caches()
+
+    def test_routes_follow_the_setting(self):
+        url = reverse('parasitologyTool:like', args=['Post', self.post.id])
+        self.assertIs(resolve(url).func, async_views.add_like)
+        self.reload_urls()
+        self.assertIs(resolve(url).func.view_class, views.AddLike)
+
+    async def test_like_toggles(self):
+        url = reverse('parasitologyTool:like', args=['Post', self.post.id])
+        response = await self.async_client.post(url)
+        self.assertEqual(response.json(), {'message': "Successfully liked post.", 'likes': 1, 'dislikes': 0})
+        self.assertEqual((await self.async_client.post(url)).json()['likes'], 0)
+        await sync_to_async(self.post.refresh_from_db)()
+        self.assertEqual(self.post.like_count, 0)
+
+        missing = reverse('parasitologyTool:dislike', args=['ResearchPost', 1000])
+        self.assertEqual((await self.async_client.post(missing)).status_code, 404)
+
+        # the queries made in the ORM threads are counted for the request
+        values, active = metrics.collect()
+        queries_sum = values[('parasitology_db_queries_per_request', ('parasitologyTool:like',))][-2]
+        self.assertGreater(queries_sum, 0)
+        # taking the like back isn't counted
+        self.assertEqual(values[('parasitology_interactions_total', ('like',))], 1)
+        self.assertEqual(active, {'clinician': 1})
+
+    async def test_reply_is_saved(self):
+        url = reverse('parasitologyTool:comment-reply', args=[self.post.id, self.comment.id])
+        # form encoded, as the page sends it
+        response = await self.async_client.post(url, 'reply_text=a+reply', content_type=FORM_ENCODED)
+        self.assertEqual(response.json(), {'reply_text': 'a reply', 'comment_id': self.comment.id,
+                                           'username': 'clinician'})
+        self.assertEqual((await self.async_client.post(url, 'reply_text=+', content_type=FORM_ENCODED)).json(),
+                         {'message': 'empty string'})
+        replies = await sync_to_async(list)(Reply.objects.values_list('reply_text', 'user__user__username'))
+        self.assertEqual(replies, [('a reply', 'clinician')])
+
+    async def test_login_and_post_are_required(self):
+        url = reverse('parasitologyTool:like', args=['Post', self.post.id])
+        self.assertEqual((await self.async_client.get(url)).status_code, 405)
+        await sync_to_async(self.async_client.logout)()
+        response = await self.async_client.post(url)
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response.url.startswith(reverse('parasitologyTool:login')))
+
+    async def test_orm_threads_are_bounded(self):
+        running, most = 0, 0
+        lock = threading.Lock()
+
+        def query():
+            nonlocal running, most
+            with lock:
+                running += 1
+                most = max(most, running)
+            time.sleep(0.02)
+            with lock:
+                running -= 1
+
+        with mock.patch.object(async_views, '_executor', ThreadPoolExecutor(max_workers=2)):
+            await asyncio.gather(*(async_views.run_orm(query) for _ in range(6)))
+        self.assertEqual(most, 2)
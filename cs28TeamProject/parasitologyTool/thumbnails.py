@@ -0,0 +1,187 @@
+"""
+Smaller copies of uploaded pictures, for srcset.
+
+Every picture gets one resized copy per width in THUMBNAIL_WIDTHS, each as
+WebP and in a fallback format (PNG for pictures that may be transparent,
+JPEG otherwise), stored next to the original:
+
+    clinical_pictures/Helminths.jpg
+    clinical_pictures/thumbs/Helminths.320w.webp
+    clinical_pictures/thumbs/Helminths.320w.jpg
+    ...
+
+The copies are made by a background job (see jobs.py) queued when a
+picture is uploaded, and by `manage.py generate_thumbnails` for pictures
+already on disk; they are deleted along with the original when
+django_cleanup deletes it. Pictures are never scaled up, so a copy can be
+narrower than its name says; the browser still picks a sensible one.
+Templates use the {% responsive_image %} tag, which falls back to the
+original until its copies exist.
+"""
+
+import logging
+import posixpath
+from io import BytesIO
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db.models.signals import post_save, pre_save
+from django_cleanup.signals import cleanup_post_delete, cleanup_pre_delete
+from PIL import Image, ImageOps
+
+from . import jobs, storage
+from .models import Article, ClinicalImage, Parasite, ResearchImage, UserProfile
+
+logger = logging.getLogger(__name__)
+
+WIDTHS = tuple(getattr(settings, 'THUMBNAIL_WIDTHS', (96, 320, 640, 1280)))
+WEBP_QUALITY = getattr(settings, 'THUMBNAIL_WEBP_QUALITY', 80)
+JPEG_QUALITY = getattr(settings, 'THUMBNAIL_JPEG_QUALITY', 85)
+
+# the picture field of every model that has one
+IMAGE_FIELDS = {
+    ClinicalImage: 'image',
+    ResearchImage: 'image',
+    Parasite: 'picture',
+    Article: 'picture',
+    UserProfile: 'profile_picture',
+}
+
+# extension: (Pillow format, save options)
+FORMATS = {
+    'webp': ('WEBP', {'quality': WEBP_QUALITY, 'method': 4}),
+    'jpg': ('JPEG', {'quality': JPEG_QUALITY, 'optimize': True, 'progressive': True}),
+    'png': ('PNG', {'optimize': True}),
+}
+
+
+def fallback_format(name):
+    # decided from the name alone, so templates can build URLs without opening the file
+    return 'png' if posixpath.splitext(name)[1].lower() in ('.png', '.gif') else 'jpg'
+
+
+def variant_name(name, width, extension):
+    directory, filename = posixpath.split(name)
+    stem = posixpath.splitext(filename)[0]
+    return posixpath.join(directory, 'thumbs', f'{stem}.{width}w.{extension}')
+
+
+def variant_names(name):
+    return [variant_name(name, width, extension)
+            for width in WIDTHS for extension in ('webp', fallback_format(name))]
+
+
+def has_variants(name, storage=default_storage):
+    # the largest copy is written last, so once it exists all of them do
+    return storage.exists(variant_name(name, WIDTHS[-1], fallback_format(name)))
+
+
+def _encode(image, extension):
+    pillow_format, options = FORMATS[extension]
+    if pillow_format == 'JPEG' and image.mode != 'RGB':
+        image = image.convert('RGB')
+    elif image.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+        image = image.convert('RGBA')
+    buffer = BytesIO()
+    # nothing but the pixels is written, so EXIF data (GPS position etc.) is dropped
+    image.save(buffer, pillow_format, **options)
+    return ContentFile(buffer.getvalue())
+
+
+def generate(name, storage=default_storage, force=False):
+    """Makes the copies of one picture. Returns the names written."""
+    if not name or (not force and has_variants(name, storage)):
+        return []
+    with storage.open(name, 'rb') as original:
+        image = Image.open(original)
+        image = ImageOps.exif_transpose(image)
+        image.load()
+
+    written = []
+    for width in WIDTHS:
+        resized = image.copy()
+        resized.thumbnail((width, width * 10), Image.LANCZOS)
+        for extension in ('webp', fallback_format(name)):
+            target = variant_name(name, width, extension)
+            if storage.exists(target):
+                storage.delete(target)
+            written.append(storage.save(target, _encode(resized, extension)))
+    return written
+
+
+def srcset(name, extension, storage=default_storage):
+    return ', '.join(f'{storage.url(variant_name(name, width, extension))} {width}w' for width in WIDTHS)
+
+
+def _set_status(model, pk, status):
+    # attachments record how their processing went; other models have nowhere to put it
+    if any(field.name == 'status' for field in model._meta.fields):
+        model.objects.filter(pk=pk).update(status=status)
+
+
+def thumbnails_failed(model_label, pk):
+    _set_status(apps.get_model(model_label), pk, 'failed')
+
+
+@jobs.task('make_thumbnails', on_failure=thumbnails_failed)
+def make_thumbnails(model_label, pk):
+    model = apps.get_model(model_label)
+    instance = model.objects.filter(pk=pk).first()
+    if instance is None:
+        # deleted before a worker got to it
+        return
+    field_file = getattr(instance, IMAGE_FIELDS[model])
+    if field_file:
+        try:
+            generate(field_file.name, field_file.storage)
+        except (Image.UnidentifiedImageError, Image.DecompressionBombError):
+            # not a picture Pillow can read, which trying again won't change; the original is shown as it is
+            logger.warning("could not make thumbnails of %s", field_file.name, exc_info=True)
+            _set_status(model, pk, 'failed')
+            return
+    _set_status(model, pk, 'ready')
+
+
+def picture_saving(sender, instance, **kwargs):
+    # a newly uploaded file is only written to storage later in save(), so note it now
+    field_file = getattr(instance, IMAGE_FIELDS[sender])
+    instance._new_picture = bool(field_file) and not field_file._committed
+
+
+def picture_saved(sender, instance, created=False, **kwargs):
+    if getattr(instance, '_new_picture', False):
+        instance._new_picture = False
+        jobs.enqueue('make_thumbnails', sender._meta.label, instance.pk)
+    elif created and not getattr(instance, IMAGE_FIELDS[sender]):
+        # nothing to make copies of, so no job will ever say it's done
+        _set_status(sender, instance.pk, 'ready')
+
+
+def original_deleting(sender, file, **kwargs):
+    # file.name is gone by the time cleanup_post_delete is sent
+    file._thumbnails_of = file.name
+
+
+def original_deleted(sender, file, **kwargs):
+    name = getattr(file, '_thumbnails_of', None)
+    # a shared original can outlive the row (see storage.py), and then so do its copies
+    if name and not file.storage.exists(name):
+        for variant in variant_names(name):
+            file.storage.delete(variant)
+
+
+def blob_deleted(sender, name, **kwargs):
+    # blobs are removed later, by a job, see storage.py
+    for variant in variant_names(name):
+        default_storage.delete(variant)
+
+
+def connect_signals():
+    for model in IMAGE_FIELDS:
+        pre_save.connect(picture_saving, sender=model, dispatch_uid=f'thumbnails.{model.__name__}_saving')
+        post_save.connect(picture_saved, sender=model, dispatch_uid=f'thumbnails.{model.__name__}')
+    cleanup_pre_delete.connect(original_deleting, dispatch_uid='thumbnails.original_deleting')
+    cleanup_post_delete.connect(original_deleted, dispatch_uid='thumbnails.original_deleted')
+    storage.blob_deleted.connect(blob_deleted, dispatch_uid='thumbnails.blob_deleted')
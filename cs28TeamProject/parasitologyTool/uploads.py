@@ -0,0 +1,92 @@
+"""
+Upload handling for the add post pages.
+
+Django's default handlers keep small files in memory and copy large ones
+through a temporary file. StreamingUploadHandler writes every file to a
+temporary file in FILE_UPLOAD_TEMP_DIR chunk by chunk (so the storage can
+move it into place rather than copy it, as long as both are on the same
+disk), computes its SHA-256 on the way, and enforces the limits below while
+the request is still being read:
+
+* a request bigger than UPLOAD_MAX_REQUEST_BYTES is refused before any of
+  it is read (by the streaming_uploads decorator),
+* a file with an extension its form field doesn't accept is skipped as
+  soon as its headers arrive,
+* a file is dropped as soon as it grows past UPLOAD_MAX_FILE_BYTES.
+
+What was refused is listed in request.upload_errors for the view to show.
+"""
+
+import hashlib
+import posixpath
+from functools import wraps
+
+from django.conf import settings
+from django.core.files.uploadhandler import SkipFile, TemporaryFileUploadHandler
+from django.http import HttpResponse
+from django.template.defaultfilters import filesizeformat
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+
+MAX_FILE_BYTES = getattr(settings, 'UPLOAD_MAX_FILE_BYTES', 50 * 1024 * 1024)
+MAX_REQUEST_BYTES = getattr(settings, 'UPLOAD_MAX_REQUEST_BYTES', 200 * 1024 * 1024)
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp', '.tif', '.tiff'}
+# form field: the extensions it accepts
+ALLOWED_EXTENSIONS = getattr(settings, 'UPLOAD_ALLOWED_EXTENSIONS', {
+    'images': IMAGE_EXTENSIONS,
+    'files': IMAGE_EXTENSIONS | {'.pdf', '.txt', '.csv', '.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx', '.zip'},
+})
+
+
+class StreamingUploadHandler(TemporaryFileUploadHandler):
+    def __init__(self, request=None, max_file_bytes=None, allowed_extensions=None):
+        super().__init__(request)
+        self.max_file_bytes = max_file_bytes or MAX_FILE_BYTES
+        self.allowed_extensions = allowed_extensions or ALLOWED_EXTENSIONS
+        self.errors = []
+        if request is not None:
+            request.upload_errors = self.errors
+
+    def new_file(self, field_name, file_name, *args, **kwargs):
+        extension = posixpath.splitext(file_name)[1].lower()
+        allowed = self.allowed_extensions.get(field_name)
+        if allowed is not None and extension not in allowed:
+            self.errors.append(f"{file_name} is not a file type that can be uploaded here.")
+            # the parser closes self.file when a file is skipped, which must not be the previous upload
+            self.__dict__.pop('file', None)
+            raise SkipFile
+        super().new_file(field_name, file_name, *args, **kwargs)
+        self.sha256 = hashlib.sha256()
+        self.received = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > self.max_file_bytes:
+            self.errors.append(f"{self.file_name} is too big; the limit is {filesizeformat(self.max_file_bytes)}.")
+            raise SkipFile
+        self.sha256.update(raw_data)
+        self.file.write(raw_data)
+
+    def file_complete(self, file_size):
+        uploaded = super().file_complete(file_size)
+        uploaded.sha256 = self.sha256.hexdigest()
+        return uploaded
+
+
+def streaming_uploads(view):
+    """
+    Makes a view read its uploads with StreamingUploadHandler, and refuses
+    requests over UPLOAD_MAX_REQUEST_BYTES without reading them. The CSRF
+    check reads the request body, so it is moved to after the handler is
+    set up.
+    """
+    protected = csrf_protect(view)
+
+    @wraps(view)
+    def wrap(request, *args, **kwargs):
+        if int(request.META.get('CONTENT_LENGTH') or 0) > MAX_REQUEST_BYTES:
+            return HttpResponse(f"The upload is too big; the limit is {filesizeformat(MAX_REQUEST_BYTES)}.",
+                                status=413)
+        request.upload_handlers = [StreamingUploadHandler(request)]
+        return protected(request, *args, **kwargs)
+    return csrf_exempt(wrap)
@@ -1,10 +1,18 @@
+from django.conf import settings
 from django.conf.urls import url
-from parasitologyTool import views
+from parasitologyTool import async_views, views
 from django.urls import path
 
 
 app_name = 'parasitologyTool'
 
+# the busiest AJAX endpoints, async when served over ASGI, see async_views.py
+if settings.ASYNC_VIEWS:
+    add_like, add_dislike, comment_reply = async_views.add_like, async_views.add_dislike, async_views.comment_reply
+else:
+    add_like, add_dislike, comment_reply = (views.AddLike.as_view(), views.AddDislike.as_view(),
+                                            views.CommentReplyView.as_view())
+
 urlpatterns = [
     path('', views.index, name='index'),
     path('about/', views.about, name='about'),
@@ -13,26 +21,38 @@ urlpatterns = [
     path('login/', views.user_login, name='login'),
     path('logout/', views.user_logout, name='logout'),
     path('public_content/', views.public_content, name='public_content'),
+    path('public_content/articles/', views.more_articles, name='more_articles'),
     path('public_content/<int:parasite_id>/add_article/',views.add_article, name='add_article'),
     path('public_content/<int:parasite_id>/', views.public_parasite_page, name = 'public_parasite_page'),
+    path('public_content/<int:parasite_id>/articles/', views.more_parasite_articles, name='more_parasite_articles'),
     path('public_content/add_parasite/', views.add_parasite, name='add_parasite'),
     path('public_content/goto/', views.goto_parasite, name='goto'),
+    path('public_content/goto_article/', views.goto_article, name='goto_article'),
     path('clinical_portal/', views.clinical_portal, name = 'clinical_portal'),
     path('clinical_portal/<int:parasite_id>/', views.clinical_parasite_page, name = 'clinical_parasite_page'),
+    path('clinical_portal/<int:parasite_id>/posts/', views.more_clinical_posts, name='more_clinical_posts'),
     path('clinical_portal/<int:parasite_id>/add_post/',views.add_post, name='add_post'),
     path('research_portal/', views.research_portal, name = 'research_portal'),
     path('research_portal/<int:parasite_id>/', views.research_parasite_page, name = 'research_parasite_page'),
+    path('research_portal/<int:parasite_id>/posts/', views.more_research_posts, name='more_research_posts'),
     path('profile/<username>/', views.ProfileView.as_view(), name='profile'),
     path('research_portal/<int:parasite_id>/add_post/',views.add_research_post, name='add_research_post'),
     path('research_portal/<int:parasite_id>/<int:post_id>',views.research_post_page, name='research_post_page'),
     path('clinical_portal/<int:parasite_id>/<int:post_id>',views.clinical_post_page, name='clinical_post_page'),
+    path('research_portal/<int:parasite_id>/<int:post_id>/comments/',views.more_research_comments, name='more_research_comments'),
+    path('clinical_portal/<int:parasite_id>/<int:post_id>/comments/',views.more_clinical_comments, name='more_clinical_comments'),
     path('like_post/',views.LikePostView.as_view(), name='like_post'),
     path('search_results/', views.SearchResults, name='search_results'),
+    path('search_results/autocomplete/', views.autocomplete_users, name='autocomplete_users'),
     path('manage_user/<username>/', views.AdminManage, name='admin_manage'),
+    path('cache_stats/', views.cache_stats, name='cache_stats'),
     path('search/', views.SearchPage, name='search_page'),
+    path('search/content/', views.content_search, name='content_search'),
     path('user_posts/<username>/',views.UserPost, name='user_posts'),
+    path('user_posts/<username>/more/',views.more_user_posts, name='more_user_posts'),
     path('delete_post/<int:post_id>/<username>/',views.DeletePost, name='delete_post'),
-    path('research_portal/<str:post_model>/<int:post_id>/like',views.AddLike.as_view(), name='like'),
-    path('research_portal/<str:post_model>/<int:post_id>/dislike',views.AddDislike.as_view(), name='dislike'),
-    path('post/<int:post_id>/comment/<int:comment_id>/reply', views.CommentReplyView.as_view(), name="comment-reply"),
+    path('research_portal/<str:post_model>/<int:post_id>/like', add_like, name='like'),
+    path('research_portal/<str:post_model>/<int:post_id>/dislike', add_dislike, name='dislike'),
+    path('post/<int:post_id>/comment/<int:comment_id>/reply', comment_reply, name="comment-reply"),
+    path('comment/<int:comment_id>/replies/', views.comment_replies, name='comment_replies'),
 ]
\ No newline at end of file
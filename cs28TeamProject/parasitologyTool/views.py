@@ -1,8 +1,16 @@
 from django.shortcuts import render
 
+from parasitologyTool import attachments, metrics, objcache, permissions, ranking, reactions, search, view_counts
 from parasitologyTool.decorators import clinicians_only, clinicians_researchers_only
+from parasitologyTool.feeds import clinical_feed, comment_thread, reply_page, research_feed, with_replies
+from parasitologyTool.middleware import get_profile
+from parasitologyTool.page_cache import cache_public_page
+from parasitologyTool.pagination import InvalidCursor, paginate, paginate_merged
+from parasitologyTool.uploads import streaming_uploads
 from .models import *
-from django.http import JsonResponse, HttpResponse, HttpResponseRedirect
+from django.http import JsonResponse, HttpResponse, HttpResponseRedirect, HttpResponseBadRequest, Http404
+from django.db import transaction
+from django.template.loader import render_to_string
 from .forms import *
 from django.shortcuts import redirect
 from django.contrib.auth import authenticate, login, logout
@@ -13,14 +21,22 @@ from django.views import View, generic
 from django.utils.decorators import method_decorator
 from django.forms import formset_factory
 from django.contrib.auth.mixins import LoginRequiredMixin
-from itertools import chain
+from urllib.parse import urlsplit
 
 
+def more_response(request, template, context_dict, page):
+    # the JSON answer to a "load more" request: the next page rendered, and where to continue from
+    context_dict['next_cursor'] = page.next_cursor
+    return JsonResponse({'html': render_to_string(template, context_dict, request=request),
+                         'next_cursor': page.next_cursor})
+
+
+@cache_public_page
 def index(request):
     parasite_list = Parasite.objects.order_by('name')
     context_dict = {'parasites': parasite_list}
     if (request.user.is_authenticated):
-        context_dict['user_profile'] = UserProfile.objects.get(user=request.user)
+        context_dict['user_profile'] = get_profile(request)
 
     return render(request, 'parasitologyTool/index.html', context=context_dict)
 
@@ -29,19 +45,31 @@ def about(request):
     return render(request, 'parasitologyTool/about.html')
 
 
+@cache_public_page
 def public_content(request):
     context_dict = {}
 
     parasite_list = Parasite.objects.order_by('name')
     top_viewed_parasite = Parasite.objects.order_by('-views')[:5]
-    article_list = Article.objects.order_by('views')
+    page = objcache.cached_page('article', paginate(Article.objects.only('id', 'date_posted')))
     context_dict['parasites'] = parasite_list
-    context_dict['articles'] = article_list
+    context_dict['articles'] = page.items
+    context_dict['next_cursor'] = page.next_cursor
     context_dict['top_viewed_parasite'] = top_viewed_parasite
 
     return render(request, 'parasitologyTool/public_content.html', context=context_dict)
 
 
+def more_articles(request):
+    try:
+        page = objcache.cached_page('article', paginate(Article.objects.only('id', 'date_posted'),
+                                                         request.GET.get('cursor')))
+    except InvalidCursor:
+        return HttpResponseBadRequest("invalid cursor")
+
+    return more_response(request, 'parasitologyTool/article_list.html', {'articles': page.items}, page)
+
+
 def add_parasite(request):
     form = ParasiteForm()
 
@@ -73,7 +101,7 @@ def add_article(request, parasite_id):
         if form.is_valid():
             article = form.save(commit=False)
             article.parasite = parasite
-            article.user = UserProfile.objects.get(user = request.user)
+            article.user = get_profile(request)
             article.save()
             return redirect(reverse("parasitologyTool:public_parasite_page", kwargs={'parasite_id':
                                                                                          parasite_id}))
@@ -84,6 +112,7 @@ def add_article(request, parasite_id):
     return render(request, 'parasitologyTool/add_article.html', context=context_dict)
 
 
+@streaming_uploads
 @login_required
 @clinicians_only
 def add_post(request, parasite_id):
@@ -96,14 +125,18 @@ def add_post(request, parasite_id):
     if request.method == 'POST':
         form = PostForm(request.POST)
         images = request.FILES.getlist('images')
+        for error in getattr(request, 'upload_errors', []):
+            form.add_error(None, error)
         if form.is_valid():
             post = form.save(commit=False)
             post.parasite = parasite
-            post.user = UserProfile.objects.get(user=request.user)
+            post.user = get_profile(request)
             #post.likes = 0
-            post.save()
-            for image in images:
-                ClinicalImage.objects.create(clinical_post=post, image=image, )
+            with transaction.atomic():
+                post.save()
+                attachments.create_all(post, images)
+            metrics.INTERACTIONS.inc(kind='clinical_post')
+            metrics.uploads_added('image', images)
             return redirect(reverse("parasitologyTool:clinical_parasite_page", args=[parasite_id]))
         else:
             print(form.errors)
@@ -111,36 +144,66 @@ def add_post(request, parasite_id):
     return render(request, 'parasitologyTool/add_post.html', {'form': form})
 
 
+@cache_public_page
 def public_parasite_page(request, parasite_id):
     context_dict = {}
     try:
-        parasite = Parasite.objects.get(id=parasite_id)
-        article_list = parasite.article_set.all();
+        parasite = objcache.get('parasite', parasite_id)
     except Parasite.DoesNotExist:
         return not_found(request)
 
+    page = objcache.cached_page('article', paginate(Article.objects.filter(parasite_id=parasite.id)
+                                                     .only('id', 'date_posted')))
     context_dict['parasite'] = parasite
-    context_dict['articles'] = article_list
+    context_dict['articles'] = page.items
+    context_dict['next_cursor'] = page.next_cursor
     context_dict['intro'] = parasite.intro
     return render(request, 'parasitologyTool/public_parasite_page.html', context=context_dict)
 
 
+def more_parasite_articles(request, parasite_id):
+    articles = Article.objects.filter(parasite_id=parasite_id).only('id', 'date_posted')
+    try:
+        page = objcache.cached_page('article', paginate(articles, request.GET.get('cursor')))
+    except InvalidCursor:
+        return HttpResponseBadRequest("invalid cursor")
+
+    return more_response(request, 'parasitologyTool/article_list.html', {'articles': page.items}, page)
+
+
 def goto_parasite(request):
     if request.method == 'GET':
         parasite_id = request.GET.get('parasite_id')
 
         try:
-            selected_parasite = Parasite.objects.get(id=parasite_id)
-        except Parasite.DoesNotExist:
+            selected_parasite = Parasite.objects.only('id').get(id=parasite_id)
+        except (Parasite.DoesNotExist, ValueError):
             return redirect(reverse('parasitologyTool:public_content'))
 
-        selected_parasite.views = selected_parasite.views + 1
-        selected_parasite.save()
+        view_counts.record(Parasite, selected_parasite.id)
 
         return redirect(reverse('parasitologyTool:public_parasite_page', args=[parasite_id]))
     return redirect(reverse('parasitologyTool:public_content'))
 
 
+def goto_article(request):
+    if request.method == 'GET':
+        article_id = request.GET.get('article_id')
+
+        try:
+            selected_article = objcache.get('article', article_id)
+        except Article.DoesNotExist:
+            return redirect(reverse('parasitologyTool:public_content'))
+
+        # articles saved before the scheme was checked may link anywhere
+        if urlsplit(selected_article.url).scheme.lower() not in Article.URL_SCHEMES:
+            return redirect(reverse('parasitologyTool:public_content'))
+        view_counts.record(Article, selected_article.id)
+
+        return redirect(selected_article.url)
+    return redirect(reverse('parasitologyTool:public_content'))
+
+
 class ProfileView(View):
     def get_user_details(self, username):
         try:
@@ -250,8 +313,6 @@ def user_logout(request):
 @login_required
 @clinicians_only
 def clinical_portal(request):
-    if UserProfile.objects.get(user=request.user).role != 'clinician':
-        return HttpResponse("you are not authorised to view this page")
     context_dict = {}
     parasite_list = Parasite.objects.order_by('name')
     context_dict['parasite_list'] = parasite_list
@@ -274,36 +335,62 @@ def clinical_parasite_page(request, parasite_id):
     context_dict = {}
     try:
         parasite = Parasite.objects.get(id=parasite_id)
-        posts = parasite.post_set.all()
     except Parasite.DoesNotExist:
         return not_found(request)
 
-    pop_posts = Post.objects.order_by('-likes')[:5]
+    page = paginate(clinical_feed(parasite.post_set.all()))
+    pop_posts = ranking.top_posts(parasite, 'clinical')
 
     context_dict['parasite'] = parasite
-    context_dict['posts'] = posts
+    context_dict['posts'] = page.items
+    context_dict['next_cursor'] = page.next_cursor
     context_dict['pop_posts'] = pop_posts
     return render(request, 'parasitologyTool/clinical_parasite_page.html', context=context_dict)
 
 
+@login_required
+@clinicians_only
+def more_clinical_posts(request, parasite_id):
+    try:
+        page = paginate(clinical_feed(Post.objects.filter(parasite_id=parasite_id)), request.GET.get('cursor'))
+    except InvalidCursor:
+        return HttpResponseBadRequest("invalid cursor")
+
+    return more_response(request, 'parasitologyTool/clinical_post_list.html', {'posts': page.items}, page)
+
+
 @login_required
 @clinicians_researchers_only
 def research_parasite_page(request, parasite_id):
     context_dict = {}
     try:
         parasite = Parasite.objects.get(id=parasite_id)
-        research_posts = parasite.researchpost_set.all()
     except Parasite.DoesNotExist:
         return not_found(request)
 
-    pop_posts = ResearchPost.objects.order_by('-likes')[:5]
+    page = paginate(research_feed(parasite.researchpost_set.all()))
+    pop_posts = ranking.top_posts(parasite, 'research')
 
     context_dict['parasite'] = parasite
-    context_dict['research_posts'] = research_posts
+    context_dict['research_posts'] = page.items
+    context_dict['next_cursor'] = page.next_cursor
     context_dict['pop_posts'] = pop_posts
     return render(request, 'parasitologyTool/research_parasite_page.html', context=context_dict)
 
 
+@login_required
+@clinicians_researchers_only
+def more_research_posts(request, parasite_id):
+    posts = research_feed(ResearchPost.objects.filter(parasite_id=parasite_id))
+    try:
+        page = paginate(posts, request.GET.get('cursor'))
+    except InvalidCursor:
+        return HttpResponseBadRequest("invalid cursor")
+
+    return more_response(request, 'parasitologyTool/research_post_list.html', {'posts': page.items}, page)
+
+
+@streaming_uploads
 @login_required
 @clinicians_researchers_only
 def add_research_post(request, parasite_id):
@@ -317,15 +404,18 @@ def add_research_post(request, parasite_id):
         form = ResearchPostForm(request.POST)
         images = request.FILES.getlist('images')
         files = request.FILES.getlist('files')
+        for error in getattr(request, 'upload_errors', []):
+            form.add_error(None, error)
         if form.is_valid():
             post = form.save(commit=False)
             post.parasite = parasite
-            post.user = UserProfile.objects.get(user=request.user)
-            post.save()
-            for image in images:
-                ResearchImage.objects.create(research_post=post, image=image, )
-            for file in files:
-                ResearchFile.objects.create(research_post=post, file=file, )
+            post.user = get_profile(request)
+            with transaction.atomic():
+                post.save()
+                attachments.create_all(post, images, files)
+            metrics.INTERACTIONS.inc(kind='research_post')
+            metrics.uploads_added('image', images)
+            metrics.uploads_added('file', files)
             return redirect(reverse("parasitologyTool:research_parasite_page", args=[parasite_id]))
         else:
             print(form.errors)
@@ -337,12 +427,15 @@ def add_research_post(request, parasite_id):
 @clinicians_researchers_only
 def research_post_page(request, parasite_id, post_id):
     try:
-        post = ResearchPost.objects.get(id=post_id)
+        post = objcache.get('research_post', post_id)
     except ResearchPost.DoesNotExist:
         return not_found(request)
 
+    page = paginate(comment_thread(post.comment_set.all()))
     context_dict = {}
     context_dict['post'] = post
+    context_dict['comments'] = with_replies(page.items)
+    context_dict['next_cursor'] = page.next_cursor
 
     comment_form = CommentForm()
     reply_form = ReplyForm()
@@ -353,8 +446,9 @@ def research_post_page(request, parasite_id, post_id):
         if comment_form.is_valid():
             comment = comment_form.save(commit=False)
             comment.research_post = post
-            comment.user = UserProfile.objects.get(user=request.user)
+            comment.user = get_profile(request)
             comment.save()
+            metrics.INTERACTIONS.inc(kind='comment')
             return redirect(reverse("parasitologyTool:research_post_page", args=[parasite_id, post_id]))
         else:
             print(comment_form.errors)
@@ -364,6 +458,21 @@ def research_post_page(request, parasite_id, post_id):
     return render(request, 'parasitologyTool/research_post_page.html', context=context_dict)
 
 
+@login_required
+@clinicians_researchers_only
+def more_research_comments(request, parasite_id, post_id):
+    try:
+        post = ResearchPost.objects.get(id=post_id)
+        page = paginate(comment_thread(post.comment_set.all()), request.GET.get('cursor'))
+    except ResearchPost.DoesNotExist:
+        raise Http404("Post not found.")
+    except InvalidCursor:
+        return HttpResponseBadRequest("invalid cursor")
+
+    context_dict = {'post': post, 'comments': with_replies(page.items), 'reply_form': ReplyForm()}
+    return more_response(request, 'parasitologyTool/comment_list.html', context_dict, page)
+
+
 class LikePostView(View):
     @method_decorator(login_required)
     def get(self, request):
@@ -386,14 +495,15 @@ class LikePostView(View):
 @clinicians_only
 def clinical_post_page(request, parasite_id, post_id):
     try:
-        post = Post.objects.get(id=post_id)
-    except ResearchPost.DoesNotExist:
+        post = objcache.get('clinical_post', post_id)
+    except Post.DoesNotExist:
         return not_found(request)
 
-
-
+    page = paginate(comment_thread(post.comment_set.all()))
     context_dict = {}
     context_dict['post'] = post
+    context_dict['comments'] = with_replies(page.items)
+    context_dict['next_cursor'] = page.next_cursor
 
     comment_form = CommentForm()
     reply_form = ReplyForm()
@@ -404,8 +514,9 @@ def clinical_post_page(request, parasite_id, post_id):
         if comment_form.is_valid():
             comment = comment_form.save(commit=False)
             comment.clinical_post = post
-            comment.user = UserProfile.objects.get(user=request.user)
+            comment.user = get_profile(request)
             comment.save()
+            metrics.INTERACTIONS.inc(kind='comment')
             return redirect(reverse("parasitologyTool:clinical_post_page", args=[parasite_id, post_id]))
         else:
             print(comment_form.errors)
@@ -415,38 +526,73 @@ def clinical_post_page(request, parasite_id, post_id):
     return render(request, 'parasitologyTool/clinical_post_page.html', context=context_dict)
 
 
+@login_required
+@clinicians_only
+def more_clinical_comments(request, parasite_id, post_id):
+    try:
+        post = Post.objects.get(id=post_id)
+        page = paginate(comment_thread(post.comment_set.all()), request.GET.get('cursor'))
+    except Post.DoesNotExist:
+        raise Http404("Post not found.")
+    except InvalidCursor:
+        return HttpResponseBadRequest("invalid cursor")
+
+    context_dict = {'post': post, 'comments': with_replies(page.items), 'reply_form': ReplyForm()}
+    return more_response(request, 'parasitologyTool/comment_list.html', context_dict, page)
+
+
 def SearchPage(request):
     return render(request, 'parasitologyTool/search_page.html')
 
-@login_required
-def SearchResults(request):
-    query = request.GET.get('q')
-    object_list = User.objects.filter(username__icontains=query)
-    user_list = []
-
-    for user in object_list:
-        user_list.append(UserProfile.objects.get(user=user))
 
+def content_search(request):
+    query = request.GET.get('q', '').strip()
     try:
-        cur_user = UserProfile.objects.get(user=request.user)
-        if cur_user.role == 'admin':
-            is_admin = True
-        else:
-            is_admin = False
-    except:
+        page_number = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        return HttpResponseBadRequest("invalid page")
+
+    page = search.search(request.user, query, page_number)
+    context_dict = {'query': query, 'results': page.results, 'page': page.page, 'has_next': page.has_next}
+    return render(request, 'parasitologyTool/content_search_results.html', context=context_dict)
+
+@login_required
+def SearchResults(request):
+    if permissions.user_role(request.user) is None:
         return index(request)
+    query = request.GET.get('q', '')
+    try:
+        page_number = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        return HttpResponseBadRequest("invalid page")
+
+    page = search.search_users(query, page_number)
+    is_admin = permissions.has_permission(request.user, 'manage_users')
 
-    context_dict = {"results": user_list, "is_admin": is_admin}
+    context_dict = {"results": page.results, "is_admin": is_admin, "query": query,
+                    "page": page.page, "has_next": page.has_next}
 
     return render(request, 'parasitologyTool/search_results.html', context=context_dict)
 
 
+@login_required
+def autocomplete_users(request):
+    if permissions.user_role(request.user) is None:
+        return JsonResponse({'usernames': []})
+    return JsonResponse({'usernames': search.autocomplete_users(request.GET.get('q', ''))})
+
+
+@permissions.permission_required('manage_users')
+def cache_stats(request):
+    # for the worker process that answers, see objcache.stats()
+    return JsonResponse({'objects': objcache.stats()})
+
+
 @login_required
 def AdminManage(request, username):
+    if not permissions.has_permission(request.user, 'manage_users'):
+        return index(request)
     try:
-        cur_user = UserProfile.objects.get(user=request.user)
-        if cur_user.role != 'admin':
-            return index(request)
         user_s = User.objects.get(username=username)
         user = UserProfile.objects.get(user=user_s)
     except UserProfile.DoesNotExist:
@@ -471,21 +617,45 @@ def AdminManage(request, username):
     return render(request, 'parasitologyTool/admin_manage.html', context=context_dict)
 
 
+def user_post_page(username, viewer, cursor=None):
+    user_s = User.objects.get(username=username)
+    user = UserProfile.objects.get(user=user_s)
+    # the posts link their attachments with signed URLs, so only those of portals the viewer may see
+    feeds = []
+    if permissions.has_portal_access(viewer, 'clinical'):
+        feeds.append(clinical_feed(user.post_set.all()))
+    if permissions.has_portal_access(viewer, 'research'):
+        feeds.append(research_feed(user.researchpost_set.all()))
+    return paginate_merged(feeds, cursor)
+
+
+@login_required
 def UserPost(request, username):
     try:
-        user_s = User.objects.get(username=username)
-        user = UserProfile.objects.get(user=user_s)
-        userpost1 = user.post_set.all()
-        user_posts = chain(userpost1, user.researchpost_set.all())
+        page = user_post_page(username, request.user)
     except User.DoesNotExist:
         return not_found(request)
 
     context_dict = {}
-    context_dict['user_posts'] = user_posts
+    context_dict['user_posts'] = page.items
+    context_dict['next_cursor'] = page.next_cursor
+    context_dict['username'] = username
 
     return render(request, 'parasitologyTool/user_posts.html', context=context_dict)
 
 
+@login_required
+def more_user_posts(request, username):
+    try:
+        page = user_post_page(username, request.user, request.GET.get('cursor'))
+    except User.DoesNotExist:
+        raise Http404("User not found.")
+    except InvalidCursor:
+        return HttpResponseBadRequest("invalid cursor")
+
+    return more_response(request, 'parasitologyTool/user_post_list.html', {'posts': page.items}, page)
+
+
 def DeletePost(request, post_id, username):
     user_s = User.objects.get(username=username)
     user = UserProfile.objects.get(user=user_s)
@@ -503,56 +673,57 @@ def DeletePost(request, post_id, username):
 
 class AddLike(LoginRequiredMixin, View):
     def post(self, request, post_model, post_id, *args, **kwargs):
-        if post_model == 'ResearchPost':
-            post = ResearchPost.objects.get(id=post_id)
-        else:
-            post = Post.objects.get(id=post_id)
-        print(post_model)
-        is_like = False
-
-        for like in post.likes.all():
-            if like == request.user:
-                is_like = True
-                break
-
-        if not is_like:
-            post.likes.add(request.user)
-
-        if is_like:
-            post.likes.remove(request.user)
+        model = reactions.post_model(post_model)
+        try:
+            likes, dislikes, added = reactions.toggle(model, post_id, request.user, 'likes')
+        except model.DoesNotExist:
+            return JsonResponse({'message': "Post not found."}, status=404)
+        if added:
+            metrics.INTERACTIONS.inc(kind='like')
 
         data = {'message': "Successfully liked post.",
-                'likes': post.likes.all().count(),
-                'dislikes': post.dislikes.all().count()}
+                'likes': likes,
+                'dislikes': dislikes}
         return JsonResponse(data)
 
 
 class AddDislike(LoginRequiredMixin, View):
     def post(self, request, post_model, post_id, *args, **kwargs):
-        if post_model == 'ResearchPost':
-            post = ResearchPost.objects.get(id=post_id)
-        else:
-            post = Post.objects.get(id=post_id)
-
-        is_dislike = False
-
-        for dislike in post.dislikes.all():
-            if dislike == request.user:
-                is_dislike = True
-                break
-
-        if not is_dislike:
-            post.dislikes.add(request.user)
-
-        if is_dislike:
-            post.dislikes.remove(request.user)
+        model = reactions.post_model(post_model)
+        try:
+            likes, dislikes, added = reactions.toggle(model, post_id, request.user, 'dislikes')
+        except model.DoesNotExist:
+            return JsonResponse({'message': "Post not found."}, status=404)
+        if added:
+            metrics.INTERACTIONS.inc(kind='dislike')
 
         data = {'message': "Successfully disliked post.",
-                'dislikes': post.dislikes.all().count(),
-                'likes': post.likes.all().count()}
+                'dislikes': dislikes,
+                'likes': likes}
         return JsonResponse(data)
 
-class CommentReplyView(View):
+@login_required
+def comment_replies(request, comment_id):
+    try:
+        comment = Comment.objects.only('clinical_post_id', 'research_post_id').get(id=comment_id)
+        after = int(request.GET.get('after', 0))
+    except Comment.DoesNotExist:
+        raise Http404("Comment not found.")
+    except ValueError:
+        return HttpResponseBadRequest("invalid reply id")
+    portal = 'clinical' if comment.clinical_post_id else 'research'
+    if not permissions.has_portal_access(request.user, portal):
+        return permissions.not_authorised()
+
+    replies, has_more = reply_page(comment_id, after)
+    return JsonResponse({
+        'replies': [{'id': reply.id, 'username': reply.user.username if reply.user else '', 'reply_text': reply.reply_text}
+                    for reply in replies],
+        'has_more': has_more,
+    })
+
+
+class CommentReplyView(LoginRequiredMixin, View):
     def post(self, request, post_id, comment_id, *args, **kwargs):
         #post = ResearchPost.objects.get(id=post_id)
         parent_comment = Comment.objects.get(id=comment_id)
@@ -562,9 +733,10 @@ class CommentReplyView(View):
         if form.is_valid():
             new_comment = form.save(commit=False)
             new_comment.parent_comment = parent_comment
-            new_comment.user = UserProfile.objects.get(user=request.user)
+            new_comment.user = get_profile(request)
             new_comment.save()
-            data = {'reply_text': request.POST['reply_text'], 'comment_id':comment_id, 'username': new_comment.user.username}
+            metrics.INTERACTIONS.inc(kind='reply')
+            data = {'reply_text': request.POST['reply_text'], 'comment_id':comment_id, 'username': new_comment.user.username if new_comment.user else ''}
             return JsonResponse(data)
         else:
             return JsonResponse({'message':'failed'})
@@ -6,10 +6,12 @@ import django
 
 django.setup()
 from parasitologyTool.models import Parasite
+from parasitologyTool.seeding import PARASITE_NAMES
 
 
+# for a database at production scale (thousands of posts, comments and likes) use `manage.py seed_data`
 def populate():
-    parasites = ['Trypanosoma', 'Plasmodium', 'Leishmania', 'Toxoplasma', 'Helminths']
+    parasites = PARASITE_NAMES
     for p in parasites:
         c = add_parasite(p)
 
@@ -1,10 +1,56 @@
+// Comment threads show their first few replies; the rest are fetched from the
+// comment's replies URL, a page at a time, when the thread is expanded.
+function loadReplies(link) {
+    if (link.disabled) {
+        return;
+    }
+    link.disabled = true;
+
+    var url = link.getAttribute('data-url') + '?after=' + encodeURIComponent(link.getAttribute('data-after'));
+    fetch(url, {credentials: 'same-origin', headers: {'X-Requested-With': 'XMLHttpRequest'}})
+        .then(function (response) {
+            return response.json();
+        })
+        .then(function (data) {
+            var list = link.parentNode.querySelector('.replies');
+            data.replies.forEach(function (reply) {
+                var item = document.createElement('li');
+                var name = document.createElement('b');
+                name.textContent = reply.username;
+                item.appendChild(name);
+                item.appendChild(document.createTextNode(': ' + reply.reply_text));
+                list.appendChild(item);
+            });
+            if (data.has_more && data.replies.length) {
+                link.setAttribute('data-after', data.replies[data.replies.length - 1].id);
+                link.textContent = 'more replies';
+                link.disabled = false;
+            } else {
+                link.parentNode.removeChild(link);
+            }
+        })
+        .catch(function (error) {
+            console.log(error);
+            link.disabled = false;
+        });
+}
+
 function expandToggle(parent_id){
-                
+
     const row = document.getElementById('reply-'+parent_id)
 
     if (row.classList.contains('d-none')){
         row.classList.remove('d-none');
     } else {
         row.classList.add('d-none');
-    }           
-}
\ No newline at end of file
+    }
+}
+
+document.addEventListener('click', function (event) {
+    var link = event.target.closest('.more-replies');
+    if (!link) {
+        return;
+    }
+    event.preventDefault();
+    loadReplies(link);
+});
@@ -0,0 +1,31 @@
+// "load more" buttons: fetch the next page of a listing and append it to data-target
+document.addEventListener('click', function (event) {
+    var button = event.target.closest('.load-more');
+    if (!button) {
+        return;
+    }
+    event.preventDefault();
+    button.disabled = true;
+
+    var url = button.getAttribute('data-url') + '?cursor=' + encodeURIComponent(button.getAttribute('data-cursor'));
+    fetch(url, {credentials: 'same-origin', headers: {'X-Requested-With': 'XMLHttpRequest'}})
+        .then(function (response) {
+            return response.json();
+        })
+        .then(function (data) {
+            document.querySelector(button.getAttribute('data-target')).insertAdjacentHTML('beforeend', data.html);
+            if (window.feather) {
+                feather.replace();
+            }
+            if (data.next_cursor) {
+                button.setAttribute('data-cursor', data.next_cursor);
+                button.disabled = false;
+            } else {
+                button.parentNode.removeChild(button);
+            }
+        })
+        .catch(function (error) {
+            console.log(error);
+            button.disabled = false;
+        });
+});
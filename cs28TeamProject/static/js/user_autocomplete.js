@@ -0,0 +1,37 @@
+// type-ahead for the user search box: fills its datalist with matching usernames
+(function () {
+    var input = document.querySelector('.user-autocomplete');
+    if (!input) {
+        return;
+    }
+    var list = document.getElementById(input.getAttribute('list'));
+    var timer = null;
+
+    input.addEventListener('input', function () {
+        clearTimeout(timer);
+        var prefix = input.value.trim();
+        if (!prefix) {
+            list.innerHTML = '';
+            return;
+        }
+        // wait for a pause in typing rather than asking on every key
+        timer = setTimeout(function () {
+            var url = input.getAttribute('data-url') + '?q=' + encodeURIComponent(prefix);
+            fetch(url, {credentials: 'same-origin', headers: {'X-Requested-With': 'XMLHttpRequest'}})
+                .then(function (response) {
+                    return response.json();
+                })
+                .then(function (data) {
+                    list.innerHTML = '';
+                    data.usernames.forEach(function (username) {
+                        var option = document.createElement('option');
+                        option.value = username;
+                        list.appendChild(option);
+                    });
+                })
+                .catch(function (error) {
+                    console.log(error);
+                });
+        }, 150);
+    });
+})();